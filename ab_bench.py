@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import run_db
+
+# A/B comparison of two server binaries. For every configuration (a string of
+# main.py options) the binaries are run in ABBA order, so slow drift of the box
+# hits both equally, and every metric is compared with Welch's t-test. A
+# candidate that is significantly worse than the baseline by more than a gate's
+# threshold fails the comparison (exit code 1).
+#
+# Trials run on a serving testbed (--testbed testbed.sock) or as one main.py
+# process each. Every trial is recorded in runs.db under the label
+# ab-<session>-A / ab-<session>-B.
+
+# metric -> True if higher is better
+METRICS = {
+    "tps": True,
+    "loss": False,
+    "jain": True,
+    "ceiling_fraction": True,
+}
+
+
+def betainc(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_fraction(a, b, x) / a
+    return 1.0 - front * _beta_fraction(b, a, 1 - x) / b
+
+
+def _beta_fraction(a: float, b: float, x: float) -> float:
+    # continued fraction of the incomplete beta function, modified Lentz's method
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return h
+
+
+def t_two_sided_p(t: float, df: float) -> float:
+    """P(|T| >= |t|) for Student's t with df degrees of freedom."""
+    return betainc(df / 2, 0.5, df / (df + t * t))
+
+
+def t_critical(df: float, confidence: float = 0.95) -> float:
+    lo, hi = 0.0, 1e3
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if t_two_sided_p(mid, df) > 1 - confidence:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def describe(values: list[float], confidence: float = 0.95) -> dict:
+    """Mean, sample standard deviation and confidence interval half-width."""
+    n = len(values)
+    mean = sum(values) / n if n else float("nan")
+    if n < 2:
+        return {"n": n, "mean": mean, "std": float("nan"), "ci": float("nan")}
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    return {"n": n, "mean": mean, "std": std, "ci": t_critical(n - 1, confidence) * std / math.sqrt(n)}
+
+
+def welch(a: dict, b: dict) -> float:
+    """Two-sided p-value of Welch's t-test from describe() results."""
+    if a["n"] < 2 or b["n"] < 2:
+        return float("nan")
+    va, vb = a["std"] ** 2 / a["n"], b["std"] ** 2 / b["n"]
+    if va + vb == 0:
+        return 1.0 if a["mean"] == b["mean"] else 0.0
+    t = (b["mean"] - a["mean"]) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va**2 / (a["n"] - 1) + vb**2 / (b["n"] - 1))
+    return t_two_sided_p(t, df)
+
+
+def run_trial(args, binary: str, label: str, config: list[str]) -> int:
+    """One run of `binary` with the options of `config`, returns its runs.db id."""
+    argv = ["--server", binary, "--label", label] + config
+    if os.path.exists("results/run_id"):
+        os.remove("results/run_id")
+    if args.testbed:
+        from testbed import request  # pulls in mininet, only needed here
+
+        reply = request(args.testbed, {"cmd": "run", "argv": argv})
+        if not reply["ok"]:
+            raise RuntimeError(f"testbed run failed: {reply['error']}")
+    else:
+        subprocess.run([sys.executable, "main.py", args.hosts] + argv, check=True)
+    return int(open("results/run_id").read())
+
+
+def trial_metrics(run_id: int) -> dict[str, float]:
+    run = run_db.query_runs(id=run_id)[0]
+    rows = run_db.query_results(id=run_id)
+    metrics = {
+        "tps": run["server_tps"],
+        "loss": 1 - run["total_got"] / run["total_sent"] if run["total_sent"] else float("nan"),
+        "jain": run["jain"] if run["jain"] is not None else float("nan"),
+    }
+    if run["ceiling_tps"]:
+        metrics["ceiling_fraction"] = run["server_tps"] / run["ceiling_tps"]
+    tiers: dict[int, int] = {}
+    for row in rows:
+        tiers[row["stake"]] = tiers.get(row["stake"], 0) + row["got"]
+    for stake, got in sorted(tiers.items()):
+        metrics[f"share_stake_{stake}"] = got / run["total_got"] if run["total_got"] else float("nan")
+    return metrics
+
+
+def compare(a: list[dict], b: list[dict], confidence: float) -> dict[str, dict]:
+    """Per metric: baseline and candidate statistics, relative change and p-value."""
+    report = {}
+    names = [name for name in a[0] if all(name in trial for trial in a + b)] if a and b else []
+    for name in names:
+        sa = describe([trial[name] for trial in a if not math.isnan(trial[name])], confidence)
+        sb = describe([trial[name] for trial in b if not math.isnan(trial[name])], confidence)
+        change = (sb["mean"] - sa["mean"]) / abs(sa["mean"]) if sa["mean"] else float("nan")
+        report[name] = {"a": sa, "b": sb, "change": change, "p": welch(sa, sb)}
+    return report
+
+
+def regressions(report: dict[str, dict], gates: dict[str, float], alpha: float) -> list[str]:
+    """Gated metrics on which the candidate is significantly worse by more than the gate."""
+    failed = []
+    for name, threshold in gates.items():
+        if name not in report:
+            failed.append(f"{name} was not measured")
+            continue
+        row = report[name]
+        worse = -row["change"] if METRICS.get(name, True) else row["change"]
+        if row["p"] < alpha and worse * 100 > threshold:
+            failed.append(f"{name} {row['change']:+.1%} (p={row['p']:.3g})")
+    return failed
+
+
+def print_report(config: str, report: dict[str, dict], confidence: float):
+    print(f"=== {config or 'defaults'}")
+    ci = f"{confidence:.0%} CI"
+    print(f"{'metric':>22} {'A mean':>12} {'± ' + ci:>12} {'B mean':>12} {'± ' + ci:>12} {'change':>8} {'p':>8}")
+    for name, row in report.items():
+        print(
+            f"{name:>22} {row['a']['mean']:12.4g} {row['a']['ci']:12.3g} {row['b']['mean']:12.4g}"
+            f" {row['b']['ci']:12.3g} {row['change']:+8.1%} {row['p']:8.3g}"
+        )
+
+
+def trial_count(value: str) -> int:
+    trials = int(value)
+    if trials < 2:
+        # a single trial per side has no variance, every p-value would be NaN and no gate could fail
+        raise argparse.ArgumentTypeError("at least 2 trials are needed for a t-test")
+    return trials
+
+
+def parse_gate(spec: str) -> tuple[str, float]:
+    name, _, threshold = spec.partition(":")
+    return name, float(threshold or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="ab_bench",
+        description="interleaved A/B comparison of two server binaries",
+        epilog="exit code 1 means the candidate regressed on a gated metric",
+    )
+    parser.add_argument("hosts", type=str, help="file with staked accounts")
+    parser.add_argument("--a", type=str, default="./swqos_current", help="baseline server binary")
+    parser.add_argument("--b", type=str, default="./swqos", help="candidate server binary")
+    parser.add_argument("--trials", type=trial_count, default=6, help="runs of each binary per configuration")
+    parser.add_argument(
+        "--config",
+        type=str,
+        action="append",
+        help="main.py options of one configuration, e.g. '--latency 50 --tx-size 512', repeatable",
+    )
+    parser.add_argument("--testbed", type=str, help="control socket of a serving testbed.py")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level of the gates")
+    parser.add_argument(
+        "--gate",
+        type=str,
+        action="append",
+        help="metric[:percent], fail if B is significantly worse by more than percent (default tps:2)",
+    )
+    parser.add_argument("--json", type=str, help="also write the comparison here")
+    args = parser.parse_args()
+
+    configs = args.config or [""]
+    gates = dict(parse_gate(spec) for spec in args.gate or ["tps:2"])
+    session = time.strftime("%Y%m%d-%H%M%S")
+    binaries = {"A": args.a, "B": args.b}
+    results, failed = {}, []
+    for config in configs:
+        trials = {"A": [], "B": []}
+        for i in range(args.trials):
+            # ABBA: each binary goes first in half of the pairs
+            for side in ("AB" if i % 2 == 0 else "BA"):
+                label = f"ab-{session}-{side}"
+                print(f"*** {config or 'defaults'}: trial {i + 1}/{args.trials} of {side} ({binaries[side]})")
+                run_id = run_trial(args, binaries[side], label, shlex.split(config))
+                trials[side].append(trial_metrics(run_id))
+        report = compare(trials["A"], trials["B"], args.confidence)
+        print_report(config, report, args.confidence)
+        failed += [f"{config or 'defaults'}: {failure}" for failure in regressions(report, gates, args.alpha)]
+        results[config] = {"trials": trials, "report": report}
+
+    if args.json:
+        json.dump({"a": args.a, "b": args.b, "session": session, "configs": results}, open(args.json, "w"), indent=2)
+    if failed:
+        print("REGRESSION:\n  " + "\n  ".join(failed))
+        sys.exit(1)
+    print("No significant regression on " + ", ".join(gates))
+
+
+if __name__ == "__main__":
+    main()
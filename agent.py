@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Load-generation agent: runs mock clients for a coordinator (bench_cluster.py --agents).
+
+    AGENT_TOKEN=secret ./agent.py --listen 0.0.0.0:7800 --workdir /tmp/agent --key-dir real_keypairs
+
+POST /start   {"run_id", "start_at" (unix time), "identities", "target", "duration",
+               "tx_size", "num_connections", "flags", "tx_pool"}
+POST /stop    {"run_id"}: kill the clients of that run, or keep them from starting
+GET  /status  state of the current run and the clients' exit codes
+GET  /results?run_id=ID  tar.gz of that run's results directory
+
+Every request must carry "Authorization: Bearer <token>" with the token of
+--token-file or $AGENT_TOKEN: whoever can start runs picks the target and the
+client flags. The agent only listens on localhost unless told otherwise.
+
+Clients of a run start together at `start_at`, so agents on different boxes
+need synchronized clocks (NTP is plenty at the run lengths we use).
+"""
+
+import argparse
+import hmac
+import json
+import os
+import re
+import shlex
+import tarfile
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from client_node import ClientNode
+from coordinator import read_token
+
+PUBKEY_RE = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{32,44}$")
+RUN_ID_RE = re.compile(r"^[\w.-]+$")
+
+
+class Agent:
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.lock = threading.Lock()
+        self.run = {"state": "idle"}
+        # of the current run: set by stop(), and the clients to kill then
+        self.cancel = threading.Event()
+        self.nodes: list[ClientNode] = []
+
+    def run_dir(self, run_id: str) -> str:
+        if not RUN_ID_RE.match(run_id):
+            raise ValueError(f"bad run id {run_id!r}")
+        return os.path.join(self.workdir, run_id)
+
+    @staticmethod
+    def validate(request: dict) -> dict:
+        """The run request with its fields checked and converted, ValueError if one is bad."""
+        try:
+            run = {
+                "run_id": str(request["run_id"]),
+                "start_at": float(request["start_at"]),
+                "identities": list(request["identities"]),
+                "target": str(request["target"]),
+                "duration": float(request["duration"]),
+                "tx_size": int(request["tx_size"]),
+                "num_connections": int(request["num_connections"]),
+                # flags come over the network, keep them from reaching the shell as anything but arguments
+                "flags": " ".join(shlex.quote(arg) for arg in shlex.split(str(request.get("flags", "")))),
+                "tx_pool": bool(request.get("tx_pool")),
+            }
+        except KeyError as e:
+            raise ValueError(f"run request lacks {e}")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"bad run request: {e}")
+        bad = [pk for pk in run["identities"] if not isinstance(pk, str) or not PUBKEY_RE.match(pk)]
+        if bad:
+            raise ValueError(f"bad identities {bad}")
+        return run
+
+    def start(self, request: dict) -> dict:
+        # everything the client thread uses is checked here, so a bad request cannot leave the agent stuck
+        request = self.validate(request)
+        identities = request["identities"]
+        run_dir = self.run_dir(request["run_id"])
+        with self.lock:
+            if self.run["state"] in ("waiting", "running"):
+                raise RuntimeError(f"run {self.run['run_id']} is still {self.run['state']}")
+            os.makedirs(os.path.join(run_dir, "results"), exist_ok=True)
+            self.run = {
+                "state": "waiting",
+                "run_id": request["run_id"],
+                "start_at": request["start_at"],
+                "identities": identities,
+                "exit_codes": {},
+            }
+            self.cancel = threading.Event()
+            self.nodes = [ClientNode(pubkey=pk) for pk in identities]
+        threading.Thread(
+            target=self._run_clients, args=(request, run_dir, self.nodes, self.cancel), daemon=True
+        ).start()
+        return self.status()
+
+    def stop(self, run_id: str) -> dict:
+        """Kills the clients of run `run_id` if it is still waiting or running."""
+        with self.lock:
+            if self.run.get("run_id") != run_id or self.run["state"] not in ("waiting", "running"):
+                return json.loads(json.dumps(self.run))
+            self.cancel.set()
+            nodes = list(self.nodes)
+        for node in nodes:
+            proc = node.proc
+            if proc is not None and proc.returncode is None:
+                proc.stop()
+        return self.status()
+
+    def _run_clients(self, request: dict, run_dir: str, nodes: list[ClientNode], cancel: threading.Event):
+        try:
+            if cancel.wait(max(request["start_at"] - time.time(), 0)):
+                raise RuntimeError("stopped before the start")
+            with self.lock:
+                self.run["state"] = "running"
+                self.run["started"] = time.time()
+            for node in nodes:
+                if cancel.is_set():
+                    raise RuntimeError("stopped while starting the clients")
+                node.run_agave_client(
+                    target=shlex.quote(request["target"]),
+                    duration=request["duration"],
+                    tx_size=request["tx_size"],
+                    num_connections=request["num_connections"],
+                    flags=request["flags"],
+                    tx_pool=request["tx_pool"],
+                    cwd=run_dir,
+                )
+            if cancel.is_set():
+                # stop() may have looked before the last client was up
+                raise RuntimeError("stopped while starting the clients")
+            waiters = [threading.Thread(target=self._wait, args=(node,)) for node in nodes]
+            for waiter in waiters:
+                waiter.start()
+            for waiter in waiters:
+                waiter.join()
+            state = "stopped" if cancel.is_set() else "done"
+        except Exception:
+            if not cancel.is_set():
+                traceback.print_exc()
+            # clients started before the failure must not keep sending once the agent takes new runs
+            for node in nodes:
+                node.stop()
+            state = "stopped" if cancel.is_set() else "failed"
+        with self.lock:
+            self.run["state"] = state
+            self.run["finished"] = time.time()
+
+    def _wait(self, node: ClientNode):
+        code = node.wait()
+        with self.lock:
+            self.run["exit_codes"][node.pubkey] = code
+
+    def status(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps(self.run))
+
+    def results_dir(self, run_id: str) -> str:
+        results_dir = os.path.join(self.run_dir(run_id), "results")
+        if not os.path.isdir(results_dir):
+            raise FileNotFoundError(f"no results for run {run_id}")
+        return results_dir
+
+    @staticmethod
+    def write_results(results_dir: str, out):
+        """Streams a tar.gz of `results_dir` to `out`, the result files can be far larger than memory."""
+        with tarfile.open(fileobj=out, mode="w|gz") as tar:
+            for name in sorted(os.listdir(results_dir)):
+                tar.add(os.path.join(results_dir, name), arcname=name)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def reply(self, code: int, body: bytes, content_type="application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, code: int, payload: dict):
+        self.reply(code, (json.dumps(payload) + "\n").encode())
+
+    def authorized(self) -> bool:
+        expected = f"Bearer {self.server.token}"  # pyright:ignore
+        if hmac.compare_digest(self.headers.get("Authorization", "").encode(), expected.encode()):
+            return True
+        self.reply_json(401, {"ok": False, "error": "missing or wrong agent token"})
+        return False
+
+    def handle_errors(self, action):
+        agent: Agent = self.server.agent  # pyright:ignore
+        if not self.authorized():
+            return
+        try:
+            action(agent)
+        except (ValueError, KeyError) as e:
+            self.reply_json(400, {"ok": False, "error": str(e)})
+        except FileNotFoundError as e:
+            self.reply_json(404, {"ok": False, "error": str(e)})
+        except RuntimeError as e:
+            self.reply_json(409, {"ok": False, "error": str(e)})
+
+    def do_POST(self):
+        def post(agent):
+            path = urlparse(self.path).path
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if path == "/start":
+                self.reply_json(200, {"ok": True, **agent.start(request)})
+            elif path == "/stop":
+                self.reply_json(200, {"ok": True, **agent.stop(str(request["run_id"]))})
+            else:
+                raise FileNotFoundError(path)
+
+        self.handle_errors(post)
+
+    def do_GET(self):
+        def get(agent):
+            url = urlparse(self.path)
+            if url.path == "/status":
+                self.reply_json(200, {"ok": True, **agent.status()})
+            elif url.path == "/results":
+                results_dir = agent.results_dir(parse_qs(url.query)["run_id"][0])
+                # no Content-Length: the archive is written as it is built and ends with the connection
+                self.send_response(200)
+                self.send_header("Content-Type", "application/gzip")
+                self.end_headers()
+                agent.write_results(results_dir, self.wfile)
+            else:
+                raise FileNotFoundError(url.path)
+
+        self.handle_errors(get)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="agent", description="runs mock clients on this box for a remote coordinator"
+    )
+    parser.add_argument(
+        "--listen", type=str, default="127.0.0.1:7800", help="address:port to serve on, 0.0.0.0:PORT for all interfaces"
+    )
+    parser.add_argument("--token-file", type=str, help="file holding the shared token (default: $AGENT_TOKEN)")
+    parser.add_argument("--workdir", type=str, default="agent_runs", help="runs and their results go here")
+    parser.add_argument("--client-bin", type=str, default=ClientNode.CLIENT_BIN)
+    parser.add_argument("--key-dir", type=str, default=ClientNode.KEY_DIR)
+    parser.add_argument("--tx-pool-dir", type=str, default=ClientNode.TX_POOL_DIR)
+    args = parser.parse_args()
+
+    token = read_token(args.token_file)
+    if not token:
+        parser.error("an agent token is required, set AGENT_TOKEN or pass --token-file")
+
+    # clients run inside the run directory, so every path they get must be absolute
+    ClientNode.CLIENT_BIN = os.path.abspath(args.client_bin)
+    ClientNode.KEY_DIR = os.path.abspath(args.key_dir)
+    ClientNode.TX_POOL_DIR = os.path.abspath(args.tx_pool_dir)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    host, port = args.listen.rsplit(":", 1)
+    server = ThreadingHTTPServer((host, int(port)), RequestHandler)
+    server.agent = Agent(os.path.abspath(args.workdir))  # pyright:ignore
+    server.token = token  # pyright:ignore
+    print(f"Agent serving on {args.listen}, runs in {args.workdir}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
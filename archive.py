@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from datatypes import (
+    SERVER_RESOURCES_MAGIC,
+    client_stats_dtype,
+    client_stats_header,
+    read_header,
+    send_record_dtype,
+    server_record_dtype,
+    thread_sample_dtype,
+)
+from pcap_analyze import CAPTURE_PREFIX
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Raw results of past runs, kept compressed: mk_results_dir moves every file of
+# the previous run into archive/<run>/ instead of deleting it, and a niced
+# background process compresses them into <name>.qz while the next run goes on.
+# Until it is done the run directory holds a PENDING marker. Packet captures
+# stay as they are (they barely compress) and are kept for the newest
+# KEEP_CAPTURE_RUNS runs only; runs beyond the newest KEEP_RUNS are deleted.
+#
+# A .qz file is MAGIC, a u32 length and a JSON header, then independently
+# compressed chunks of CHUNK_RECORDS records, then an index of
+# chunk_index_dtype entries and a trailer (u64 index offset, u64 chunk count,
+# MAGIC). Chunks are stored column by column with the time column
+# delta-encoded, and the index carries each chunk's time range, so a reader
+# decompresses only the chunks overlapping the range it asks for. Files whose
+# layout is not known are stored as opaque byte chunks.
+
+MAGIC = b"QARCHIV\0"
+VERSION = 1
+SUFFIX = ".qz"
+CHUNK_RECORDS = 1 << 16
+OPAQUE_CHUNK_BYTES = 1 << 22
+PENDING = ".pending"
+KEEP_RUNS = 100
+KEEP_CAPTURE_RUNS = 2
+
+chunk_index_dtype = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("length", "<u8"),
+        ("records", "<u8"),
+        ("t_min", "<u8"),
+        ("t_max", "<u8"),
+    ]
+)
+
+
+def record_layout(path: str) -> tuple[np.dtype, int, str | None] | None:
+    """(record dtype, offset of the first record, time field) of a known results file."""
+    name = os.path.basename(path)
+    if name == "serverlog.bin":
+        return server_record_dtype, 0, "time"
+    if name.endswith("-host-transactions.bin"):
+        header, offset = client_stats_header(path)
+        return client_stats_dtype(header), offset, "time"
+    if name.endswith("-sendlog.bin"):
+        return send_record_dtype, 0, "time"
+    if name == "server_resources.bin":
+        found = read_header(path, SERVER_RESOURCES_MAGIC)
+        return (client_stats_dtype(found[0]), found[1], "time") if found else None
+    if name == "server_threads.bin":
+        return thread_sample_dtype, 0, "time"
+    return None
+
+
+def _compressor():
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress
+    return "zlib", lambda data: zlib.compress(data, 1)
+
+
+def _decompressor(codec: str):
+    if codec == "zlib":
+        return zlib.decompress
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("archive is zstd compressed, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"unknown codec {codec}")
+
+
+def _encode(chunk: np.ndarray, time_field: str | None) -> bytes:
+    if chunk.dtype.names is None:
+        return chunk.tobytes()
+    columns = []
+    for name in chunk.dtype.names:
+        column = np.ascontiguousarray(chunk[name])
+        if name == time_field:
+            column = np.diff(column.astype("<u8"), prepend=np.uint64(0))
+        columns.append(column.tobytes())
+    return b"".join(columns)
+
+
+def _decode(data: bytes, dtype: np.dtype, count: int, time_field: str | None) -> np.ndarray:
+    if dtype.names is None:
+        return np.frombuffer(data, dtype=dtype, count=count)
+    out = np.empty(count, dtype=dtype)
+    pos = 0
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        size = field.itemsize * count
+        if name == time_field:
+            out[name] = np.cumsum(np.frombuffer(data, dtype="<u8", count=count, offset=pos), dtype="<u8")
+        else:
+            out[name] = np.frombuffer(data, dtype=field, count=count, offset=pos)
+        pos += size
+    return out
+
+
+def write_archive(src: str, dst: str) -> int:
+    """Compresses one results file into `dst`, returns the bytes written."""
+    size = os.path.getsize(src)
+    try:
+        layout = record_layout(src)
+    except ValueError as e:
+        print(f"{e}, storing it as opaque bytes")
+        layout = None
+    if layout is None:
+        dtype, offset, time_field, chunk_records = np.dtype("u1"), 0, None, OPAQUE_CHUNK_BYTES
+    else:
+        (dtype, offset, time_field), chunk_records = layout, CHUNK_RECORDS
+    count = (size - offset) // dtype.itemsize
+    codec, compress = _compressor()
+    with open(src, "rb") as f:
+        prefix = f.read(offset)
+        f.seek(offset + count * dtype.itemsize)
+        suffix = f.read()
+    header = {
+        "version": VERSION,
+        "codec": codec,
+        "dtype": np.lib.format.dtype_to_descr(dtype),
+        "time_field": time_field,
+        "records": count,
+        "chunk_records": chunk_records,
+        "prefix": base64.b64encode(prefix).decode("ascii"),
+        "suffix": base64.b64encode(suffix).decode("ascii"),
+    }
+    records = (
+        np.memmap(src, dtype=dtype, mode="r", offset=offset, shape=(count,)) if count else np.empty(0, dtype)
+    )
+    index = np.zeros((count + chunk_records - 1) // chunk_records, dtype=chunk_index_dtype)
+    with open(dst, "wb") as out:
+        encoded = json.dumps(header).encode()
+        out.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        for i, start in enumerate(range(0, count, chunk_records)):
+            chunk = np.asarray(records[start : start + chunk_records])
+            data = compress(_encode(chunk, time_field))
+            index[i] = (out.tell(), len(data), len(chunk), 0, 0)
+            if time_field is not None:
+                index["t_min"][i] = chunk[time_field].min()
+                index["t_max"][i] = chunk[time_field].max()
+            out.write(data)
+        index_offset = out.tell()
+        out.write(index.tobytes())
+        out.write(struct.pack("<QQ", index_offset, len(index)) + MAGIC)
+        return out.tell()
+
+
+class ArchivedRecords:
+    """Reads a .qz file, decompressing only the chunks a query needs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + 4)
+            if head[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path}: not a results archive")
+            (length,) = struct.unpack("<I", head[len(MAGIC) :])
+            self.header = json.loads(f.read(length))
+            f.seek(-(16 + len(MAGIC)), os.SEEK_END)
+            index_offset, chunks = struct.unpack("<QQ", f.read(16))
+            f.seek(index_offset)
+            self.index = np.frombuffer(f.read(chunks * chunk_index_dtype.itemsize), dtype=chunk_index_dtype)
+        self.dtype = np.lib.format.descr_to_dtype(self.header["dtype"])
+        self.time_field = self.header["time_field"]
+        self.prefix = base64.b64decode(self.header["prefix"])
+        self.suffix = base64.b64decode(self.header["suffix"])
+        self._decompress = _decompressor(self.header["codec"])
+
+    def __len__(self):
+        return self.header["records"]
+
+    def chunks(self, t_start: int | None = None, t_end: int | None = None):
+        """Yields the records with t_start <= time <= t_end, one chunk at a time."""
+        if (t_start, t_end) != (None, None) and self.time_field is None:
+            raise ValueError(f"{self.path}: records carry no time field")
+        wanted = np.ones(len(self.index), dtype=bool)
+        if t_start is not None:
+            wanted &= self.index["t_max"] >= t_start
+        if t_end is not None:
+            wanted &= self.index["t_min"] <= t_end
+        with open(self.path, "rb") as f:
+            for entry in self.index[wanted]:
+                f.seek(int(entry["offset"]))
+                data = self._decompress(f.read(int(entry["length"])))
+                chunk = _decode(data, self.dtype, int(entry["records"]), self.time_field)
+                if self.time_field is not None:
+                    t = chunk[self.time_field]
+                    keep = np.ones(len(chunk), dtype=bool)
+                    if t_start is not None:
+                        keep &= t >= t_start
+                    if t_end is not None:
+                        keep &= t <= t_end
+                    chunk = chunk[keep]
+                yield chunk
+
+    def read(self, t_start: int | None = None, t_end: int | None = None) -> np.ndarray:
+        parts = list(self.chunks(t_start, t_end))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=self.dtype)
+
+    def restore(self, dst: str):
+        """Writes the original file back."""
+        with open(dst, "wb") as out:
+            out.write(self.prefix)
+            for chunk in self.chunks():
+                out.write(chunk.tobytes())
+            out.write(self.suffix)
+
+
+def _run_name(results_dir: str) -> str:
+    run_id = os.path.join(results_dir, "run_id")
+    if os.path.exists(run_id):
+        return f"run-{open(run_id).read().strip()}"
+    config = os.path.join(results_dir, "config.json")
+    stamp = os.path.getmtime(config) if os.path.exists(config) else time.time()
+    return time.strftime("%Y%m%d-%H%M%S", time.localtime(stamp))
+
+
+def stage_results(results_dir: str = "results", archive_root: str = "archive") -> str | None:
+    """Moves the files of `results_dir` uncompressed into a new, pending run directory."""
+    names = sorted(
+        name
+        for name in os.listdir(results_dir)
+        if os.path.isfile(os.path.join(results_dir, name)) and not name.startswith("timeline-")
+    )
+    run_dir = None
+    if names:
+        run_dir = os.path.join(archive_root, _run_name(results_dir))
+        base, n = run_dir, 1
+        while os.path.exists(run_dir):
+            run_dir, n = f"{base}.{n}", n + 1
+        os.makedirs(run_dir)
+        open(os.path.join(run_dir, PENDING), "w").close()
+        for name in names:
+            shutil.move(os.path.join(results_dir, name), os.path.join(run_dir, name))
+    for name in os.listdir(results_dir):
+        path = os.path.join(results_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    return run_dir
+
+
+def pack_run(run_dir: str, archive_root: str = "archive", keep_runs=KEEP_RUNS, keep_capture_runs=KEEP_CAPTURE_RUNS):
+    """Compresses the raw files of a staged run directory, then prunes the archive."""
+    raw = packed = files = 0
+    t0 = time.monotonic()
+    for name in sorted(os.listdir(run_dir)):
+        if name == PENDING or name.endswith(SUFFIX) or name.startswith(CAPTURE_PREFIX):
+            continue
+        src = os.path.join(run_dir, name)
+        raw += os.path.getsize(src)
+        packed += write_archive(src, src + SUFFIX)
+        os.remove(src)
+        files += 1
+    os.remove(os.path.join(run_dir, PENDING))
+    print(
+        f"Archived {files} files to {run_dir}: {raw / 1e6:.1f} MB -> {packed / 1e6:.1f} MB"
+        f" in {time.monotonic() - t0:.1f}s"
+    )
+    prune(archive_root, keep_runs, keep_capture_runs)
+
+
+def prune(archive_root: str, keep_runs=KEEP_RUNS, keep_capture_runs=KEEP_CAPTURE_RUNS):
+    """Deletes all but the newest `keep_runs` runs and the captures of all but the newest `keep_capture_runs`."""
+    runs = []
+    for run in os.listdir(archive_root):
+        run_dir = os.path.join(archive_root, run)
+        try:
+            if os.path.isdir(run_dir) and not os.path.exists(os.path.join(run_dir, PENDING)):
+                runs.append((os.path.getmtime(run_dir), run_dir))
+        except FileNotFoundError:
+            continue  # pruned by another packer meanwhile
+    runs = [run_dir for _, run_dir in sorted(runs, reverse=True)]
+    for run_dir in runs[keep_runs:]:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    for run_dir in runs[keep_capture_runs:keep_runs]:
+        for name in os.listdir(run_dir):
+            if name.startswith(CAPTURE_PREFIX):
+                os.remove(os.path.join(run_dir, name))
+
+
+def archive_results(results_dir: str = "results", archive_root: str = "archive", background=False) -> str | None:
+    """Moves the files of `results_dir` into a new run directory under `archive_root`.
+
+    With `background` the compression runs in a niced process of its own that
+    the caller does not wait for.
+    """
+    run_dir = stage_results(results_dir, archive_root)
+    if run_dir is None:
+        return None
+    if background:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "pack", run_dir, "--archive", archive_root],
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+            preexec_fn=lambda: os.nice(19),
+        )
+    else:
+        pack_run(run_dir, archive_root)
+    return run_dir
+
+
+def extract_run(run_dir: str, results_dir: str):
+    """Restores an archived run, e.g. to re-run parse.py or the plots on it."""
+    os.makedirs(results_dir, exist_ok=True)
+    for name in sorted(os.listdir(run_dir)):
+        if name.endswith(SUFFIX):
+            ArchivedRecords(os.path.join(run_dir, name)).restore(os.path.join(results_dir, name[: -len(SUFFIX)]))
+        elif name != PENDING:
+            # captures, and files of a run that is still being packed
+            shutil.copy(os.path.join(run_dir, name), os.path.join(results_dir, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="archive", description="archived raw results of past runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    list_parser = sub.add_parser("list", help="archived runs and their sizes")
+    list_parser.add_argument("archive", type=str, nargs="?", default="archive")
+    extract_parser = sub.add_parser("extract", help="restore an archived run")
+    extract_parser.add_argument("run", type=str, help="archive/<run> directory")
+    extract_parser.add_argument("results", type=str, help="directory to restore into")
+    store_parser = sub.add_parser("store", help="archive a results directory now")
+    store_parser.add_argument("results", type=str, nargs="?", default="results")
+    store_parser.add_argument("--archive", type=str, default="archive")
+    pack_parser = sub.add_parser("pack", help="compress a staged run directory (what mk_results_dir starts)")
+    pack_parser.add_argument("run", type=str, help="archive/<run> directory")
+    pack_parser.add_argument("--archive", type=str, default="archive")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for run in sorted(os.listdir(args.archive)):
+            run_dir = os.path.join(args.archive, run)
+            files = [os.path.join(run_dir, name) for name in os.listdir(run_dir)]
+            size = sum(os.path.getsize(path) for path in files)
+            state = " (being packed)" if os.path.exists(os.path.join(run_dir, PENDING)) else ""
+            print(f"{run:24} {len(files):4} files {size / 1e6:10.1f} MB{state}")
+    elif args.command == "extract":
+        if os.path.exists(args.results) and os.listdir(args.results):
+            parser.error(f"{args.results} is not empty")
+        extract_run(args.run, args.results)
+    elif args.command == "pack":
+        pack_run(args.run, args.archive)
+    else:
+        archive_results(args.results, args.archive)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Sweeps client connections x worker threads against a local server.
+
+Reports achieved TPS (client-sent and, with --server, server-received) and the
+client's CPU cost per transaction, to see where one load generator saturates.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import subprocess
+import time
+
+from client_node import ClientNode
+from results_loader import load_server_log
+from tooling import mk_results_dir
+
+
+def run_point(args, identity: str, connections: int, threads: int) -> dict:
+    mk_results_dir()
+    server = None
+    if args.server is not None:
+        server = subprocess.Popen(
+            f"{args.server} --test-duration {args.duration + 5.0} --stake-amounts {args.hosts} "
+            f"--bind-to {args.target} --log-file ./results/serverlog.bin",
+            shell=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        time.sleep(1.0)
+
+    cmd = [
+        ClientNode.CLIENT_BIN,
+        "--target", args.target,
+        "--duration", str(args.duration),
+        "--host-name", identity,
+        "--staked-identity-file", f"{ClientNode.KEY_DIR}/{identity}.json",
+        "--num-connections", str(connections),
+        "--worker-threads", str(threads),
+        "--num-runtimes", str(args.num_runtimes),
+        "--tx-size", str(args.tx_size),
+        "--max-bitrate-bps", str(args.max_bitrate_bps),
+        "--max-in-flight-streams", str(args.max_in_flight_streams),
+    ]
+    if args.pin_cores is not None:
+        cmd += ["--pin-cores", args.pin_cores]
+    print(f"running {' '.join(cmd)}")
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output = proc.stdout.read()  # pyright:ignore
+    # wait4 gives the rusage of exactly this child
+    _, status, usage = os.wait4(proc.pid, 0)
+    # the CPU time covers setup and the drain after --duration too, so divide by the whole lifetime
+    wall = time.monotonic() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    sent = 0
+    for line in output.splitlines():
+        if line.startswith("TRANSACTIONS_SENT"):
+            sent = int(line.split()[1])
+    cpu = usage.ru_utime + usage.ru_stime
+    point = {
+        "connections": connections,
+        "worker_threads": threads,
+        "exit_code": proc.returncode,
+        "sent_tps": sent / args.duration,
+        "wall_s": wall,
+        "cpu_cores": cpu / wall,
+        "cpu_us_per_tx": cpu * 1e6 / sent if sent else float("nan"),
+        "server_tps": float("nan"),
+    }
+    if server is not None:
+        server.wait()
+        point["server_tps"] = len(load_server_log()) / args.duration
+    return point
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="bench_client_scaling",
+        description="client scaling benchmark",
+        epilog="If you encounter some bug, I wish you a luck ©No-Manuel Macros",
+    )
+    parser.add_argument("hosts", type=str, help="file with staked accounts, the first one is used")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--worker-threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--num-runtimes", type=int, default=1)
+    parser.add_argument("--pin-cores", type=str, help="core list passed to the client")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--tx-size", type=int, default=512)
+    parser.add_argument("--max-bitrate-bps", type=float, default=1e12, help="per connection")
+    parser.add_argument("--max-in-flight-streams", type=int, default=16)
+    parser.add_argument("--target", type=str, default="127.0.0.1:8000")
+    parser.add_argument("--server", type=str, help="start this server binary locally per point")
+    parser.add_argument("--output", type=str, default="client_scaling.csv")
+    args = parser.parse_args()
+
+    identity = open(args.hosts).readline().split()[0]
+    points = []
+    for connections, threads in itertools.product(args.connections, args.worker_threads):
+        point = run_point(args, identity, connections, threads)
+        print(point)
+        points.append(point)
+
+    print(f"{'conns':>6} {'threads':>8} {'sent TPS':>10} {'server TPS':>11} {'cores':>6} {'us/tx':>7}")
+    for p in points:
+        print(
+            f"{p['connections']:>6} {p['worker_threads']:>8} {p['sent_tps']:>10.0f} "
+            f"{p['server_tps']:>11.0f} {p['cpu_cores']:>6.2f} {p['cpu_us_per_tx']:>7.2f}"
+        )
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(points[0]))
+        writer.writeheader()
+        writer.writerows(points)
+
+
+if __name__ == "__main__":
+    main()
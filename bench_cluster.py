@@ -5,7 +5,9 @@ import json
 import subprocess
 import parse
 
-from client_node import ClientNode
+from client_node import ClientNode, add_congestion_arguments, congestion_flags, congestion_spec
+from coordinator import read_token, run_on_agents, split_identities
+from knee_search import add_knee_arguments, group_by_stake, offered_bitrate_flag, run_knee_search
 from tooling import mk_results_dir
 
 ClientNode.KEY_DIR = "real_keypairs/"
@@ -25,6 +27,7 @@ def main():
     parser.add_argument(
         "--disable_congestion", action="store_true", help="Disable congestion control"
     )
+    add_congestion_arguments(parser)
     parser.add_argument("--target", type=str, help="target validator", default="72.46.85.181:8004")
     parser.add_argument(
         "--num_connections",
@@ -33,28 +36,111 @@ def main():
         default=1,
     )
     parser.add_argument("--tx-size", type=int, help="Transaction size", default=1000)
+    parser.add_argument(
+        "--max-in-flight-streams",
+        type=int,
+        help="uni streams each client connection keeps in flight",
+        default=1,
+    )
+    parser.add_argument(
+        "--tx-pool",
+        action="store_true",
+        help="clients send pre-signed transactions from txpools/ (make_txpool.py) instead of dummy payloads",
+    )
+    parser.add_argument(
+        "--offered-tps",
+        type=float,
+        help="total TPS offered by all clients, split evenly (default: client bitrate limit)",
+    )
+    parser.add_argument(
+        "--agents",
+        type=str,
+        help="comma separated agent.py addresses (host:port) to run the clients on instead of locally",
+    )
+    parser.add_argument(
+        "--agent-token-file", type=str, help="file with the agents' shared token (default: $AGENT_TOKEN)"
+    )
+    parser.add_argument(
+        "--start-delay",
+        type=float,
+        default=5.0,
+        help="seconds between handing a run to the agents and its synchronized start",
+    )
+    parser.add_argument("--label", type=str, help="tag stored with the run in runs.db")
+    add_knee_arguments(parser)
 
     args = parser.parse_args()
-
-    mk_results_dir()
-    configs = {"duration": args.duration, "tx-size": args.tx_size}
+    if args.agents and not read_token(args.agent_token_file):
+        parser.error("--agents needs the agents' token, set AGENT_TOKEN or pass --agent-token-file")
 
     client_identities = [
         line.strip().split(" ")[0].strip() for line in open(args.hosts, "r").readlines()
     ]
-    flags = ""
-    if args.disable_congestion:
-        flags += "--disable-congestion"
     client_nodes = [ClientNode(pubkey=host_id) for host_id in client_identities]
 
-    for i, node in enumerate(client_nodes):
+    if args.find_knee is not None:
+        # the remote validator's log is not available, so a trial passes while the
+        # clients manage to send what their pacers offer
+        def trial(rate):
+            args.offered_tps = rate
+            run_clients(args, client_nodes)
+            return group_by_stake(parse.main(args.hosts, record=False))
+
+        run_knee_search(args, trial)
+        return
+
+    run_clients(args, client_nodes)
+    parse.main(args.hosts, label=args.label)
+
+
+def run_clients(args, client_nodes):
+    mk_results_dir()
+    configs = {
+        "duration": args.duration,
+        "tx-size": args.tx_size,
+        "max-in-flight-streams": args.max_in_flight_streams,
+        "offered-tps": args.offered_tps,
+        "tx-pool": args.tx_pool,
+        "target": args.target,
+        "num-connections": args.num_connections,
+        "num-clients": len(client_nodes),
+        "disable-congestion": args.disable_congestion,
+        "congestion": congestion_spec(args),
+    }
+    flags = congestion_flags(args)
+    flags += f" --max-in-flight-streams {args.max_in_flight_streams}"
+    flags += offered_bitrate_flag(args, [node.pubkey for node in client_nodes])
+
+    for node in client_nodes:
         configs[node.pubkey] = {"latency": None}
+    if args.agents:
+        agents = args.agents.split(",")
+        configs["agents"] = split_identities([node.pubkey for node in client_nodes], agents)
+        json.dump(configs, open("results/config.json", "w"))
+        run_on_agents(
+            agents,
+            [node.pubkey for node in client_nodes],
+            {
+                "target": args.target,
+                "duration": args.duration,
+                "tx_size": args.tx_size,
+                "num_connections": args.num_connections,
+                "flags": flags,
+                "tx_pool": args.tx_pool,
+            },
+            read_token(args.agent_token_file),
+            start_delay=args.start_delay,
+        )
+        return
+
+    for node in client_nodes:
         node.run_agave_client(
             target=args.target,
             num_connections=args.num_connections,
             duration=args.duration,
             tx_size=args.tx_size,
             flags=flags,
+            tx_pool=args.tx_pool,
         )
     json.dump(configs, open("results/config.json", "w"))
     print("========Waiting for clients=======")
@@ -63,8 +149,6 @@ def main():
 
     subprocess.run("sudo chmod a+rw -R ./results/", shell=True, text=True, check=True)
 
-    parse.main(args.hosts)
-
 
 if __name__ == "__main__":
     main()
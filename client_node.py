@@ -1,52 +1,117 @@
-import subprocess
+import os
+
+from client_supervisor import supervisor
+
+CONGESTION_CONTROLLERS = ["cubic", "newreno", "bbr", "fixed", "aimd"]
+
+
+def add_congestion_arguments(parser):
+    parser.add_argument(
+        "--congestion",
+        choices=CONGESTION_CONTROLLERS,
+        default="cubic",
+        help="client congestion controller (--disable_congestion means a fixed window)",
+    )
+    parser.add_argument("--fixed-window", type=int, default=8_000_000, help="bytes in flight of --congestion fixed")
+    parser.add_argument("--aimd-min-window", type=int, default=4_000_000, help="smallest window of --congestion aimd")
+    parser.add_argument("--aimd-max-window", type=int, default=8_000_000, help="largest window of --congestion aimd")
+    parser.add_argument(
+        "--aimd-interval-ms", type=float, default=5.0, help="minimum time between window cuts of --congestion aimd"
+    )
+
+
+def congestion_spec(args) -> str:
+    """The controller and its parameters, as recorded in config.json, e.g. aimd:4000000:8000000:5.0"""
+    kind = "fixed" if args.disable_congestion else args.congestion
+    if kind == "fixed":
+        return f"fixed:{args.fixed_window}"
+    if kind == "aimd":
+        return f"aimd:{args.aimd_min_window}:{args.aimd_max_window}:{args.aimd_interval_ms}"
+    return kind
+
+
+def congestion_flags(args) -> str:
+    if args.disable_congestion:
+        return f" --disable-congestion --fixed-window {args.fixed_window}"
+    flags = f" --congestion {args.congestion}"
+    if args.congestion == "fixed":
+        flags += f" --fixed-window {args.fixed_window}"
+    elif args.congestion == "aimd":
+        flags += (
+            f" --aimd-min-window {args.aimd_min_window} --aimd-max-window {args.aimd_max_window}"
+            f" --aimd-interval-ms {args.aimd_interval_ms}"
+        )
+    return flags
 
 
 class ClientNode:
     KEY_DIR="solana_keypairs/"
-    def __init__(self, pubkey: str, latency: int=0, mininet_host = None):
-        self.pubkey = pubkey
+    CLIENT_BIN="./mock_server/target/release/client"
+    TX_POOL_DIR="txpools/"
+    # a client still running this long after its duration is killed
+    DEADLINE_GRACE=30.0
+    def __init__(self, pubkey: str | list[str], latency: float=0, mininet_host = None, link = None,
+                 bandwidth: float | None = None):
+        # several identities share this host and one client process
+        self.pubkeys = [pubkey] if isinstance(pubkey, str) else list(pubkey)
         self.latency = latency
+        self.bandwidth = bandwidth
         self.mininet_host = mininet_host
+        self.link = link
         self.proc = None
 
+    @property
+    def pubkey(self) -> str:
+        return self.pubkeys[0]
+
     def run_iperf_client(self, target: str, duration: float, tx_size: int):
         args = f"iperf3 -l{tx_size}b -c {target} -t{int(duration)} -u -b 1G"
         print(f"running {args}...")
-        self.proc = self.mininet_host.popen(
-            f"{args}",
-            shell=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        self._spawn(args, duration, "iperf")
 
     def run_agave_client(
         self, target: str, duration: float, tx_size: int, num_connections: int, flags:str="",
+        tx_pool: bool = False, cwd: str | None = None,
     ):
-        args = f"./mock_server/target/release/client --target {target} --duration {duration} --host-name {self.pubkey} --staked-identity-file {self.KEY_DIR}/{self.pubkey}.json --num-connections {num_connections} --tx-size {tx_size} {flags}"
+        if len(self.pubkeys) == 1:
+            args = f"{self.CLIENT_BIN} --target {target} --duration {duration} --host-name {self.pubkey} --staked-identity-file {self.KEY_DIR}/{self.pubkey}.json --num-connections {num_connections} --tx-size {tx_size} {flags}"
+            if tx_pool:
+                args += f" --tx-pool {self.TX_POOL_DIR}/{self.pubkey}.bin"
+        else:
+            # result files are named after each pubkey; every identity holds sockets and files open
+            identities = " ".join(f"--staked-identity-file {self.KEY_DIR}/{pk}.json" for pk in self.pubkeys)
+            args = f"ulimit -n $(ulimit -Hn); {self.CLIENT_BIN} --target {target} --duration {duration} {identities} --num-connections {num_connections} --tx-size {tx_size} {flags}"
+            if tx_pool:
+                args += f" --tx-pool {self.TX_POOL_DIR}"
 
         print(f"running {args}...")
-        if self.mininet_host is not None:
-            self.proc = self.mininet_host.popen(
-                    f"{args}",
-                    shell=True,
-                    text=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-            )
-        else:
-            self.proc = subprocess.Popen(f"{args}",
-                                         shell=True,
-                                         text=True,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
+        self._spawn(args, duration, "client", cwd)
+
+    def _spawn(self, args: str, duration: float, kind: str, cwd: str | None = None):
+        log_path = os.path.join(cwd or ".", "results", f"{self.pubkey}-{kind}.log")
+        self.proc = supervisor().spawn(
+            self.pubkey,
+            args,
+            log_path,
+            cwd=cwd,
+            namespace_pid=self.mininet_host.pid if self.mininet_host is not None else None,
+            timeout=duration + self.DEADLINE_GRACE,
+        )
 
     def wait(self):
         if self.proc is None:
-            return
-        print(f"==== Waiting for client {self.pubkey} latency {self.latency}")
-        print(self.proc.stdout.read(), end="")  # pyright:ignore
-        print(self.proc.stderr.read(), end="")  # pyright:ignore
-        self.proc.wait()
+            return None
+        code = self.proc.wait()
+        killed = " (killed at deadline)" if self.proc.killed else ""
+        others = f" (+{len(self.pubkeys) - 1} identities)" if len(self.pubkeys) > 1 else ""
+        print(f"==== Client {self.pubkey}{others} latency {self.latency}: exit code {code} after {self.proc.runtime():.1f}s{killed}, log {self.proc.log_path}")
+        print("".join(self.proc.tail()), end="")
         print("======")
         self.proc = None
+        return code
+
+    def stop(self):
+        """Kills a client that is still running and collects it like wait()."""
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.stop()
+        return self.wait()
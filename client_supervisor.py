@@ -0,0 +1,137 @@
+import asyncio
+import concurrent.futures
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+# Client processes run under one asyncio loop on a background thread. Their
+# output is drained as it is produced into a log file per client, so a chatty
+# client (RUST_LOG=solana_streamer=debug) never stalls on a full pipe, and a
+# client still running at its deadline is killed instead of hanging the run.
+
+KILL_GRACE_S = 5.0
+READ_CHUNK = 64 * 1024
+
+
+class ClientProcess:
+    def __init__(self, name: str, log_path: str, timeout: float | None):
+        self.name = name
+        self.log_path = log_path
+        self.timeout = timeout
+        self.pid = None
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.killed = False
+        self.done = None
+
+    def wait(self, timeout: float | None = None) -> int:
+        return self.done.result(timeout)  # pyright:ignore
+
+    def stop(self) -> int:
+        """Terminates the client ahead of its deadline and waits for it to exit."""
+        self.killed = True
+        ClientSupervisor._signal(self.pid, signal.SIGTERM)
+        try:
+            return self.wait(KILL_GRACE_S)
+        except concurrent.futures.TimeoutError:
+            ClientSupervisor._signal(self.pid, signal.SIGKILL)
+            return self.wait()
+
+    def runtime(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def tail(self, lines: int = 10) -> list[str]:
+        with open(self.log_path, errors="replace") as f:
+            return list(deque(f, maxlen=lines))
+
+
+class ClientSupervisor:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="client-supervisor", daemon=True)
+        self.thread.start()
+        self.processes: dict[str, ClientProcess] = {}
+
+    def spawn(
+        self, name: str, cmd: str, log_path: str, cwd: str | None = None,
+        namespace_pid: int | None = None, timeout: float | None = None,
+    ) -> ClientProcess:
+        """Starts `cmd` through bash, inside the namespaces of `namespace_pid` if given.
+
+        Returns once the process is running; it is killed if it is still
+        running `timeout` seconds later.
+        """
+        client = ClientProcess(name, log_path, timeout)
+        proc = asyncio.run_coroutine_threadsafe(self._start(client, cmd, cwd, namespace_pid), self.loop).result()
+        client.done = asyncio.run_coroutine_threadsafe(self._supervise(client, proc), self.loop)
+        self.processes[name] = client
+        return client
+
+    async def _start(self, client: ClientProcess, cmd: str, cwd: str | None, namespace_pid: int | None):
+        argv = ["bash", "-c", cmd]
+        if namespace_pid is not None:
+            # what mininet's Host.popen does: new session, then enter the host's namespaces
+            argv = ["mnexec", "-da", str(namespace_pid)] + argv
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=namespace_pid is None,
+        )
+        client.pid = proc.pid
+        client.started = time.monotonic()
+        return proc
+
+    async def _supervise(self, client: ClientProcess, proc) -> int:
+        with open(client.log_path, "wb") as log:
+            drain = asyncio.create_task(self._drain(proc.stdout, log))
+            try:
+                await asyncio.wait_for(proc.wait(), client.timeout)
+            except asyncio.TimeoutError:
+                client.killed = True
+                self._signal(proc.pid, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(proc.wait(), KILL_GRACE_S)
+                except asyncio.TimeoutError:
+                    self._signal(proc.pid, signal.SIGKILL)
+                    await proc.wait()
+            client.finished = time.monotonic()
+            client.returncode = proc.returncode
+            # anything the client forked may still hold the pipe open
+            try:
+                await asyncio.wait_for(drain, KILL_GRACE_S)
+            except asyncio.TimeoutError:
+                pass
+        return proc.returncode
+
+    @staticmethod
+    async def _drain(stream, log):
+        while chunk := await stream.read(READ_CHUNK):
+            log.write(chunk)
+
+    @staticmethod
+    def _signal(pid, sig):
+        # the client leads its own session (setsid), so this reaches bash and its children
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def running(self) -> list[ClientProcess]:
+        return [client for client in self.processes.values() if client.returncode is None]
+
+
+_supervisor = None
+
+
+def supervisor() -> ClientSupervisor:
+    global _supervisor
+    if _supervisor is None:
+        _supervisor = ClientSupervisor()
+    return _supervisor
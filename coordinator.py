@@ -0,0 +1,107 @@
+import json
+import os
+import tarfile
+import time
+import urllib.request
+
+# Drives agent.py instances: splits the identities over them, starts every
+# agent's clients at the same wall clock time and pulls the result files back.
+# Every request carries the agents' shared token (read_token).
+
+POLL_INTERVAL = 1.0
+
+
+def read_token(token_file: str | None) -> str:
+    """The agents' shared token, from `token_file` or else $AGENT_TOKEN."""
+    if token_file:
+        with open(token_file) as f:
+            return f.read().strip()
+    return os.environ.get("AGENT_TOKEN", "").strip()
+
+
+def open_call(agent: str, path: str, token: str, payload: dict | None = None, timeout: float = 30.0):
+    data = None if payload is None else json.dumps(payload).encode()
+    request = urllib.request.Request(
+        f"http://{agent}{path}",
+        data=data,
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def call(agent: str, path: str, token: str, payload: dict | None = None, timeout: float = 30.0) -> bytes:
+    with open_call(agent, path, token, payload, timeout) as reply:
+        return reply.read()
+
+
+def split_identities(identities: list[str], agents: list[str]) -> dict[str, list[str]]:
+    """Round-robin, so stake tiers from a sorted hosts file spread over all agents."""
+    return {agent: identities[i :: len(agents)] for i, agent in enumerate(agents)}
+
+
+def stop_agents(agents: list[str], token: str, run_id: str):
+    """Asks each agent to kill the clients of `run_id`; an agent that cannot be reached is reported and skipped."""
+    for agent in agents:
+        try:
+            call(agent, "/stop", token, {"run_id": run_id})
+            print(f"*** {agent}: stopped run {run_id}")
+        except Exception as e:
+            print(f"*** {agent}: could not stop run {run_id}: {e}")
+
+
+def run_on_agents(
+    agents: list[str],
+    identities: list[str],
+    client_args: dict,
+    token: str,
+    start_delay: float = 5.0,
+    results_dir: str = "results",
+) -> dict[str, dict]:
+    """Runs one test on the agents and unpacks their result files into `results_dir`.
+
+    `client_args` holds target, duration, tx_size, num_connections, flags and
+    tx_pool as for ClientNode.run_agave_client. Returns the final status of
+    every agent.
+    """
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    start_at = time.time() + start_delay
+    shards = split_identities(identities, agents)
+    started = []
+    try:
+        for agent, shard in shards.items():
+            if not shard:
+                continue
+            call(agent, "/start", token, {"run_id": run_id, "start_at": start_at, "identities": shard, **client_args})
+            started.append(agent)
+            print(f"*** {agent}: {len(shard)} clients start in {start_at - time.time():.1f}s")
+    except Exception:
+        # a partial run would measure fewer clients than asked for; call off the agents already armed
+        stop_agents(started, token, run_id)
+        raise
+
+    deadline = start_at + client_args["duration"] + 60.0
+    statuses = {}
+    pending = [agent for agent, shard in shards.items() if shard]
+    while pending:
+        time.sleep(POLL_INTERVAL)
+        for agent in list(pending):
+            status = json.loads(call(agent, "/status", token))
+            if status.get("run_id") == run_id and status["state"] in ("done", "failed", "stopped"):
+                statuses[agent] = status
+                pending.remove(agent)
+        if pending and time.time() > deadline:
+            stop_agents(pending, token, run_id)
+            raise TimeoutError(f"agents {pending} did not finish run {run_id}")
+
+    for agent, status in statuses.items():
+        failed = {pk: code for pk, code in status["exit_codes"].items() if code != 0}
+        if status["state"] != "done" or failed:
+            print(f"*** {agent}: run {status['state']}, failed clients {failed}")
+        # extracted as it arrives, the archive never sits in memory whole
+        with open_call(agent, f"/results?run_id={run_id}", token, timeout=300.0) as reply, tarfile.open(
+            fileobj=reply, mode="r|gz"
+        ) as tar:
+            tar.extractall(results_dir, filter="data")
+            names = tar.getnames()
+        print(f"*** {agent}: collected {len(names)} files")
+    return statuses
@@ -1,3 +1,8 @@
+import json
+import os
+import struct
+import time
+
 import numpy as np
 
 server_record_dtype = np.dtype(
@@ -8,15 +13,8 @@ server_record_dtype = np.dtype(
     ]
 )
 
-server_local_dtype = np.dtype(
-    [
-        ("id", "S32"),  # 32-byte pubkey
-        ("size", np.uint64),
-        ("time", np.float64),
-    ]
-)
-
-client_record_dtype = np.dtype(
+# fixed layouts of client stats files written before they had a header
+client_record_v1_dtype = np.dtype(
     [
         ("udp_tx", np.uint64),
         ("udp_rx", np.uint64),
@@ -28,15 +26,122 @@ client_record_dtype = np.dtype(
         ("connection_id", np.uint64),
     ]
 )
-client_local_dtype = np.dtype(
+client_record_dtype = np.dtype(
+    client_record_v1_dtype.descr
+    + [("intended_sent", np.uint64)]  # what the pacer meant to have sent by "time"
+)
+
+CLIENT_STATS_MAGIC = b"QSTATS\0\0"
+LEGACY_SAMPLE_INTERVAL_US = 5000
+
+
+def client_stats_header(path: str) -> tuple[dict, int]:
+    """Header of a client stats file and the offset its records start at.
+
+    Files with a header start with CLIENT_STATS_MAGIC, a u32 length and that
+    much JSON listing the u64 fields. Older files are a bare array of one of
+    the fixed layouts above; the one that divides the file size and gives
+    time-ordered records is picked.
+    """
+    size = os.path.getsize(path)
+    found = read_header(path, CLIENT_STATS_MAGIC)
+    if found is not None:
+        return found
+    for version, dtype in ((2, client_record_dtype), (1, client_record_v1_dtype)):
+        if size % dtype.itemsize == 0 and _time_ordered(path, dtype, size // dtype.itemsize):
+            return {
+                "version": version,
+                "fields": list(dtype.names),
+                "sample_interval_us": LEGACY_SAMPLE_INTERVAL_US,
+            }, 0
+    if size % client_record_v1_dtype.itemsize == 0:
+        # the first clients wrote each connection's samples in turn, not time-ordered
+        return {
+            "version": 1,
+            "fields": list(client_record_v1_dtype.names),
+            "sample_interval_us": LEGACY_SAMPLE_INTERVAL_US,
+        }, 0
+    raise ValueError(f"{path}: unknown client stats layout")
+
+
+def pack_header(magic: bytes, header: dict) -> bytes:
+    """`magic`, a u32 length and the JSON header, padded so records start 8-byte aligned."""
+    encoded = json.dumps(header).encode()
+    encoded += b" " * (-(len(magic) + 4 + len(encoded)) % 8)
+    return magic + struct.pack("<I", len(encoded)) + encoded
+
+
+def read_header(path: str, magic: bytes) -> tuple[dict, int] | None:
+    """(header, offset of the first record) of a file written with pack_header, None without one."""
+    with open(path, "rb") as f:
+        head = f.read(len(magic) + 4)
+        if len(head) < len(magic) + 4 or head[: len(magic)] != magic:
+            return None
+        (length,) = struct.unpack("<I", head[len(magic) :])
+        return json.loads(f.read(length)), len(head) + length
+
+
+def _time_ordered(path: str, dtype: np.dtype, count: int, probe: int = 4096) -> bool:
+    if count == 0:
+        return True
+    records = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+    head, tail = records[:probe]["time"], records[-probe:]["time"]
+    return bool((np.diff(head.astype(np.int64)) >= 0).all() and (np.diff(tail.astype(np.int64)) >= 0).all())
+
+
+def client_stats_dtype(header: dict) -> np.dtype:
+    return np.dtype([(name, header.get("dtype", "<u8")) for name in header["fields"]])
+
+
+def read_client_stats(path: str) -> np.ndarray:
+    """Memory-maps a client stats file with the layout its header describes."""
+    header, offset = client_stats_header(path)
+    dtype = client_stats_dtype(header)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+send_record_dtype = np.dtype(
+    [
+        ("time", np.uint64),  # us since solana epoch, same clock as serverlog
+        ("transaction_id", np.uint32),
+        ("connection_id", np.uint32),
+    ]
+)
+
+
+# 2020-03-16 UTC; every result file stamps records in microseconds since then
+SOLANA_EPOCH_US = 1584316800 * 1_000_000
+
+
+def solana_epoch_micros() -> int:
+    return time.time_ns() // 1000 - SOLANA_EPOCH_US
+
+
+# server resources (resource_sampler.py): a pack_header header listing u8 fields,
+# then one record per sample. Counters are cumulative, cpu in microseconds.
+SERVER_RESOURCES_MAGIC = b"QRSRC\0\0\0"
+
+thread_sample_dtype = np.dtype(
     [
-        ("udp_tx", np.uint64),
-        ("udp_rx", np.uint64),
-        ("sent", np.uint64),
-        ("congestion_events", np.uint64),
-        ("congestion_window", np.uint64),
-        ("lost_packets", np.uint64),
-        ("time", np.float64),
-        ("connection_id", np.uint64),
+        ("time", np.uint64),
+        ("tid", np.uint64),
+        ("cpu_user_us", np.uint64),
+        ("cpu_system_us", np.uint64),
+        ("name", "S16"),  # /proc comm, at most 15 bytes
     ]
 )
+
+
+def read_server_resources(path: str) -> np.ndarray:
+    found = read_header(path, SERVER_RESOURCES_MAGIC)
+    if found is None:
+        raise ValueError(f"{path}: not a server resources file")
+    header, offset = found
+    dtype = client_stats_dtype(header)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
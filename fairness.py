@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import argparse
+import json
+
+import numpy as np
+
+from results_loader import load_stakes
+from timeline import build_timeline
+
+# SWQoS fairness of one run, judged per sliding window of the server log:
+# what every identity received against the stake-weighted max-min fair split of
+# what the server accepted in that window. An identity's demand is what its
+# client sent in the window (unbounded if it has no client stats), so a client
+# that offers less than its stake share is not counted as starved. Unstaked
+# identities split whatever the staked ones leave, equally.
+
+
+def sliding_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Sums of `window` consecutive bins along the last axis, one per full window."""
+    padded = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+    np.cumsum(values, axis=-1, out=padded[..., 1:])
+    return padded[..., window:] - padded[..., :-window]
+
+
+def water_fill(capacity: np.ndarray, demand: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted max-min fair allocation of capacity[w] over demand[host, w].
+
+    Every host gets min(demand, weight * level), with one level per window
+    chosen so the allocations add up to the capacity, or meet every demand.
+    All weights must be positive; demand may be inf.
+    """
+    if len(weights) == 0:
+        return np.zeros_like(demand)
+    w = np.broadcast_to(weights[:, None].astype(np.float64), demand.shape)
+    order = np.argsort(demand / w, axis=0, kind="stable")
+    d = np.take_along_axis(demand, order, axis=0)
+    w = np.take_along_axis(w, order, axis=0)
+    with np.errstate(invalid="ignore"):
+        met_before = np.zeros_like(d)
+        np.cumsum(d[:-1], axis=0, out=met_before[1:])
+        weight_from = np.cumsum(w[::-1], axis=0)[::-1]
+        # capacity used if the level were set to just fill host k
+        used = met_before + d / w * weight_from
+        full = used >= capacity
+    k = np.argmax(full, axis=0)[None]
+    level = (capacity - np.take_along_axis(met_before, k, axis=0)[0]) / np.take_along_axis(weight_from, k, axis=0)[0]
+    level = np.where(full.any(axis=0), level, np.inf)
+    return np.minimum(demand, weights[:, None] * level)
+
+
+def stake_allocation(capacity: np.ndarray, demand: np.ndarray, stakes: np.ndarray) -> np.ndarray:
+    """Staked hosts split the capacity by stake, unstaked ones share the rest equally."""
+    allocation = np.zeros_like(demand)
+    staked = stakes > 0
+    allocation[staked] = water_fill(capacity, demand[staked], stakes[staked])
+    left = capacity - allocation[staked].sum(axis=0)
+    # rounding leaves crumbs when the staked hosts take everything
+    left = np.where(left > capacity * 1e-9, left, 0)
+    allocation[~staked] = water_fill(left, demand[~staked], np.ones((~staked).sum()))
+    return allocation
+
+
+def jain_index(received: np.ndarray, allocation: np.ndarray) -> np.ndarray:
+    """Jain's index of received/allocation over the hosts entitled to something, per window."""
+    entitled = allocation > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.where(entitled, received / allocation, 0)
+        return x.sum(axis=0) ** 2 / (entitled.sum(axis=0) * (x**2).sum(axis=0))
+
+
+def analyze(
+    hosts_file: str, results_dir: str = "results", window_ms: float = 1000.0, step_ms: float = 100.0,
+    use_cache: bool = True,
+) -> dict[str, np.ndarray]:
+    """Fairness over windows of `window_ms`, advanced by `step_ms`.
+
+    Arrays are indexed [host, window] or [tier, window] (tiers are the distinct
+    stakes, ascending); rates are TPS. Windows in which the server received
+    nothing from known hosts are dropped.
+    """
+    timeline = build_timeline(hosts_file, results_dir, bin_ms=step_ms, use_cache=use_cache)
+    window = max(int(round(window_ms / step_ms)), 1)
+    bin_s = timeline["bin_us"] / 1e6
+    window_s = window * bin_s
+
+    stakes = np.array(list(load_stakes(hosts_file).values()), dtype=np.float64)
+    received = sliding_sum(timeline["server_tps"] * bin_s, window)
+    sent = sliding_sum(timeline["client_tps"] * bin_s, window)
+    unknown = sliding_sum(timeline["unknown_tps"][None] * bin_s, window)[0]
+    capacity = received.sum(axis=0)
+    active = capacity > 0
+    received, sent, unknown, capacity = received[:, active], sent[:, active], unknown[active], capacity[active]
+
+    has_client = timeline["client_tps"].any(axis=1)
+    demand = np.where(has_client[:, None], np.maximum(sent, received), np.inf)
+    allocation = stake_allocation(capacity, demand, stakes)
+
+    tiers, tier_of = np.unique(stakes, return_inverse=True)
+    members = np.zeros((len(tiers), len(stakes)))
+    members[tier_of, np.arange(len(stakes))] = 1
+    tier_received = members @ received
+    tier_allocation = members @ allocation
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "hosts": timeline["hosts"],
+            "stakes": stakes,
+            "window_start": timeline["time"][: len(active)][active],
+            "window_s": np.float64(window_s),
+            "stake_share": stakes / stakes.sum(),
+            "received_tps": received / window_s,
+            "allocation_tps": allocation / window_s,
+            "share": received / capacity,
+            "allocation_share": allocation / capacity,
+            "deviation": (received - allocation) / allocation,
+            "jain": jain_index(received, allocation),
+            "unknown_share": unknown / (capacity + unknown),
+            "tiers": tiers,
+            "tier_share": tier_received / capacity,
+            "tier_allocation_share": tier_allocation / capacity,
+            "tier_deviation": (tier_received - tier_allocation) / tier_allocation,
+        }
+
+
+def summarize(result: dict[str, np.ndarray]) -> dict:
+    """Run-level numbers: Jain's index and per-tier shares, averaged over windows."""
+    jain = result["jain"][np.isfinite(result["jain"])]
+    summary = {
+        "windows": int(len(result["window_start"])),
+        "window_s": float(result["window_s"]),
+        "jain_mean": float(jain.mean()) if len(jain) else float("nan"),
+        "jain_p10": float(np.percentile(jain, 10)) if len(jain) else float("nan"),
+        "jain_min": float(jain.min()) if len(jain) else float("nan"),
+        "tiers": {},
+    }
+    for t, stake in enumerate(result["tiers"]):
+        deviation = result["tier_deviation"][t]
+        deviation = deviation[np.isfinite(deviation)]
+        summary["tiers"][f"stake {int(stake)}"] = {
+            "stake_share": float(result["stake_share"][result["stakes"] == stake].sum()),
+            "share": float(np.nanmean(result["tier_share"][t])),
+            "allocation_share": float(np.nanmean(result["tier_allocation_share"][t])),
+            "deviation_mean": float(deviation.mean()) if len(deviation) else float("nan"),
+            "deviation_abs_max": float(np.abs(deviation).max()) if len(deviation) else float("nan"),
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    print(
+        f"Fairness over {summary['windows']} windows of {summary['window_s']:.1f}s: "
+        f"Jain {summary['jain_mean']:.3f} (p10 {summary['jain_p10']:.3f}, min {summary['jain_min']:.3f})"
+    )
+    print(f"{'tier':>16} {'stake':>8} {'fair':>8} {'got':>8} {'dev':>8} {'|dev|max':>9}")
+    for tier, row in summary["tiers"].items():
+        print(
+            f"{tier:>16} {row['stake_share']:8.3f} {row['allocation_share']:8.3f} {row['share']:8.3f}"
+            f" {row['deviation_mean']:+8.1%} {row['deviation_abs_max']:9.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="fairness",
+        description="stake-weighted fairness of a run over sliding windows",
+        epilog="If you encounter some bug, I wish you a luck ©No-Manuel Macros",
+    )
+    parser.add_argument("hosts", type=str, help="file with staked accounts")
+    parser.add_argument("--results", type=str, default="results", help="results directory of the run")
+    parser.add_argument("--window-ms", type=float, default=1000.0, help="length of a window")
+    parser.add_argument("--step-ms", type=float, default=100.0, help="how far windows advance")
+    parser.add_argument("--json", type=str, help="also write the summary here")
+    parser.add_argument("--no-cache", action="store_true", help="rebuild the timeline even if cached")
+    args = parser.parse_args()
+
+    result = analyze(args.hosts, args.results, args.window_ms, args.step_ms, use_cache=not args.no_cache)
+    summary = summarize(result)
+    print_summary(summary)
+    if args.json:
+        json.dump(summary, open(args.json, "w"), indent=2)
+
+
+if __name__ == "__main__":
+    main()
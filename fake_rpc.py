@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Stand-in for a Solana RPC node answering getClusterNodes, for testing watch_connections.py.
+
+    ./fake_rpc.py nodes.txt --listen 127.0.0.1:8899
+    ./watch_connections.py --rpc-url http://127.0.0.1:8899 ...
+
+nodes.txt holds `pubkey ip:port` lines and is re-read on every request, so
+editing it simulates validators moving or disappearing.
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RpcHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if request.get("method") == "getClusterNodes":
+            reply = {"jsonrpc": "2.0", "id": request.get("id"), "result": self.cluster_nodes()}
+        else:
+            reply = {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32601, "message": "Method not found"},
+            }
+        body = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def cluster_nodes(self) -> list[dict]:
+        nodes = []
+        for line in open(self.server.nodes_file):  # pyright:ignore
+            fields = line.split("#")[0].split()
+            if len(fields) >= 2:
+                nodes.append({"pubkey": fields[0], "tpuQuic": fields[1], "version": "fake"})
+        return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="fake_rpc", description="getClusterNodes stand-in")
+    parser.add_argument("nodes", type=str, help="file with 'pubkey ip:port' lines")
+    parser.add_argument("--listen", type=str, default="127.0.0.1:8899")
+    args = parser.parse_args()
+    host, port = args.listen.rsplit(":", 1)
+    server = ThreadingHTTPServer((host, int(port)), RpcHandler)
+    server.nodes_file = args.nodes  # pyright:ignore
+    print(f"Serving getClusterNodes from {args.nodes} on {args.listen}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Bottleneck queue and impairments of one direction of a link, as a tc tree on
+# the sending interface:
+#
+#   root netem: delay, jitter, loss, reorder    if any of them is set
+#     htb, one class at the bottleneck rate     if a rate is set
+#       leaf qdisc: pfifo / fq / fq_codel        if given, else the kernel default
+#
+# netem comes first and holds up to NETEM_LIMIT packets, so the delay line itself
+# never drops; what leaves it is shaped to the rate, and the leaf qdisc decides
+# what queues and what is dropped at the bottleneck.
+#
+# Leaf qdisc specs (--server-qdisc / --client-qdisc):
+#   pfifo:1000                 tail drop after 1000 packets
+#   fq  fq:10000               per-flow fair queueing, optionally with a packet limit
+#   fq_codel  fq_codel:5:100   fq_codel, optionally with target and interval in ms
+
+NETEM_LIMIT = 2000000
+HTB_BURST = "15k"
+
+
+def qdisc_args(spec: str) -> str:
+    kind, _, params = spec.partition(":")
+    values = params.split(":") if params else []
+    if kind == "pfifo":
+        return f"pfifo limit {int(values[0]) if values else 1000}"
+    if kind == "fq":
+        return "fq" + (f" limit {int(values[0])}" if values else "")
+    if kind == "fq_codel":
+        args = "fq_codel"
+        if values:
+            args += f" target {float(values[0])}ms"
+        if len(values) > 1:
+            args += f" interval {float(values[1])}ms"
+        return args
+    raise ValueError(f"unknown qdisc '{spec}'")
+
+
+def server_shape(args) -> dict | None:
+    """What the impairment options ask of the switch -> server direction, None if nothing."""
+    shape = {
+        "delay": args.server_delay,
+        "jitter": args.server_jitter,
+        "loss": args.server_loss,
+        "reorder": args.server_reorder,
+        "bandwidth": args.server_bw,
+        "qdisc": args.server_qdisc,
+    }
+    return shape if any(shape.values()) else None
+
+
+def client_shape(args, latency: float, bandwidth: float | None) -> dict | None:
+    """What the impairment options ask of a client -> switch direction, None if nothing.
+
+    The link's own delay and bandwidth are kept, the tree replaces the one
+    mininet built for them.
+    """
+    if not (args.loss_percentage or args.client_jitter or args.client_reorder or args.client_qdisc):
+        return None
+    return {
+        "delay": latency,
+        "jitter": args.client_jitter,
+        "loss": args.loss_percentage,
+        "reorder": args.client_reorder,
+        "bandwidth": bandwidth,
+        "qdisc": args.client_qdisc,
+    }
+
+
+def tc_commands(dev: str, shape: dict) -> list[str]:
+    delay, jitter = shape.get("delay") or 0, shape.get("jitter") or 0
+    loss, reorder = shape.get("loss") or 0, shape.get("reorder") or 0
+    if reorder and not delay:
+        raise ValueError(f"{dev}: netem reorders by sending some packets without the delay, set a delay")
+    commands = [f"tc qdisc del dev {dev} root"]
+    parent = "root"
+    if delay or jitter or loss or reorder:
+        netem = f"netem limit {NETEM_LIMIT}"
+        if delay or jitter:
+            netem += f" delay {delay}ms" + (f" {jitter}ms" if jitter else "")
+        if loss:
+            netem += f" loss {loss}%"
+        if reorder:
+            netem += f" reorder {reorder}%"
+        commands.append(f"tc qdisc add dev {dev} root handle 1: {netem}")
+        parent = "parent 1:1"
+    if shape.get("bandwidth"):
+        commands.append(f"tc qdisc add dev {dev} {parent} handle 2: htb default 1")
+        commands.append(
+            f"tc class add dev {dev} parent 2: classid 2:1 htb rate {shape['bandwidth']}mbit burst {HTB_BURST}"
+        )
+        parent = "parent 2:1"
+    if shape.get("qdisc"):
+        commands.append(f"tc qdisc add dev {dev} {parent} handle 3: {qdisc_args(shape['qdisc'])}")
+    return commands
+
+
+def apply(intf, shape: dict):
+    """Replaces the tc tree of a mininet interface with the one `shape` describes."""
+    commands = tc_commands(intf.name, shape)
+    # deleting the root fails harmlessly when there is none yet
+    intf.cmd(commands[0] + " 2>/dev/null")
+    for command in commands[1:]:
+        output = intf.cmd(command + " 2>&1")
+        if output.strip():
+            raise RuntimeError(f"{command} failed: {output.strip()}")
+    intf.impairment = shape
+
+
+def describe(shape: dict | None) -> str:
+    if shape is None:
+        return "unshaped"
+    parts = [f"{key}={value}" for key, value in shape.items() if value]
+    return " ".join(parts) or "unshaped"
@@ -0,0 +1,165 @@
+import json
+import os
+import time
+
+from client_node import ClientNode
+from make_txpool import mean_size
+
+# A trial at offered rate R returns {group: (offered, delivered)} for the groups
+# "all" and "stake <n>". A group passes if it delivered at least
+# (1 - tolerance) of what was offered to it. Offered is what the client pacers
+# meant to send, so both server-side loss and clients stalled by the server
+# (stream limits, flow control) count against the group.
+
+
+def add_knee_arguments(parser):
+    parser.add_argument(
+        "--find-knee",
+        type=str,
+        metavar="LO:HI",
+        help="bisect the aggregate offered TPS in [LO, HI] for the saturation knee",
+    )
+    parser.add_argument(
+        "--knee-tolerance",
+        type=float,
+        default=0.02,
+        help="fraction of offered transactions a passing trial may lose",
+    )
+    parser.add_argument(
+        "--knee-precision",
+        type=float,
+        default=0.05,
+        help="stop once every bracket is narrower than this fraction of its lower end",
+    )
+    parser.add_argument("--knee-trials", type=int, default=12, help="trial budget")
+
+
+def offered_tx_size(args, pubkeys: list[str]) -> float:
+    """Bytes per transaction the clients' pacers budget: --tx-size, or the pools' mean size.
+
+    Pools differ a little, the harmonic mean makes a shared bitrate add up to
+    the intended total TPS.
+    """
+    if not args.tx_pool:
+        return args.tx_size
+    sizes = []
+    for pubkey in pubkeys:
+        path = os.path.join(ClientNode.TX_POOL_DIR, f"{pubkey}.bin")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} is needed here to convert TPS to the pool's bitrate")
+        sizes.append(mean_size(path))
+    return len(sizes) / sum(1 / size for size in sizes)
+
+
+def offered_bitrate_flag(args, pubkeys: list[str]) -> str:
+    """--max-bitrate-bps for each client connection so all of them offer --offered-tps."""
+    if args.offered_tps is None:
+        return ""
+    per_connection_tps = args.offered_tps / (len(pubkeys) * args.num_connections)
+    return f" --max-bitrate-bps {per_connection_tps * offered_tx_size(args, pubkeys) * 8:.0f}"
+
+
+def group_by_stake(per_identity: dict[str, dict]) -> dict[str, tuple[int, int]]:
+    """Sums a parse.main() result into (offered, delivered) per stake tier and overall."""
+    groups = {}
+    for result in per_identity.values():
+        offered = result["intended"] or result["sent"]
+        for group in ("all", f"stake {result['stake']}"):
+            o, d = groups.get(group, (0, 0))
+            groups[group] = (o + offered, d + result["got"])
+    return groups
+
+
+def _brackets(history, groups, lo, hi):
+    """[lo, hi] per group: lowest failing rate and the highest passing rate below it."""
+    brackets = {}
+    for group in groups:
+        outcomes = [(t["rate"], t["passed"][group]) for t in history if group in t["passed"]]
+        failing = [rate for rate, ok in outcomes if not ok]
+        upper = min(failing, default=float("inf"))
+        passing = [rate for rate, ok in outcomes if ok and rate < upper]
+        brackets[group] = {
+            "lo": max(passing, default=lo),
+            "hi": min(upper, hi),
+            "lo_passed": bool(passing),
+            "hi_failed": bool(failing),
+        }
+    return brackets
+
+
+def search_knee(run_trial, lo: float, hi: float, tolerance=0.02, rel_precision=0.05, max_trials=12):
+    """Bisects offered load for the highest rate every group still keeps up with.
+
+    Brackets are kept per group and every trial is placed at the midpoint of the
+    widest one; its outcome narrows all brackets at once, so tiers that saturate
+    early and the aggregate share trials. The ends of the range are tried before
+    bisecting towards them, so a knee outside [lo, hi] is reported as such.
+    """
+    history = []
+    groups = set()
+    rate = hi
+    while len(history) < max_trials:
+        t0 = time.monotonic()
+        result = run_trial(rate)
+        trial = {
+            "rate": rate,
+            "time": time.monotonic() - t0,
+            "groups": {g: {"offered": o, "delivered": d} for g, (o, d) in result.items()},
+            "passed": {g: d >= (1 - tolerance) * o for g, (o, d) in result.items()},
+        }
+        history.append(trial)
+        groups.update(result)
+        print(
+            f"*** knee trial {len(history)}: {rate:.0f} TPS offered, "
+            + ", ".join(f"{g} {'ok' if ok else 'FAIL'}" for g, ok in sorted(trial["passed"].items()))
+        )
+
+        brackets = _brackets(history, groups, lo, hi)
+        open_brackets = [
+            b for b in brackets.values() if b["hi_failed"] and b["hi"] - b["lo"] > rel_precision * b["lo"]
+        ]
+        if not open_brackets:
+            break
+        widest = max(open_brackets, key=lambda b: (b["hi"] - b["lo"]) / max(b["lo"], 1.0))
+        if widest["lo_passed"] or any(t["rate"] == lo for t in history):
+            rate = (widest["lo"] + widest["hi"]) / 2
+        else:
+            # make sure the range starts low enough before bisecting towards it
+            rate = lo
+
+    brackets = _brackets(history, groups, lo, hi)
+    knees = {
+        group: {
+            # None: even the lower end of the range saturated this group
+            "knee_tps": b["lo"] if b["lo_passed"] or not b["hi_failed"] else None,
+            "upper_tps": b["hi"] if b["hi_failed"] else None,
+        }
+        for group, b in brackets.items()
+    }
+    return knees, history
+
+
+def run_knee_search(args, run_trial, out_path="knee_search.json"):
+    """Runs the search for --find-knee, prints the knees and saves them with the trial history."""
+    lo, hi = map(float, args.find_knee.split(":"))
+    knees, history = search_knee(
+        run_trial, lo, hi, args.knee_tolerance, args.knee_precision, args.knee_trials
+    )
+    print("=== saturation knee (offered TPS)")
+    for group, knee in sorted(knees.items(), key=lambda kv: (kv[0] != "all", kv[0])):
+        if knee["knee_tps"] is None:
+            print(f"{group:>16}: saturated below {lo:.0f}")
+        elif knee["upper_tps"] is None:
+            print(f"{group:>16}: keeps up at {hi:.0f}, knee is above the range")
+        else:
+            print(f"{group:>16}: {knee['knee_tps']:.0f} (fails at {knee['upper_tps']:.0f})")
+    report = {
+        "config": {
+            k: v for k, v in vars(args).items() if isinstance(v, (int, float, str, bool, type(None)))
+        },
+        "knees": knees,
+        "trials": history,
+    }
+    json.dump(report, open(out_path, "w"), indent=1)
+    print(f"Trial history written to {out_path}")
+    return knees
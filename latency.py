@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+
+import numpy as np
+from base58 import b58encode
+
+from datatypes import send_record_dtype
+from results_loader import CHUNK_RECORDS, IdentityIndex, load_server_log, load_stakes, map_records
+
+# End-to-end latency needs every received transaction matched to its send. The
+# client writes its transaction id into payload bytes 32..40 (and logs it with
+# the connection in <host>-sendlog.bin), but serverlog.bin only carries the
+# identity, size and receive time, so sends and receives cannot be paired:
+# matching them by rank is wrong as soon as one transaction is lost or an
+# identity has more than one stream in flight, which is the regime this is for.
+# Until the server logs the transaction id, this reports what the logs do
+# determine: per identity how many sends were logged, how many the server
+# received, and when each side started and ended.
+
+
+def receive_times(server_log: np.ndarray, index: IdentityIndex) -> list[np.ndarray]:
+    """Sorted server receive times per known identity, from one pass over the log."""
+    parts = [[] for _ in range(len(index))]
+    for start in range(0, len(server_log), CHUNK_RECORDS):
+        chunk = server_log[start : start + CHUNK_RECORDS]
+        codes = index.codes(chunk)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(index) + 1))
+        times = chunk["time"][order]
+        for i in range(len(index)):
+            parts[i].append(times[bounds[i] : bounds[i + 1]])
+    return [np.sort(np.concatenate(p)) if p else np.empty(0, np.uint64) for p in parts]
+
+
+def span(times: np.ndarray) -> dict:
+    if len(times) == 0:
+        return {"first": None, "last": None}
+    return {"first": int(times.min()), "last": int(times.max())}
+
+
+def main(hosts_file: str, results_dir: str = "results"):
+    stakes = load_stakes(hosts_file)
+    index = IdentityIndex(list(stakes))
+    received = receive_times(load_server_log(os.path.join(results_dir, "serverlog.bin")), index)
+
+    report = {"percentiles": None, "identities": {}}
+    print("No latency percentiles: serverlog.bin has no transaction ids to match sends with")
+    for i, (id, stake) in enumerate(stakes.items()):
+        b58_id = b58encode(id).decode("ascii")
+        path = os.path.join(results_dir, f"{b58_id}-sendlog.bin")
+        if not os.path.exists(path):
+            print(f"{b58_id}: no send log")
+            continue
+        sent = map_records(path, send_record_dtype)["time"]
+        entry = {
+            "stake": stake,
+            "sent": len(sent),
+            "received": len(received[i]),
+            "send": span(sent),
+            "receive": span(received[i]),
+        }
+        report["identities"][b58_id] = entry
+        print(
+            f"{b58_id[0:7]:>24} stake {stake:<12} logged sends {len(sent):<9} received {len(received[i]):<9}"
+            f" not received {len(sent) - len(received[i])}"
+        )
+    json.dump(report, open(os.path.join(results_dir, "latency.json"), "w"), indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="latency",
+        description="send log and server log counts per identity (latency needs transaction ids in the server log)",
+        epilog="If you encounter some bug, I wish you a luck ©No-Manuel Macros",
+    )
+    parser.add_argument("hosts", type=str, help="file with staked accounts")
+    args = parser.parse_args()
+    main(args.hosts)
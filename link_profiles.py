@@ -0,0 +1,103 @@
+import numpy as np
+
+# Spec strings for --latency-dist / --bandwidth-dist:
+#   fixed:50              every client gets 50
+#   uniform:10:120        uniform in [10, 120]
+#   normal:60:20          mean 60, stddev 20 (clipped at 0)
+#   lognormal:60:0.5      median 60, log-space sigma 0.5
+#   choice:10,25,50,100   picked uniformly from the list
+
+
+def sample(spec: str, count: int, rng: np.random.Generator) -> np.ndarray:
+    kind, _, params = spec.partition(":")
+    if kind == "fixed":
+        return np.full(count, float(params))
+    if kind == "uniform":
+        low, high = map(float, params.split(":"))
+        return rng.uniform(low, high, count)
+    if kind == "normal":
+        mean, std = map(float, params.split(":"))
+        return np.clip(rng.normal(mean, std, count), 0, None)
+    if kind == "lognormal":
+        median, sigma = map(float, params.split(":"))
+        return rng.lognormal(np.log(median), sigma, count)
+    if kind == "choice":
+        return rng.choice([float(v) for v in params.split(",")], count)
+    raise ValueError(f"unknown distribution '{spec}'")
+
+
+def _is_number(field: str) -> bool:
+    # a base58 pubkey made of digits only would parse, but no latency is 32+ digits long
+    if len(field) >= 32:
+        return False
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def read_profile(path: str, identities: list[str]) -> dict[str, tuple[float, float | None]]:
+    """Reads a link profile file.
+
+    Each line is `[pubkey] latency_ms [bandwidth_mbit]`. Lines starting with a
+    known pubkey pin that client; the remaining lines (e.g. an RTT table) are
+    handed out in order to the other clients, wrapping around if needed. Lines
+    pinning a pubkey that is not among `identities` are skipped with a warning.
+    """
+    pinned = {}
+    table = []
+    known = set(identities)
+    for number, line in enumerate(open(path).readlines(), 1):
+        fields = line.split("#")[0].split()
+        if not fields:
+            continue
+        if fields[0] in known:
+            pubkey, fields = fields[0], fields[1:]
+        elif not _is_number(fields[0]):
+            print(f"[WARNING] {path}:{number}: {fields[0]} is not one of the clients, line skipped")
+            continue
+        else:
+            pubkey = None
+        entry = (float(fields[0]), float(fields[1]) if len(fields) > 1 else None)
+        if pubkey is None:
+            table.append(entry)
+        else:
+            pinned[pubkey] = entry
+    rest = [pk for pk in identities if pk not in pinned]
+    if rest and not table:
+        raise ValueError(f"{path} has no entries for {len(rest)} clients")
+    for i, pubkey in enumerate(rest):
+        pinned[pubkey] = table[i % len(table)]
+    return pinned
+
+
+def assign_links(identities: list[str], args) -> dict[str, dict]:
+    """Per-client {"latency": ms, "bandwidth": Mbit/s or None}.
+
+    Precedence: --link-profile, then --latency-dist/--bandwidth-dist, then --latency.
+    The same seed always gives the same assignment.
+    """
+    rng = np.random.default_rng(args.seed)
+    if args.link_profile is not None:
+        profile = read_profile(args.link_profile, identities)
+        return {
+            pk: {"latency": round(profile[pk][0], 1), "bandwidth": profile[pk][1]}
+            for pk in identities
+        }
+    if args.latency_dist is not None:
+        latencies = sample(args.latency_dist, len(identities), rng)
+    else:
+        latencies = np.full(len(identities), float(args.latency))
+    if args.bandwidth_dist is not None:
+        bandwidths = sample(args.bandwidth_dist, len(identities), rng)
+    else:
+        bandwidths = [None] * len(identities)
+    return {
+        pk: {
+            "latency": round(float(latency), 1),
+            "bandwidth": None if bw is None else round(float(bw), 1),
+        }
+        for pk, latency, bw in zip(identities, latencies, bandwidths)
+    }
+
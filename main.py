@@ -6,16 +6,22 @@ import os
 import subprocess
 import sys
 from subprocess import call
+import impairments
+import latency
 import parse
+import preflight
 from mininet.link import TCLink
 from mininet.log import setLogLevel
 from mininet.net import Mininet
 from mininet.node import OVSController
 
 from tooling import watchdog, mk_results_dir
-from client_node import ClientNode
+from client_node import ClientNode, add_congestion_arguments, congestion_flags, congestion_spec
+from link_profiles import assign_links
+from pcap_analyze import capture_command
+from knee_search import add_knee_arguments, group_by_stake, offered_bitrate_flag, run_knee_search
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(
         prog="streamer_torture",
         description="Solana validator Simulation",
@@ -23,7 +29,24 @@ def main():
     )
     parser.add_argument("hosts", type=str, help="file with staked accounts")
     parser.add_argument("--loss-percentage", type=int, default=0,
-                        choices=list(range(0, 100)), help="0-99 allowed")
+                        choices=list(range(0, 100)), help="netem loss on every client uplink, 0-99 allowed")
+    parser.add_argument("--client-jitter", type=float, default=0, help="netem jitter (ms) on every client uplink")
+    parser.add_argument(
+        "--client-reorder", type=float, default=0, help="percentage of client datagrams sent ahead of the delay"
+    )
+    parser.add_argument(
+        "--client-qdisc", type=str, help="leaf qdisc of every client uplink: pfifo:N, fq[:N], fq_codel[:TARGET:INTERVAL]"
+    )
+    parser.add_argument("--server-bw", type=float, help="bandwidth (Mbit/s) of the link into the server")
+    parser.add_argument(
+        "--server-qdisc", type=str, help="bottleneck qdisc in front of the server: pfifo:N, fq[:N], fq_codel[:TARGET:INTERVAL]"
+    )
+    parser.add_argument("--server-delay", type=float, default=0, help="extra delay (ms) in front of the server")
+    parser.add_argument("--server-jitter", type=float, default=0, help="netem jitter (ms) in front of the server")
+    parser.add_argument("--server-loss", type=float, default=0, help="netem loss (%%) in front of the server")
+    parser.add_argument(
+        "--server-reorder", type=float, default=0, help="percentage of datagrams sent ahead of --server-delay"
+    )
     parser.add_argument(
         "--iperf", action="store_true", help="Run iperf instead of agave"
     )
@@ -31,6 +54,24 @@ def main():
         "--duration", type=float, help="how long to run the test for", default=3.0
     )
     parser.add_argument("--latency", type=int, help="override latency", default=50)
+    parser.add_argument(
+        "--latency-dist",
+        type=str,
+        help="per-client latency distribution, e.g. uniform:10:120 (overrides --latency)",
+    )
+    parser.add_argument(
+        "--bandwidth-dist",
+        type=str,
+        help="per-client bandwidth distribution in Mbit/s, e.g. choice:100,1000",
+    )
+    parser.add_argument(
+        "--link-profile",
+        type=str,
+        help="file with '[pubkey] latency_ms [bandwidth_mbit]' lines (overrides the distributions)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed for the per-client link distributions"
+    )
     parser.add_argument(
         "--num_connections",
         type=int,
@@ -46,7 +87,19 @@ def main():
     parser.add_argument(
         "--disable_congestion", action="store_true", help="Disable congestion control"
     )
+    add_congestion_arguments(parser)
     parser.add_argument("--tx-size", type=int, help="Transaction size", default=1000)
+    parser.add_argument(
+        "--max-in-flight-streams",
+        type=int,
+        help="uni streams each client connection keeps in flight",
+        default=1,
+    )
+    parser.add_argument(
+        "--send-log",
+        action="store_true",
+        help="clients log every send (<host>-sendlog.bin); latency.py reports them against the server log",
+    )
     parser.add_argument(
         "--max-tps",
         type=int,
@@ -55,32 +108,122 @@ def main():
     parser.add_argument(
         "--server", type=str, help="Server binary path", default="./swqos"
     )
+    parser.add_argument(
+        "--tx-pool",
+        action="store_true",
+        help="clients send pre-signed transactions from txpools/ (make_txpool.py) instead of dummy payloads",
+    )
+    parser.add_argument(
+        "--offered-tps",
+        type=float,
+        help="total TPS offered by all clients, split evenly (default: client bitrate limit)",
+    )
+    parser.add_argument(
+        "--identities-per-host",
+        type=int,
+        default=1,
+        help="identities sharing one client host, link and client process (hosts file order)",
+    )
+    parser.add_argument(
+        "--resource-interval-ms",
+        type=float,
+        default=10.0,
+        help="sample server CPU, memory and UDP drops this often into results/ (0 disables)",
+    )
+    parser.add_argument(
+        "--capture-server", action="store_true", help="ring-buffered tcpdump of the server link into results/"
+    )
+    parser.add_argument(
+        "--capture-client",
+        type=str,
+        action="append",
+        default=[],
+        help="also capture the link of the client host running this identity (pubkey prefix), repeatable",
+    )
+    parser.add_argument("--capture-file-mb", type=int, default=100, help="size of one capture ring file")
+    parser.add_argument("--capture-files", type=int, default=10, help="ring files kept per captured link")
+    parser.add_argument(
+        "--preflight-duration",
+        type=float,
+        default=3.0,
+        help="seconds of concurrent iperf3 UDP from all clients to measure the network ceiling (0 skips it)",
+    )
+    parser.add_argument("--label", type=str, help="tag stored with the run in runs.db")
+    add_knee_arguments(parser)
 
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
 
     mk_results_dir()
 
-    client_identities = [
-        line.strip().split(" ")[0].strip() for line in open(args.hosts, "r").readlines()
-    ]
+    client_identities = read_identities(args.hosts)
 
     net, server_node, client_nodes = topology(client_identities, args)
+    apply_impairments(args, server_node, client_nodes)
+    ceiling = measure_ceiling(args, server_node, client_nodes)
+    if args.find_knee is not None:
+        run_knee_search(args, lambda rate: knee_trial(args, server_node, client_nodes, rate, ceiling))
+        print("*** Stopping network")
+        net.stop()
+        return
+    write_config(args, client_nodes, ceiling)
+
+    run_test(args, server_node, client_nodes)
+
+    print("*** Stopping network")
+    net.stop()
+    parse.main(args.hosts, label=args.label)
+    if args.send_log:
+        latency.main(args.hosts)
+
+
+def knee_trial(args, server_node, client_nodes, offered_tps, ceiling=None):
+    """One short run at the given aggregate offered load, summed per stake tier."""
+    mk_results_dir()
+    args.offered_tps = offered_tps
+    write_config(args, client_nodes, ceiling)
+    run_test(args, server_node, client_nodes)
+    return group_by_stake(parse.main(args.hosts, record=False))
+
 
+def active_clients(args, client_nodes):
+    return client_nodes if args.num_clients == 0 else client_nodes[: args.num_clients]
+
+
+def measure_ceiling(args, server_node, client_nodes):
+    """config.json keys of the network ceiling measured before the run, none if skipped."""
+    if args.iperf or args.preflight_duration <= 0:
+        return {}
+    return preflight.measure(args, server_node, active_clients(args, client_nodes))
+
+
+def read_identities(hosts_file):
+    return [
+        line.strip().split(" ")[0].strip() for line in open(hosts_file, "r").readlines()
+    ]
+
+
+def run_test(args, server_node, client_nodes):
     print("Environment is up.\nRunning a server")
 
     if args.iperf:
-        cmd = "iperf3 -s -1"
+        cmd = "exec iperf3 -s -1"
+        port = 5201
     else:
         max_tps = f" --max-tps {args.max_tps}" if args.max_tps is not None else ""
-        cmd = f"{args.server} --test-duration {args.duration + 5.0} --stake-amounts solana_pubkeys.txt --bind-to 0.0.0.0:8000 --log-file ./results/serverlog.bin {max_tps}"
-    flags = ""
-    if args.disable_congestion:
-        flags += "--disable-congestion"
-    # srv_tcpdump = subprocess.Popen(f"{cli} tcpdump -i srv-br -w capture_server.pcap",
-    #                        shell=True, text=True,
-    #                        stdout=subprocess.PIPE,
-    #                        stderr=subprocess.PIPE,
-    #                        )
+        port = 8000
+        # exec so that server.pid is the server itself, which the resource sampler watches
+        cmd = f"exec {args.server} --test-duration {args.duration + 5.0} --stake-amounts solana_pubkeys.txt --bind-to 0.0.0.0:8000 --log-file ./results/serverlog.bin {max_tps}"
+    flags = congestion_flags(args)
+    flags += f" --max-in-flight-streams {args.max_in_flight_streams}"
+    if args.send_log:
+        flags += " --send-log"
+    active_nodes = active_clients(args, client_nodes)
+    flags += offered_bitrate_flag(args, [pubkey for node in active_nodes for pubkey in node.pubkeys])
+    captures = start_captures(args, server_node, client_nodes, port)
     print(f"Running {cmd}")
     server = server_node.popen(
         cmd,
@@ -91,6 +234,15 @@ def main():
         env=os.environ.copy(),
         bufsize=1,
     )
+    sampler = None
+    if args.resource_interval_ms > 0:
+        sampler = server_node.popen(
+            f"exec {sys.executable} {os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resource_sampler.py')}"
+            f" --pid {server.pid} --port {port} --interval-ms {args.resource_interval_ms}",
+            shell=True,
+            stdout=subprocess.DEVNULL,
+            stderr=sys.stdout,
+        )
 
     for i, node in enumerate(client_nodes):
         if args.num_clients != 0 and i >= args.num_clients:
@@ -109,6 +261,7 @@ def main():
                 duration=args.duration,
                 tx_size=args.tx_size,
                 flags=flags,
+                tx_pool=args.tx_pool,
             )
 
     try:
@@ -117,6 +270,13 @@ def main():
         server.kill()
         print("Server killed")
     server.wait()
+    if sampler is not None:
+        # it stops by itself once the server is gone
+        try:
+            sampler.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            sampler.terminate()
+            sampler.wait()
     print("========Stopping clients=======")
     for node in client_nodes:
     #     res = node.mininet_host.popen(
@@ -137,21 +297,34 @@ def main():
     #     res.wait()
          node.wait()
 
-    # srv_tcpdump.terminate()
-    # print("Waiting on server tcpdump")
-    # srv_tcpdump.wait()
+    for capture in captures:
+        capture.terminate()
+        capture.wait()
     subprocess.run("sudo chmod a+rw -R ./results/", shell=True, text=True, check=True)
-    subprocess.run("sudo chmod a+rw  datapoints.csv", shell=True, text=True, check=False)
     # print("*** Running CLI")
     # CLI(net)
 
-    print("*** Stopping network")
-    net.stop()
-    parse.main(args.hosts)
+
+def start_captures(args, server_node, client_nodes, port):
+    links = []
+    if args.capture_server:
+        links.append((server_node, "server"))
+    for prefix in args.capture_client:
+        nodes = [node for node in client_nodes if any(pk.startswith(prefix) for pk in node.pubkeys)]
+        if not nodes:
+            raise ValueError(f"--capture-client {prefix}: no client host runs such an identity")
+        links.append((nodes[0].mininet_host, nodes[0].pubkey))
+    captures = []
+    for host, name in links:
+        cmd = capture_command(
+            host.defaultIntf().name, name, port, args.capture_file_mb, args.capture_files
+        )
+        print(f"Capturing {name}: {cmd}")
+        captures.append(host.popen(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=sys.stdout))
+    return captures
 
 
 def topology(client_identities, args):
-    configs = {"duration": args.duration, "tx-size": args.tx_size}
     net = Mininet(controller=OVSController, link=TCLink)
     switch = net.addSwitch("s1")
     _ = net.addController("c0")
@@ -167,21 +340,36 @@ def topology(client_identities, args):
     client_nodes = []
     print("*** Creating clients")
 
-    for host_id in client_identities:
+    # identities sharing a host share its link, drawn for the first of them
+    groups = [
+        client_identities[i : i + args.identities_per_host]
+        for i in range(0, len(client_identities), args.identities_per_host)
+    ]
+    links = assign_links([group[0] for group in groups], args)
+    for group in groups:
+        host_id = group[0]
         host = net.addHost("client")
-        link_delay = args.latency
-        net.addLink(
+        link_delay = links[host_id]["latency"]
+        bandwidth = links[host_id]["bandwidth"]
+        link = net.addLink(
             host,
             switch,
             delay=f"{link_delay}ms",
-            #loss=1,
+            bw=bandwidth,
             max_queue_size=2000000,
             gro=False,
             txo=False,
             rxo=False,
         )
-        configs[host_id] = {"latency": link_delay}
-        client_nodes.append(ClientNode(pubkey=host_id, latency=link_delay, mininet_host=host))
+        client_nodes.append(
+            ClientNode(
+                pubkey=group,
+                latency=link_delay,
+                bandwidth=bandwidth,
+                mininet_host=host,
+                link=link,
+            )
+        )
 
     print("*** Starting network")
     net.start()
@@ -190,10 +378,83 @@ def topology(client_identities, args):
 
     # print("*** Testing connectivity")
     # net.pingAll()
-    json.dump(configs, open("results/config.json", "w"))
     return net, server, client_nodes
 
 
+def apply_impairments(args, server_node, client_nodes):
+    """Builds the tc trees the impairment options ask for, and restores links they no longer cover."""
+    server_intf = server_node.defaultIntf().link.intf2  # switch side, shapes what reaches the server
+    shape = impairments.server_shape(args)
+    if shape is not None:
+        impairments.apply(server_intf, shape)
+    elif getattr(server_intf, "impairment", None) is not None:
+        server_intf.config(max_queue_size=2000000, gro=False, txo=False, rxo=False)
+        server_intf.impairment = None
+    print(f"*** Server link: {impairments.describe(shape)}")
+    for node in client_nodes:
+        client_intf = node.link.intf1  # client side, shapes what the client sends
+        shape = impairments.client_shape(args, node.latency, node.bandwidth)
+        if shape is not None:
+            impairments.apply(client_intf, shape)
+        elif getattr(client_intf, "impairment", None) is not None:
+            set_client_link(node, node.latency, node.bandwidth)
+
+
+def set_client_link(node, latency, bandwidth=None):
+    """Changes delay/bandwidth of an existing client link in place (tc on both ends)."""
+    for intf in (node.link.intf1, node.link.intf2):
+        intf.config(
+            delay=f"{latency}ms",
+            bw=bandwidth,
+            max_queue_size=2000000,
+            gro=False,
+            txo=False,
+            rxo=False,
+        )
+        intf.impairment = None
+    node.latency = latency
+    node.bandwidth = bandwidth
+
+
+def write_config(args, client_nodes, ceiling=None):
+    configs = {
+        "duration": args.duration,
+        "tx-size": args.tx_size,
+        "max-in-flight-streams": args.max_in_flight_streams,
+        "latency-dist": args.latency_dist,
+        "bandwidth-dist": args.bandwidth_dist,
+        "link-profile": args.link_profile,
+        "seed": args.seed,
+        "send-log": args.send_log,
+        "offered-tps": args.offered_tps,
+        "tx-pool": args.tx_pool,
+        "server": "iperf3" if args.iperf else args.server,
+        "max-tps": args.max_tps,
+        "num-connections": args.num_connections,
+        "num-clients": args.num_clients or len(client_nodes),
+        "identities-per-host": args.identities_per_host,
+        "disable-congestion": args.disable_congestion,
+        "congestion": congestion_spec(args),
+        "resource-interval-ms": args.resource_interval_ms,
+        "capture": (["server"] if args.capture_server else []) + args.capture_client,
+        "loss-percentage": args.loss_percentage,
+        "client-jitter": args.client_jitter,
+        "client-reorder": args.client_reorder,
+        "client-qdisc": args.client_qdisc,
+        "server-bw": args.server_bw,
+        "server-qdisc": args.server_qdisc,
+        "server-delay": args.server_delay,
+        "server-jitter": args.server_jitter,
+        "server-loss": args.server_loss,
+        "server-reorder": args.server_reorder,
+    }
+    configs.update(ceiling or {})
+    for node in client_nodes:
+        for pubkey in node.pubkeys:
+            configs[pubkey] = {"latency": node.latency, "bandwidth": node.bandwidth}
+    json.dump(configs, open("results/config.json", "w"))
+
+
 if __name__ == "__main__":
     setLogLevel("info")
     with watchdog(60):
@@ -4,11 +4,17 @@ import shutil
 from pathlib import Path
 import argparse
 
+import make_txpool
+
 parser = argparse.ArgumentParser(prog='make_stakes',description="Stake identity maker",
                                      )
 parser.add_argument('hosts',type=int, default=5, help='how many to make')
 parser.add_argument('--min-stake', type=int, default=10000, help='min stake in SOL')
 parser.add_argument('--max-stake', type=int, default=10000, help='max stake in SOL')
+parser.add_argument('--tx-pool', type=int, default=0,
+                    help='also build pools of this many pre-signed transactions per identity')
+parser.add_argument('--size-mix', type=str, default="200:0.3,512:0.4,1232:0.3",
+                    help='transaction size:weight mix of the pools')
 args = parser.parse_args()
 # --- Configuration ---
 
@@ -51,3 +57,6 @@ with output_file.open("w") as f:
         f.write(f"{pk} {stake}\n")
 
 print(f"Generated {args.hosts} keypairs. Public keys written to {output_file}")
+
+if args.tx_pool:
+    make_txpool.main(str(output_file), args.tx_pool, args.size_mix, key_dir=str(keypair_dir))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Builds pools of pre-signed transactions for the client's --tx-pool.
+
+    ./make_txpool.py solana_pubkeys.txt --count 16384 --size-mix 200:0.3,512:0.4,1232:0.3
+
+Every identity gets txpools/<pubkey>.bin holding legacy Solana transactions
+signed by its keypair: a system transfer to a random account plus a memo
+instruction padded to the drawn size (memo only for sizes too small to fit
+the transfer). Layout (little endian), as read by mock_server/src/tx_pool.rs:
+  header, 64 bytes: b"TXPOOL\\0\\0", version u32, slot_size u32, count u64, pubkey [32]
+  count slots of SLOT_SIZE bytes: length u16, transaction, zero padding
+"""
+
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+from base58 import b58decode
+
+MAGIC = b"TXPOOL\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ32s8x")
+PACKET_DATA_SIZE = 1232
+# length prefix plus the largest transaction, rounded up to 8 bytes
+SLOT_SIZE = (2 + PACKET_DATA_SIZE + 7) // 8 * 8
+
+SYSTEM_PROGRAM = bytes(32)
+MEMO_PROGRAM = b58decode("MemoSq4gqABAXKb96qnH8TysNcWxMyWCqXgDLGmfcHr")
+MEMO_ALPHABET = np.frombuffer(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", dtype=np.uint8)
+
+
+def load_signer(keypair_path: str):
+    """sign(message) -> 64-byte signature for a solana-keygen JSON keypair."""
+    secret = bytes(json.load(open(keypair_path)))
+    seed = secret[:32]
+    try:
+        from nacl.signing import SigningKey
+
+        key = SigningKey(seed)
+        return lambda message: key.sign(message).signature
+    except ImportError:
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+        return Ed25519PrivateKey.from_private_bytes(seed).sign
+
+
+def shortvec(n: int) -> bytes:
+    """Solana's compact-u16 length encoding."""
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def memo_instruction(program_index: int, memo: bytes) -> bytes:
+    return bytes([program_index]) + shortvec(0) + shortvec(len(memo)) + memo
+
+
+def build_message(payer: bytes, blockhash: bytes, memo: bytes, dest: bytes | None, lamports: int) -> bytes:
+    if dest is None:
+        header = bytes([1, 0, 1])
+        keys = [payer, MEMO_PROGRAM]
+        instructions = [memo_instruction(1, memo)]
+    else:
+        header = bytes([1, 0, 2])
+        keys = [payer, dest, SYSTEM_PROGRAM, MEMO_PROGRAM]
+        transfer = struct.pack("<IQ", 2, lamports)
+        instructions = [
+            bytes([2]) + shortvec(2) + bytes([0, 1]) + shortvec(len(transfer)) + transfer,
+            memo_instruction(3, memo),
+        ]
+    return (
+        header
+        + shortvec(len(keys))
+        + b"".join(keys)
+        + blockhash
+        + shortvec(len(instructions))
+        + b"".join(instructions)
+    )
+
+
+def memo_length(size: int, with_transfer: bool) -> int:
+    """Memo bytes that make the signed transaction exactly `size` bytes, or -1."""
+    base = 1 + 64 + len(build_message(bytes(32), bytes(32), b"", bytes(32) if with_transfer else None, 0))
+    # the memo's own length prefix grows from one byte to two at 128
+    for length in (size - base, size - base - 1):
+        if length >= 0 and base + length + len(shortvec(length)) - 1 == size:
+            return length
+    return -1
+
+
+def build_transaction(sign, payer: bytes, blockhash: bytes, size: int, lamports: int, rng) -> bytes:
+    with_transfer = memo_length(size, True) >= 0
+    length = memo_length(size, with_transfer)
+    if length < 0:
+        raise ValueError(f"cannot build a {size} byte transaction")
+    memo = MEMO_ALPHABET[rng.integers(0, len(MEMO_ALPHABET), length)].tobytes()
+    dest = rng.bytes(32) if with_transfer else None
+    message = build_message(payer, blockhash, memo, dest, lamports)
+    tx = shortvec(1) + sign(message) + message
+    assert len(tx) == size, (len(tx), size)
+    return tx
+
+
+def parse_size_mix(spec: str) -> tuple[np.ndarray, np.ndarray]:
+    sizes, weights = [], []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    weights = np.array(weights)
+    return np.array(sizes), weights / weights.sum()
+
+
+def write_pool(path: str, keypair_path: str, pubkey: str, count: int, size_mix: str, seed: int):
+    sign = load_signer(keypair_path)
+    payer = b58decode(pubkey)
+    rng = np.random.default_rng([seed, int.from_bytes(payer[:8], "little")])
+    sizes, weights = parse_size_mix(size_mix)
+    if sizes.max() > PACKET_DATA_SIZE:
+        raise ValueError(f"transactions are limited to {PACKET_DATA_SIZE} bytes")
+    blockhash = rng.bytes(32)
+    pool = np.zeros((count, SLOT_SIZE), dtype=np.uint8)
+    for i, size in enumerate(rng.choice(sizes, count, p=weights)):
+        tx = build_transaction(sign, payer, blockhash, int(size), i + 1, rng)
+        pool[i, 0:2] = np.frombuffer(struct.pack("<H", len(tx)), dtype=np.uint8)
+        pool[i, 2 : 2 + len(tx)] = np.frombuffer(tx, dtype=np.uint8)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, SLOT_SIZE, count, payer))
+        pool.tofile(f)
+
+
+def mean_size(path: str) -> float:
+    """Mean transaction size of a pool, what the client's pacer budgets per send."""
+    with open(path, "rb") as f:
+        magic, version, slot_size, count, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or count == 0:
+        raise ValueError(f"{path} is not a transaction pool")
+    slots = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size, shape=(count, slot_size))
+    lengths = slots[:, 0].astype(np.int64) | slots[:, 1].astype(np.int64) << 8
+    return float(lengths.mean())
+
+
+def main(hosts_file: str, count: int, size_mix: str, key_dir="solana_keypairs", out_dir="txpools", seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    pubkeys = [line.split()[0] for line in open(hosts_file) if line.strip()]
+    for pubkey in pubkeys:
+        path = os.path.join(out_dir, f"{pubkey}.bin")
+        write_pool(path, os.path.join(key_dir, f"{pubkey}.json"), pubkey, count, size_mix, seed)
+        print(f"Wrote {count} transactions to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="make_txpool", description="pre-signed transaction pools for the mock client"
+    )
+    parser.add_argument("hosts", type=str, help="file with staked accounts")
+    parser.add_argument("--count", type=int, default=16384, help="transactions per identity")
+    parser.add_argument(
+        "--size-mix",
+        type=str,
+        default="200:0.3,512:0.4,1232:0.3",
+        help="size:weight,... of the transactions, sizes from 169 to 1232 bytes",
+    )
+    parser.add_argument("--key-dir", type=str, default="solana_keypairs")
+    parser.add_argument("--out-dir", type=str, default="txpools")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.hosts, args.count, args.size_mix, args.key_dir, args.out_dir, args.seed)
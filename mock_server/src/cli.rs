@@ -1,6 +1,16 @@
 use {
-    clap::{crate_description, crate_name, crate_version, Parser},
-    std::{net::SocketAddr, path::PathBuf, time::Duration},
+    crate::{
+        quic_networking::CongestionController,
+        runtime::{parse_core_list, CoreList},
+        stats_collection::{parse_stats_fields, StatsFields},
+    },
+    anyhow::Context,
+    clap::{crate_description, crate_name, crate_version, Parser, ValueEnum},
+    std::{
+        net::SocketAddr,
+        path::{Path, PathBuf},
+        time::Duration,
+    },
 };
 
 #[derive(Parser, Debug, Clone)]
@@ -14,8 +24,19 @@ pub struct ClientCliParameters {
     pub target: SocketAddr,
 
     // Cannot use value_parser to read keypair file because Keypair is not Clone.
-    #[clap(long, help = "validator identity for staked connection")]
-    pub staked_identity_file: Option<PathBuf>,
+    #[clap(
+        long,
+        help = "validator identity for staked connection. Repeat it to run several identities \
+        from one process, each with its own connections and result files named after its pubkey"
+    )]
+    pub staked_identity_file: Vec<PathBuf>,
+
+    #[clap(
+        long,
+        conflicts_with_all = ["staked_identity_file", "targets_file"],
+        help = "Run every keypair (*.json) in this directory, as with repeated --staked-identity-file"
+    )]
+    pub identity_dir: Option<PathBuf>,
 
     /// Address to bind on, default will listen on all available interfaces, 0 that
     /// OS will choose the port.
@@ -44,6 +65,13 @@ pub struct ClientCliParameters {
     )]
     pub max_bitrate_bps: f64,
 
+    #[clap(
+        long,
+        help = "Transactions the pacer may release back to back. \
+        By default enough to cover ~2ms at the configured rate."
+    )]
+    pub pacing_burst: Option<u32>,
+
     // it is u64 (instead of usize) because clap value parser doesn't
     // work properly with usize.
     #[clap(long,
@@ -58,11 +86,204 @@ pub struct ClientCliParameters {
     )]
     pub num_connections: usize,
 
-    #[clap(long, help = "Disable congestion control")]
+    #[clap(
+        long,
+        help = "Maximum number of uni streams kept in flight per connection. \
+        With 1 every transaction waits for the previous one to be written.",
+        default_value = "1"
+    )]
+    pub max_in_flight_streams: usize,
+
+    #[clap(
+        long,
+        help = "Worker threads of each tokio runtime",
+        default_value = "8"
+    )]
+    pub worker_threads: usize,
+
+    #[clap(
+        long,
+        help = "Number of tokio runtimes, connections are spread over them round-robin",
+        default_value = "1"
+    )]
+    pub num_runtimes: usize,
+
+    #[clap(
+        long,
+        value_parser = parse_core_list,
+        help = "Pin runtime threads to these cores, e.g. 0-7,16-23"
+    )]
+    pub pin_cores: Option<CoreList>,
+
+    #[clap(
+        long,
+        help = "Send pre-signed transactions from this pool file (see make_txpool.py) \
+        instead of dummy payloads, or from <dir>/<pubkey>.bin if it is a directory. \
+        The pacer then budgets the pool's mean size instead of --tx-size."
+    )]
+    pub tx_pool: Option<PathBuf>,
+
+    #[clap(
+        long,
+        conflicts_with = "congestion",
+        help = "Disable congestion control, same as --congestion fixed with the default --fixed-window"
+    )]
     pub disable_congestion: bool,
 
+    #[clap(
+        long,
+        value_enum,
+        default_value = "cubic",
+        help = "Congestion controller of every connection: quinn's cubic, newreno or bbr, \
+        a fixed window (--fixed-window) or AIMD (--aimd-*)"
+    )]
+    pub congestion: CongestionKind,
+
+    #[clap(
+        long,
+        default_value_t = 8_000_000,
+        help = "Bytes in flight of --congestion fixed"
+    )]
+    pub fixed_window: u64,
+
+    #[clap(
+        long,
+        default_value_t = 4_000_000,
+        help = "Smallest (and initial) window of --congestion aimd, bytes"
+    )]
+    pub aimd_min_window: u64,
+
+    #[clap(
+        long,
+        default_value_t = 8_000_000,
+        help = "Largest window of --congestion aimd, bytes"
+    )]
+    pub aimd_max_window: u64,
+
+    #[clap(
+        long,
+        default_value_t = 5.0,
+        help = "Minimum time between two window cuts of --congestion aimd, ms"
+    )]
+    pub aimd_interval_ms: f64,
+
     #[clap(long, help = "Client's host name")]
     pub host_name: Option<String>,
+
+    #[clap(
+        long,
+        conflicts_with = "host_name",
+        help = "File with `name ip:port` lines; drives all of them at once instead of --target. \
+        Each target's results are named after it and its end is reported as \
+        TARGET_DONE/TARGET_FAILED on stdout."
+    )]
+    pub targets_file: Option<PathBuf>,
+
+    #[clap(
+        long,
+        help = "Log every transaction's id and send time (us) to results/<host>-sendlog.bin"
+    )]
+    pub send_log: bool,
+
+    #[clap(
+        long,
+        default_value = "all",
+        value_parser = parse_stats_fields,
+        help = "Comma separated connection stats to record (e.g. sent,rtt_us,tx_streams_blocked_uni), \
+        time, connection_id and sent are always included"
+    )]
+    pub stats_fields: StatsFields,
+
+    #[clap(
+        long,
+        default_value_t = 5,
+        help = "Interval between stats samples in ms"
+    )]
+    pub stats_interval_ms: u64,
+}
+
+#[derive(ValueEnum, Clone, Copy, Debug, PartialEq, Eq)]
+pub enum CongestionKind {
+    Cubic,
+    #[value(name = "newreno")]
+    NewReno,
+    Bbr,
+    Fixed,
+    Aimd,
+}
+
+/// Reads `name ip:port` lines, blank lines and `#` comments are skipped.
+pub fn read_targets_file(path: &Path) -> anyhow::Result<Vec<(String, SocketAddr)>> {
+    let contents = std::fs::read_to_string(path)
+        .with_context(|| format!("reading targets file {}", path.display()))?;
+    let mut targets = Vec::new();
+    for (number, line) in contents.lines().enumerate() {
+        let line = line.split('#').next().unwrap_or_default().trim();
+        if line.is_empty() {
+            continue;
+        }
+        let mut fields = line.split_whitespace();
+        let (Some(name), Some(addr), None) = (fields.next(), fields.next(), fields.next()) else {
+            anyhow::bail!("{}:{}: expected `name ip:port`", path.display(), number + 1);
+        };
+        let addr = addr
+            .parse()
+            .with_context(|| format!("{}:{}: bad address {addr}", path.display(), number + 1))?;
+        targets.push((name.to_string(), addr));
+    }
+    if targets.is_empty() {
+        anyhow::bail!("{} lists no targets", path.display());
+    }
+    Ok(targets)
+}
+
+impl ClientCliParameters {
+    pub fn congestion_controller(&self) -> CongestionController {
+        if self.disable_congestion {
+            return CongestionController::Fixed {
+                window: self.fixed_window,
+            };
+        }
+        match self.congestion {
+            CongestionKind::Cubic => CongestionController::Cubic,
+            CongestionKind::NewReno => CongestionController::NewReno,
+            CongestionKind::Bbr => CongestionController::Bbr,
+            CongestionKind::Fixed => CongestionController::Fixed {
+                window: self.fixed_window,
+            },
+            CongestionKind::Aimd => CongestionController::Aimd {
+                min_window: self.aimd_min_window,
+                max_window: self.aimd_max_window,
+                interval: Duration::from_secs_f64(self.aimd_interval_ms / 1e3),
+            },
+        }
+    }
+
+    /// More than one identity is driven, each named after its pubkey.
+    pub fn multi_identity(&self) -> bool {
+        self.identity_dir.is_some() || self.staked_identity_file.len() > 1
+    }
+
+    /// Keypair files of all identities to drive, sorted for --identity-dir.
+    pub fn identity_files(&self) -> anyhow::Result<Vec<PathBuf>> {
+        let Some(dir) = &self.identity_dir else {
+            return Ok(self.staked_identity_file.clone());
+        };
+        let mut files = Vec::new();
+        for entry in std::fs::read_dir(dir)
+            .with_context(|| format!("reading identity dir {}", dir.display()))?
+        {
+            let path = entry?.path();
+            if path.extension().is_some_and(|ext| ext == "json") {
+                files.push(path);
+            }
+        }
+        if files.is_empty() {
+            anyhow::bail!("no *.json keypairs in {}", dir.display());
+        }
+        files.sort();
+        Ok(files)
+    }
 }
 
 fn parse_duration(s: &str) -> Result<Duration, &'static str> {
@@ -82,5 +303,44 @@ pub fn build_cli_parameters() -> ClientCliParameters {
             std::process::exit(1);
         }
     }
+    if parameters.worker_threads == 0 || parameters.num_runtimes == 0 {
+        eprintln!("Error: worker_threads and num_runtimes must be at least 1.");
+        std::process::exit(1);
+    }
+    if parameters.stats_interval_ms == 0 {
+        eprintln!("Error: stats_interval_ms must be at least 1.");
+        std::process::exit(1);
+    }
+    if parameters.multi_identity() && parameters.host_name.is_some() {
+        eprintln!("Error: host_name names a single identity's results, several identities are named after their pubkeys.");
+        std::process::exit(1);
+    }
+    if parameters.targets_file.is_some() && parameters.staked_identity_file.len() > 1 {
+        eprintln!("Error: targets_file drives one identity, pass a single staked_identity_file.");
+        std::process::exit(1);
+    }
+    if parameters.send_log
+        && parameters.host_name.is_none()
+        && parameters.targets_file.is_none()
+        && !parameters.multi_identity()
+    {
+        eprintln!("Error: send_log needs host_name to name its file.");
+        std::process::exit(1);
+    }
+    if parameters.aimd_min_window == 0 || parameters.aimd_min_window > parameters.aimd_max_window {
+        eprintln!("Error: aimd_min_window must be at least 1 and at most aimd_max_window.");
+        std::process::exit(1);
+    }
+    if parameters.fixed_window == 0
+        || parameters.aimd_interval_ms.is_nan()
+        || parameters.aimd_interval_ms < 0.0
+    {
+        eprintln!("Error: fixed_window must be at least 1 and aimd_interval_ms not negative.");
+        std::process::exit(1);
+    }
+    if parameters.max_in_flight_streams == 0 {
+        eprintln!("Error: max_in_flight_streams must be at least 1.");
+        std::process::exit(1);
+    }
     parameters
 }
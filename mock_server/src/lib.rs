@@ -1,6 +1,9 @@
 #![allow(clippy::arithmetic_side_effects)]
 pub mod cli;
 pub mod error;
+pub mod pacing;
 pub mod quic_networking;
+pub mod runtime;
 pub mod stats_collection;
 pub mod transaction_generator;
+pub mod tx_pool;
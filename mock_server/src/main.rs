@@ -3,30 +3,44 @@
 //!
 //! Checkout the `README.md` for guidance.
 
-use chrono::{NaiveDate, NaiveDateTime, NaiveTime, Utc};
+use bytes::Bytes;
 /*use bytemuck::{AnyBitPattern, NoUninit};
 use client::quic_networking::ConnectionState;
 use tracing::debug;
 use std::sync::atomic::Ordering::Relaxed;*/
 use quinn::ClientConfig;
 use solana_pubkey::Pubkey;
-use std::io::Write as _;
+use tokio::{
+    runtime::Handle,
+    sync::mpsc::{self, error::TrySendError},
+    task::{JoinError, JoinSet},
+};
 use tracing::error;
 use {
     solana_keypair::{EncodableKey, Keypair, Signer},
     solana_mock_client::{
-        cli::{build_cli_parameters, ClientCliParameters},
+        cli::{build_cli_parameters, read_targets_file, ClientCliParameters},
         error::QuicClientError,
+        pacing::Pacer,
         quic_networking::{
-            create_client_config, create_client_endpoint, send_data_over_stream,
+            create_client_config, create_client_endpoint, open_stream, write_data_over_stream,
             QuicClientCertificate,
         },
-        stats_collection::{file_bin, StatsSample},
+        runtime::build_runtimes,
+        stats_collection::{
+            file_bin, send_log_file, solana_epoch_micros, spawn_merged_writer, spawn_writer,
+            write_raw, SendRecord, StatsLayout, StatsSample, StreamWindowStats,
+            RESULTS_BUFFER_BYTES, SEND_LOG_CHANNEL_CAPACITY, STATS_CHANNEL_CAPACITY,
+        },
         transaction_generator::generate_dummy_data,
+        tx_pool::TxPool,
     },
     solana_packet::PACKET_DATA_SIZE,
     std::{
-        sync::Arc,
+        io::Write,
+        net::SocketAddr,
+        path::PathBuf,
+        sync::{atomic::Ordering::Relaxed, Arc},
         time::{Duration, Instant, SystemTime, UNIX_EPOCH},
     },
     tokio::time::sleep,
@@ -56,51 +70,262 @@ fn main() {
     ::std::process::exit(code);
 }
 
-#[tokio::main(flavor = "multi_thread", worker_threads = 8)]
-async fn run(parameters: ClientCliParameters) -> anyhow::Result<()> {
-    let identity = if let Some(staked_identity_file) = parameters.staked_identity_file.clone() {
+fn run(parameters: ClientCliParameters) -> anyhow::Result<()> {
+    let runtimes = build_runtimes(
+        parameters.num_runtimes,
+        parameters.worker_threads,
+        parameters.pin_cores.clone(),
+    )?;
+    let handles: Vec<Handle> = runtimes.iter().map(|rt| rt.handle().clone()).collect();
+    info!(
+        "{} runtime(s) with {} worker threads each",
+        runtimes.len(),
+        parameters.worker_threads
+    );
+    if let Some(targets_file) = &parameters.targets_file {
+        let targets = read_targets_file(targets_file)?;
+        return runtimes[0].block_on(run_targets(targets, parameters, handles));
+    }
+    if parameters.multi_identity() {
+        let identities = parameters.identity_files()?;
+        return runtimes[0].block_on(run_identities(identities, parameters, handles));
+    }
+    runtimes[0].block_on(async {
+        let (total_sent, window_stats) =
+            run_clients(parameters, handles, RESULTS_BUFFER_BYTES).await?;
+        println!("TRANSACTIONS_SENT {}", total_sent);
+        println!("STREAM_WINDOW {}", window_stats);
+        Ok(())
+    })
+}
+
+/// Drives every target of a targets file from the same runtimes.
+///
+/// Each target gets its own connections and result files named after it. Targets
+/// finish independently and report `TARGET_DONE <name> <sent>` or
+/// `TARGET_FAILED <name> <error>` on stdout, so a supervisor can restart just them.
+async fn run_targets(
+    targets: Vec<(String, SocketAddr)>,
+    parameters: ClientCliParameters,
+    handles: Vec<Handle>,
+) -> anyhow::Result<()> {
+    info!("Driving {} targets", targets.len());
+    let jobs = targets
+        .into_iter()
+        .map(|(name, target)| {
+            let parameters = ClientCliParameters {
+                target,
+                host_name: Some(name.clone()),
+                ..parameters.clone()
+            };
+            (name, parameters)
+        })
+        .collect();
+    run_jobs(jobs, "TARGET", handles).await?;
+    Ok(())
+}
+
+/// Drives many staked identities against one target from the same runtimes.
+///
+/// Every identity gets its own connections and result files named after its
+/// pubkey, as if it were a client process of its own; its end is reported as
+/// `IDENTITY_DONE <pubkey> <sent>` or `IDENTITY_FAILED <pubkey> <error>`.
+async fn run_identities(
+    identity_files: Vec<PathBuf>,
+    parameters: ClientCliParameters,
+    handles: Vec<Handle>,
+) -> anyhow::Result<()> {
+    let mut jobs = Vec::with_capacity(identity_files.len());
+    for path in identity_files {
+        let identity = Keypair::read_from_file(&path)
+            .map_err(|e| anyhow::anyhow!("reading keypair {}: {e}", path.display()))?;
+        let name = identity.pubkey().to_string();
+        let parameters = ClientCliParameters {
+            staked_identity_file: vec![path],
+            identity_dir: None,
+            host_name: Some(name.clone()),
+            ..parameters.clone()
+        };
+        jobs.push((name, parameters));
+    }
+    info!("Driving {} identities", jobs.len());
+    let (total_sent, window_stats) = run_jobs(jobs, "IDENTITY", handles).await?;
+    println!("TRANSACTIONS_SENT {}", total_sent);
+    println!("STREAM_WINDOW {}", window_stats);
+    Ok(())
+}
+
+/// Runs `run_clients` for every job concurrently and reports `<KIND>_DONE <name> <sent>`
+/// or `<KIND>_FAILED <name> <error>` on stdout as each one ends.
+/// Returns the totals of the jobs that ran, fails only if all of them failed.
+async fn run_jobs(
+    jobs: Vec<(String, ClientCliParameters)>,
+    kind: &str,
+    handles: Vec<Handle>,
+) -> anyhow::Result<(usize, StreamWindowStats)> {
+    let total = jobs.len();
+    // thousands of result files must not each hold a megabyte of buffer
+    let buffer_bytes = (RESULTS_BUFFER_BYTES / total.max(1)).max(64 * 1024);
+    let mut join_set = JoinSet::new();
+    for (name, parameters) in jobs {
+        let handles = handles.clone();
+        join_set.spawn(async move { (name, run_clients(parameters, handles, buffer_bytes).await) });
+    }
+    let mut failed = 0;
+    let mut total_sent = 0;
+    let window_stats = StreamWindowStats::default();
+    while let Some(joined) = join_set.join_next().await {
+        match joined {
+            Ok((name, Ok((sent, job_window_stats)))) => {
+                println!("{kind}_DONE {name} {sent}");
+                total_sent += sent;
+                window_stats.add(&job_window_stats);
+            }
+            Ok((name, Err(e))) => {
+                failed += 1;
+                println!("{kind}_FAILED {name} {e:#}");
+            }
+            Err(e) => {
+                failed += 1;
+                error!("{kind} task failed: {e}");
+            }
+        }
+    }
+    if failed == total {
+        anyhow::bail!("all {total} {} runs failed", kind.to_lowercase());
+    }
+    Ok((total_sent, window_stats))
+}
+
+/// Runs all connections to one target, returns what they sent and where their windows stalled.
+/// Fails only if no connection could be used at all.
+async fn run_clients(
+    parameters: ClientCliParameters,
+    handles: Vec<Handle>,
+    buffer_bytes: usize,
+) -> anyhow::Result<(usize, StreamWindowStats)> {
+    let identity = if let Some(staked_identity_file) = parameters.staked_identity_file.first() {
         Keypair::read_from_file(staked_identity_file)
             .map_err(|_err| QuicClientError::KeypairReadFailure)?
     } else {
         Keypair::new()
     };
     let client_certificate = Arc::new(QuicClientCertificate::new(&identity));
+    let congestion = parameters.congestion_controller();
+    let tx_pool = match &parameters.tx_pool {
+        Some(path) => {
+            // a directory holds one pool per identity, as make_txpool.py writes them
+            let path = if path.is_dir() {
+                path.join(format!("{}.bin", identity.pubkey()))
+            } else {
+                path.clone()
+            };
+            let pool = TxPool::open(&path, &identity.pubkey())?;
+            info!(
+                "Sending {} pre-signed transactions from {}, {:.0} bytes on average",
+                pool.len(),
+                path.display(),
+                pool.mean_size()
+            );
+            Some(pool)
+        }
+        None => None,
+    };
 
     let mut join_set = tokio::task::JoinSet::new();
 
-    for id in 0..parameters.num_connections as u64 {
-        let client_config =
-            create_client_config(client_certificate.clone(), parameters.disable_congestion);
-        join_set.spawn(run_endpoint(
-            client_config,
-            parameters.clone(),
-            identity.pubkey(),
-            id,
-        ));
+    // samples are streamed to the results files while the test runs
+    let mut sinks: Vec<ConnectionSinks> = (0..parameters.num_connections)
+        .map(|_| ConnectionSinks::default())
+        .collect();
+    let mut writers = Vec::new();
+    if let Some(host_name) = parameters.host_name.clone() {
+        let layout = StatsLayout {
+            fields: parameters.stats_fields.0.clone(),
+            interval: Duration::from_millis(parameters.stats_interval_ms),
+        };
+        let mut stats_file = file_bin(host_name.clone(), buffer_bytes)?;
+        stats_file.write_all(&layout.header(serde_json::json!({
+            "host": host_name,
+            "num_connections": parameters.num_connections,
+            "tx_size": parameters.tx_size,
+            "max_bitrate_bps": parameters.max_bitrate_bps,
+            "max_in_flight_streams": parameters.max_in_flight_streams,
+            "tx_pool": parameters.tx_pool,
+            "congestion": congestion.describe(),
+        })))?;
+        let (senders, writer) = spawn_merged_writer(
+            stats_file,
+            parameters.num_connections,
+            STATS_CHANNEL_CAPACITY,
+            move |sample, writer| layout.write_sample(sample, writer),
+        );
+        for (sink, sender) in sinks.iter_mut().zip(senders) {
+            sink.stats_tx = Some(sender);
+        }
+        writers.push(("stats samples", writer));
+        if parameters.send_log {
+            // one channel for all connections: a connection stuck on its window must
+            // not hold up the others' records, and the log is sorted when it is read
+            let (sender, writer) = spawn_writer(
+                send_log_file(host_name, buffer_bytes)?,
+                SEND_LOG_CHANNEL_CAPACITY * parameters.num_connections,
+                write_raw,
+            );
+            for sink in sinks.iter_mut() {
+                sink.send_log_tx = Some(sender.clone());
+            }
+            writers.push(("send records", writer));
+        }
+    }
+
+    for (id, sink) in sinks.into_iter().enumerate() {
+        let client_config = create_client_config(client_certificate.clone(), &congestion);
+        // connections are spread over the runtimes, the writers run on the first one's blocking pool
+        join_set.spawn_on(
+            run_endpoint(
+                client_config,
+                parameters.clone(),
+                identity.pubkey(),
+                id as u64,
+                sink,
+                tx_pool.clone(),
+            ),
+            &handles[id % handles.len()],
+        );
     }
-    let mut all_stats: Vec<StatsSample> = Vec::with_capacity(10 * 1024 * 1024);
     let mut total_sent = 0;
+    let window_stats = StreamWindowStats::default();
+    let mut first_error = None;
+    let mut connected = 0;
     for result in join_set.join_all().await {
-        let (mut result, sent) = match result {
+        let (sent, connection_window_stats) = match result {
             Ok(result) => result,
             Err(e) => {
                 eprintln!("{e}");
+                first_error.get_or_insert(e);
                 continue;
             }
         };
-        all_stats.append(&mut result);
+        connected += 1;
         total_sent += sent;
+        window_stats.add(&connection_window_stats);
     }
-    all_stats.sort_by(|a, b| a.time_stamp.cmp(&b.time_stamp));
-    if let Some(host_name) = parameters.host_name.clone() {
-        let mut writer = file_bin(host_name.clone())?;
-        for val in &all_stats {
-            writer.write_all(bytemuck::bytes_of(val)).unwrap();
-        }
-        writer.flush().unwrap();
+    for (what, writer) in writers {
+        let written = writer.await??;
+        info!("Wrote {written} {what}");
     }
-    println!("TRANSACTIONS_SENT {}", total_sent);
-    Ok(())
+    if let (0, Some(e)) = (connected, first_error) {
+        return Err(e.into());
+    }
+    Ok((total_sent, window_stats))
+}
+
+/// Where a connection streams its result records, if anywhere.
+#[derive(Default)]
+struct ConnectionSinks {
+    stats_tx: Option<mpsc::Sender<StatsSample>>,
+    send_log_tx: Option<mpsc::Sender<SendRecord>>,
 }
 
 // quinn has one global per-endpoint lock, so multiple endpoints help get around that
@@ -114,58 +339,75 @@ async fn run_endpoint(
         max_txs_num,
         num_connections,
         max_bitrate_bps,
+        pacing_burst,
+        max_in_flight_streams,
+        stats_interval_ms,
         ..
     }: ClientCliParameters,
     identity: Pubkey,
     connection_id: u64,
-) -> Result<(Vec<StatsSample>, usize), QuicClientError> {
+    ConnectionSinks {
+        stats_tx,
+        send_log_tx,
+    }: ConnectionSinks,
+    tx_pool: Option<TxPool>,
+) -> Result<(usize, StreamWindowStats), QuicClientError> {
     let endpoint =
         create_client_endpoint(bind, client_config).expect("Endpoint creation should not fail.");
 
     let connection = endpoint.connect(target, "connect")?.await?;
 
-    // avoid allocations for up to 10M samples
-    let mut stats_collector: Vec<StatsSample> = Vec::with_capacity(10 * 1024 * 1024);
-
     let start = Instant::now();
-    let solana_epoch = NaiveDateTime::new(
-        NaiveDate::from_ymd_opt(2020, 3, 16).unwrap(),
-        NaiveTime::MIN,
-    );
     let mut transaction_id = 1;
     let mut tx_buffer = [0u8; PACKET_DATA_SIZE];
-    let time_between_txs = (tx_size * 8) as f64 / max_bitrate_bps;
-    println!("{time_between_txs}");
-    let (sent_tx, sent_rx) = tokio::sync::watch::channel(transaction_id);
+    let mean_tx_size = tx_pool
+        .as_ref()
+        .map_or(tx_size as f64, |pool| pool.mean_size());
+    // connections start at different points of the pool so they do not send the same transactions
+    let pool_offset = tx_pool.as_ref().map_or(0, |pool| {
+        pool.len() / num_connections * connection_id as usize
+    });
+    let mut pacer = Pacer::new(max_bitrate_bps / (mean_tx_size * 8.0), pacing_burst, start);
+    let pacing = pacer.target();
+    info!(
+        "Pacing connection {connection_id} at {:.0} TPS, bursts of up to {}",
+        pacing.rate_tps,
+        pacer.burst()
+    );
+    let mut batch_left = 0;
+    let stats_interval = Duration::from_millis(stats_interval_ms);
+    // transactions sent so far (ids start at 1), None once sending is over
+    let (sent_tx, sent_rx) = tokio::sync::watch::channel(Some(0usize));
     let watcher = tokio::spawn({
         let connection = connection.clone();
         async move {
             loop {
-                let sent = *sent_rx.borrow();
-                if sent == 0 {
+                let Some(sent) = *sent_rx.borrow() else {
                     break;
-                }
-                let con_stats = connection.stats();
-                let now = Utc::now().naive_utc();
-                let delta_time = (now - solana_epoch).num_microseconds().unwrap() as u64;
-                let stats = StatsSample {
-                    udp_tx: con_stats.udp_tx.bytes,
-                    udp_rx: con_stats.udp_rx.bytes,
-                    time_stamp: delta_time,
-                    sent: sent as u64,
-                    congestion_events: con_stats.path.congestion_events,
-                    congestion_window: con_stats.path.cwnd,
-                    lost_packets: con_stats.path.lost_packets,
-                    connection_id,
                 };
-                stats_collector.push(stats);
-                tokio::time::sleep(Duration::from_millis(5)).await;
+                let stats = StatsSample::capture(
+                    &connection.stats(),
+                    connection_id,
+                    sent as u64,
+                    pacing.intended(),
+                );
+                if let Some(stats_tx) = &stats_tx {
+                    // waits only if the writer falls a full channel behind
+                    if stats_tx.send(stats).await.is_err() {
+                        error!(
+                            "Stats writer is gone, no more samples for connection {connection_id}"
+                        );
+                        break;
+                    }
+                }
+                tokio::time::sleep(stats_interval).await;
             }
-            stats_collector
         }
     });
+    let window_stats = Arc::new(StreamWindowStats::default());
+    let mut in_flight = JoinSet::new();
     let mut last_report = Instant::now();
-    loop {
+    'sending: loop {
         if let Some(duration) = duration {
             if start.elapsed() >= duration {
                 info!("Stopping TX generation after {duration:?}");
@@ -173,54 +415,107 @@ async fn run_endpoint(
             }
         }
         if let Some(max_txs_num) = max_txs_num {
-            if transaction_id == max_txs_num / num_connections {
+            if transaction_id > max_txs_num / num_connections {
                 info!("Stopping TX generation at {max_txs_num}.");
                 break;
             }
         }
 
-        generate_dummy_data(
-            &mut tx_buffer,
-            transaction_id,
-            timestamp(),
-            identity,
-            tx_size,
-        );
+        if batch_left == 0 {
+            batch_left = pacer.next_batch().await;
+        }
+        batch_left -= 1;
+
         if last_report.elapsed() > Duration::from_secs(1) {
             info!("{:?}", connection.stats());
             last_report = Instant::now();
         }
-        match tokio::time::timeout(
-            Duration::from_millis(2500),
-            send_data_over_stream(&connection, &tx_buffer[0..tx_size as usize]),
-        )
-        .await
-        {
-            Ok(Ok(_)) => {
-                transaction_id += 1;
-                if transaction_id % 1000 == 0 {
-                    tracing::debug!("{:?}", &connection.stats());
-                }
+        // reap the writes that have already completed
+        while let Some(result) = in_flight.try_join_next() {
+            if !write_succeeded(result) {
+                break 'sending;
             }
-            Ok(Err(e)) => {
-                error!("Quic error {e}");
+        }
+        if in_flight.len() >= max_in_flight_streams {
+            window_stats.window_full.fetch_add(1, Relaxed);
+            if !in_flight.join_next().await.is_some_and(write_succeeded) {
                 break;
             }
-            Err(_e) => {
-                error!("Timeout sending stream ID {transaction_id}");
-                break;
+        }
+        let send_time = solana_epoch_micros();
+        let send_stream =
+            match tokio::time::timeout(SEND_TIMEOUT, open_stream(&connection, &window_stats)).await
+            {
+                Ok(Ok(send_stream)) => send_stream,
+                Ok(Err(e)) => {
+                    error!("Quic error {e}");
+                    break;
+                }
+                Err(_e) => {
+                    error!("Timeout opening stream ID {transaction_id}");
+                    break;
+                }
+            };
+        // only transactions that got a stream are logged, and the log never waits for its writer
+        if let Some(send_log_tx) = &send_log_tx {
+            let record = SendRecord {
+                time_stamp: send_time,
+                transaction_id: transaction_id as u32,
+                connection_id: connection_id as u32,
+            };
+            match send_log_tx.try_send(record) {
+                Ok(()) => {}
+                Err(TrySendError::Full(_)) => {
+                    window_stats.send_log_dropped.fetch_add(1, Relaxed);
+                }
+                Err(TrySendError::Closed(_)) => {
+                    error!("Send log writer is gone, stopping connection {connection_id}");
+                    break;
+                }
             }
         }
-        sent_tx.send(transaction_id).unwrap();
-        // self-throttle as needed
-        let sleep = time_between_txs * transaction_id.saturating_sub(1) as f64
-            - start.elapsed().as_secs_f64();
-        if sleep > 0.0 {
-            tokio::time::sleep(Duration::from_secs_f64(sleep)).await;
+        let data = match &tx_pool {
+            Some(pool) => pool.get(pool_offset + transaction_id),
+            None => {
+                generate_dummy_data(
+                    &mut tx_buffer,
+                    transaction_id,
+                    timestamp(),
+                    identity,
+                    tx_size,
+                );
+                Bytes::copy_from_slice(&tx_buffer[0..tx_size as usize])
+            }
+        };
+        in_flight.spawn(tokio::time::timeout(
+            SEND_TIMEOUT,
+            write_data_over_stream(send_stream, data, window_stats.clone()),
+        ));
+        transaction_id += 1;
+        if transaction_id % 1000 == 0 {
+            tracing::debug!("{:?}", &connection.stats());
         }
+        sent_tx.send(Some(transaction_id - 1)).unwrap();
+    }
+    let intended = (start.elapsed().as_secs_f64() * pacing.rate_tps).max(1.0);
+    while let Some(result) = in_flight.join_next().await {
+        write_succeeded(result);
     }
-    sent_tx.send(0).unwrap();
-    let stats_collector = watcher.await.unwrap();
+    sent_tx.send(None).unwrap();
+    watcher.await.unwrap();
+    info!("connection {connection_id} stream window: {window_stats}");
+    let dropped = window_stats.send_log_dropped.load(Relaxed);
+    if dropped > 0 {
+        error!(
+            "Connection {connection_id} dropped {dropped} send records, its send log is incomplete"
+        );
+    }
+    info!(
+        "connection {connection_id} pacing: sent {} of {:.0} intended ({:+.2}%)",
+        transaction_id - 1,
+        intended,
+        ((transaction_id - 1) as f64 / intended - 1.0) * 100.0
+    );
 
     // When the connection is closed all the streams that haven't been delivered yet will be lost.
     // Sleep to give it some time to deliver all the pending streams.
@@ -234,7 +529,31 @@ async fn run_endpoint(
     // Give the server a fair chance to receive the close packet
     endpoint.wait_idle().await;
     //let _ = feedback_reader.await;
-    Ok((stats_collector, transaction_id))
+    let window_stats = Arc::into_inner(window_stats).unwrap_or_default();
+    Ok((transaction_id - 1, window_stats))
+}
+
+const SEND_TIMEOUT: Duration = Duration::from_millis(2500);
+
+/// Logs the outcome of one in-flight stream write, returns false if sending should stop.
+fn write_succeeded(
+    result: Result<Result<Result<u64, QuicClientError>, tokio::time::error::Elapsed>, JoinError>,
+) -> bool {
+    match result {
+        Ok(Ok(Ok(_stream_id))) => true,
+        Ok(Ok(Err(e))) => {
+            error!("Quic error {e}");
+            false
+        }
+        Ok(Err(_e)) => {
+            error!("Timeout writing stream");
+            false
+        }
+        Err(e) => {
+            error!("Stream write task failed {e}");
+            false
+        }
+    }
 }
 
 /// return timestamp as ms
@@ -0,0 +1,77 @@
+use std::time::{Duration, Instant};
+
+/// Longest burst the automatic burst size allows for, roughly two timer ticks.
+const AUTO_BURST_WINDOW: Duration = Duration::from_millis(2);
+const MAX_AUTO_BURST: f64 = 4096.0;
+
+/// How many transactions should have been sent by now at the configured rate.
+#[derive(Clone, Copy, Debug)]
+pub struct PacingTarget {
+    pub start: Instant,
+    pub rate_tps: f64,
+}
+
+impl PacingTarget {
+    pub fn intended(&self) -> u64 {
+        (self.start.elapsed().as_secs_f64() * self.rate_tps) as u64
+    }
+}
+
+/// Token bucket releasing transactions in small timed batches.
+///
+/// Sleeping per transaction does not work at microsecond gaps because the tokio
+/// timer has millisecond granularity. Instead the bucket refills with the time
+/// that actually passed and everything that accumulated (up to `burst`) is
+/// released at once, so the average rate holds even if wakeups are late.
+#[derive(Debug)]
+pub struct Pacer {
+    target: PacingTarget,
+    burst: f64,
+    tokens: f64,
+    last_refill: Instant,
+}
+
+impl Pacer {
+    /// `burst` of None picks enough tokens to cover a couple of timer ticks.
+    pub fn new(rate_tps: f64, burst: Option<u32>, start: Instant) -> Self {
+        let burst = match burst {
+            Some(burst) => burst.max(1) as f64,
+            None => (rate_tps * AUTO_BURST_WINDOW.as_secs_f64()).clamp(1.0, MAX_AUTO_BURST),
+        };
+        Self {
+            target: PacingTarget { start, rate_tps },
+            burst,
+            tokens: 1.0,
+            last_refill: start,
+        }
+    }
+
+    pub fn target(&self) -> PacingTarget {
+        self.target
+    }
+
+    pub fn burst(&self) -> u32 {
+        self.burst as u32
+    }
+
+    fn refill(&mut self) {
+        let now = Instant::now();
+        let elapsed = now.duration_since(self.last_refill).as_secs_f64();
+        self.tokens = (self.tokens + elapsed * self.target.rate_tps).min(self.burst);
+        self.last_refill = now;
+    }
+
+    /// Waits until at least one transaction may go, returns how many may go now.
+    pub async fn next_batch(&mut self) -> u32 {
+        loop {
+            self.refill();
+            if self.tokens >= 1.0 {
+                let batch = self.tokens.floor();
+                self.tokens -= batch;
+                return batch as u32;
+            }
+            let wait = (1.0 - self.tokens) / self.target.rate_tps;
+            tokio::time::sleep(Duration::from_secs_f64(wait)).await;
+        }
+    }
+}
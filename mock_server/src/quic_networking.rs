@@ -1,17 +1,24 @@
-use std::{sync::atomic::AtomicU64, time::Instant};
+use std::{
+    future::Future,
+    sync::atomic::{AtomicU64, Ordering::Relaxed},
+    time::Instant,
+};
+
+use bytes::Bytes;
 
 use quinn::{
-    congestion::{Controller, ControllerFactory},
+    congestion::{BbrConfig, Controller, ControllerFactory, CubicConfig, NewRenoConfig},
     crypto::rustls::QuicClientConfig,
-    ClientConfig, Connection, Endpoint, IdleTimeout, TransportConfig,
+    ClientConfig, Connection, Endpoint, IdleTimeout, SendStream, TransportConfig,
 };
 use quinn_proto::RttEstimator;
 use rustls::KeyLogFile;
 use solana_keypair::Keypair;
+use tracing::debug;
 //use std::sync::atomic::Ordering::Relaxed;
 
 use {
-    crate::error::QuicClientError,
+    crate::{error::QuicClientError, stats_collection::StreamWindowStats},
     solana_tls_utils::new_dummy_x509_certificate,
     std::{net::SocketAddr, sync::Arc, time::Duration},
 };
@@ -93,38 +100,129 @@ impl QuicClientCertificate {
         Self { certificate, key }
     }
 }
+/// Congestion controller of the client connections, see `--congestion`.
+#[derive(Debug, Clone, PartialEq)]
+pub enum CongestionController {
+    Cubic,
+    NewReno,
+    Bbr,
+    /// Always allows `window` bytes in flight.
+    Fixed {
+        window: u64,
+    },
+    /// Halves the window on congestion, at most once per `interval`, and doubles
+    /// it at most once per RTT otherwise, within [min_window, max_window].
+    Aimd {
+        min_window: u64,
+        max_window: u64,
+        interval: Duration,
+    },
+}
+
+impl CongestionController {
+    fn factory(&self) -> Arc<dyn ControllerFactory + Send + Sync + 'static> {
+        match self {
+            Self::Cubic => Arc::new(CubicConfig::default()),
+            Self::NewReno => Arc::new(NewRenoConfig::default()),
+            Self::Bbr => Arc::new(BbrConfig::default()),
+            Self::Fixed { window } => Arc::new(FixedWindow { window: *window }),
+            Self::Aimd {
+                min_window,
+                max_window,
+                interval,
+            } => Arc::new(Aimd::new(*min_window, *max_window, *interval)),
+        }
+    }
+
+    /// How the controller is named in the stats header.
+    pub fn describe(&self) -> serde_json::Value {
+        match self {
+            Self::Cubic => serde_json::json!({ "kind": "cubic" }),
+            Self::NewReno => serde_json::json!({ "kind": "newreno" }),
+            Self::Bbr => serde_json::json!({ "kind": "bbr" }),
+            Self::Fixed { window } => serde_json::json!({ "kind": "fixed", "window": window }),
+            Self::Aimd {
+                min_window,
+                max_window,
+                interval,
+            } => serde_json::json!({
+                "kind": "aimd",
+                "min_window": min_window,
+                "max_window": max_window,
+                "interval_ms": interval.as_secs_f64() * 1e3,
+            }),
+        }
+    }
+}
+
 #[derive(Debug, Clone)]
-struct NopCongestion {
-    pub window_size: u64,
-    pub last_congestion: Instant,
-    pub last_increase: Instant,
+struct FixedWindow {
+    window: u64,
+}
+
+impl Controller for FixedWindow {
+    fn on_mtu_update(&mut self, _: u16) {}
+    fn window(&self) -> u64 {
+        self.window
+    }
+    fn clone_box(&self) -> Box<dyn Controller + 'static> {
+        Box::new(self.clone())
+    }
+    fn initial_window(&self) -> u64 {
+        self.window
+    }
+    fn into_any(self: Box<Self>) -> Box<dyn std::any::Any + 'static> {
+        Box::new(self)
+    }
+    fn on_congestion_event(
+        &mut self,
+        _now: Instant,
+        _sent: Instant,
+        _is_persistent_congestion: bool,
+        _lost_bytes: u64,
+    ) {
+    }
 }
 
-impl NopCongestion {
-    const MIN_WINDOW_SIZE: u64 = 8_000_000 / 2;
-    const MAX_WINDOW_SIZE: u64 = 8_000_000;
-    const ADJUST_INTERVAL: Duration = Duration::from_millis(5);
+impl ControllerFactory for FixedWindow {
+    fn build(self: Arc<Self>, _: Instant, _: u16) -> Box<dyn Controller + 'static> {
+        Box::new((*self).clone())
+    }
+}
+
+#[derive(Debug, Clone)]
+struct Aimd {
+    window_size: u64,
+    min_window: u64,
+    max_window: u64,
+    interval: Duration,
+    last_congestion: Instant,
+    last_increase: Instant,
+}
 
-    pub fn new() -> Self {
+impl Aimd {
+    fn new(min_window: u64, max_window: u64, interval: Duration) -> Self {
         Self {
-            window_size: Self::MIN_WINDOW_SIZE,
+            window_size: min_window,
+            min_window,
+            max_window,
+            interval,
             last_congestion: Instant::now(),
             last_increase: Instant::now(),
         }
     }
 }
 
-impl Controller for NopCongestion {
+impl Controller for Aimd {
     fn on_mtu_update(&mut self, _: u16) {}
     fn window(&self) -> u64 {
-        // self.window_size
-        Self::MAX_WINDOW_SIZE
+        self.window_size
     }
     fn clone_box(&self) -> Box<dyn Controller + 'static> {
         Box::new(self.clone())
     }
     fn initial_window(&self) -> u64 {
-        Self::MIN_WINDOW_SIZE
+        self.min_window
     }
     fn into_any(self: Box<Self>) -> Box<dyn std::any::Any + 'static> {
         Box::new(self)
@@ -132,44 +230,44 @@ impl Controller for NopCongestion {
 
     fn on_congestion_event(
         &mut self,
-        _now: Instant,
+        now: Instant,
         _sent: Instant,
         _is_persistent_congestion: bool,
         _lost_bytes: u64,
     ) {
-        let now = Instant::now();
-        let dt = now.duration_since(self.last_congestion);
-        if dt > Self::ADJUST_INTERVAL {
+        if now.saturating_duration_since(self.last_congestion) > self.interval {
             self.last_congestion = now;
             self.last_increase = now; // prevent from immediately improving
-            self.window_size = (self.window_size / 2).max(Self::MIN_WINDOW_SIZE);
-            println!("Window is {}", self.window_size);
+            self.window_size = (self.window_size / 2).max(self.min_window);
+            debug!("AIMD window is {}", self.window_size);
         }
     }
 
     fn on_ack(
         &mut self,
-        _now: Instant,
+        now: Instant,
         _sent: Instant,
         _bytes: u64,
         _app_limited: bool,
         rtt: &RttEstimator,
     ) {
-        if self.window_size == Self::MAX_WINDOW_SIZE {
+        if self.window_size == self.max_window {
             return;
         }
-        let now = Instant::now();
-        let dt = now.duration_since(self.last_increase);
-        if dt > rtt.get() {
+        if now.saturating_duration_since(self.last_increase) > rtt.get() {
             self.last_increase = now;
-            self.window_size = (self.window_size * 2).min(Self::MAX_WINDOW_SIZE);
-            println!("Window is {}", self.window_size);
+            self.window_size = (self.window_size * 2).min(self.max_window);
+            debug!("AIMD window is {}", self.window_size);
         }
     }
 }
-impl ControllerFactory for NopCongestion {
-    fn build(self: Arc<Self>, _: std::time::Instant, _: u16) -> Box<dyn Controller + 'static> {
-        Box::new(Self::new())
+
+impl ControllerFactory for Aimd {
+    fn build(self: Arc<Self>, now: Instant, _: u16) -> Box<dyn Controller + 'static> {
+        let mut controller = Self::new(self.min_window, self.max_window, self.interval);
+        controller.last_congestion = now;
+        controller.last_increase = now;
+        Box::new(controller)
     }
 }
 
@@ -184,7 +282,7 @@ pub const QUIC_SEND_FAIRNESS: bool = false;
 // taken from QuicLazyInitializedEndpoint::create_endpoint
 pub fn create_client_config(
     client_certificate: Arc<QuicClientCertificate>,
-    no_congestion: bool,
+    congestion: &CongestionController,
 ) -> ClientConfig {
     let mut crypto = rustls::ClientConfig::builder()
         .dangerous()
@@ -204,9 +302,7 @@ pub fn create_client_config(
     transport_config.max_idle_timeout(Some(timeout));
     transport_config.keep_alive_interval(Some(QUIC_KEEP_ALIVE));
     transport_config.send_fairness(QUIC_SEND_FAIRNESS);
-    if no_congestion {
-        transport_config.congestion_controller_factory(Arc::new(NopCongestion::new()));
-    }
+    transport_config.congestion_controller_factory(congestion.factory());
     config.transport_config(Arc::new(transport_config));
 
     config
@@ -235,6 +331,63 @@ pub async fn send_data_over_stream(
     Ok(stream_id)
 }
 
+/// Awaits `future`, counting it in `blocked` (and the time spent in `waited_us`)
+/// if it was not ready on the first poll.
+pub async fn count_if_blocked<F: Future>(
+    future: F,
+    blocked: &AtomicU64,
+    waited_us: &AtomicU64,
+) -> F::Output {
+    let mut future = std::pin::pin!(future);
+    let mut blocked_since: Option<Instant> = None;
+    std::future::poll_fn(|cx| {
+        let poll = future.as_mut().poll(cx);
+        match (poll.is_ready(), blocked_since) {
+            (false, None) => {
+                blocked.fetch_add(1, Relaxed);
+                blocked_since = Some(Instant::now());
+            }
+            (true, Some(since)) => {
+                waited_us.fetch_add(since.elapsed().as_micros() as u64, Relaxed);
+            }
+            _ => {}
+        }
+        poll
+    })
+    .await
+}
+
+/// Opens a uni stream, recording whether we had to wait for stream credit.
+pub async fn open_stream(
+    connection: &Connection,
+    stats: &StreamWindowStats,
+) -> Result<SendStream, QuicClientError> {
+    let send_stream = count_if_blocked(
+        connection.open_uni(),
+        &stats.open_uni_blocked,
+        &stats.open_uni_wait_us,
+    )
+    .await?;
+    Ok(send_stream)
+}
+
+/// Writes one transaction into an already opened stream, recording whether
+/// the write had to wait. Runs as its own task so several streams can be in flight.
+pub async fn write_data_over_stream(
+    mut send_stream: SendStream,
+    data: Bytes,
+    stats: Arc<StreamWindowStats>,
+) -> Result<u64, QuicClientError> {
+    let stream_id = send_stream.id().index();
+    count_if_blocked(
+        send_stream.write_all(&data),
+        &stats.write_blocked,
+        &stats.write_wait_us,
+    )
+    .await?;
+    Ok(stream_id)
+}
+
 #[derive(Debug, Default)]
 pub struct ConnectionState {
     pub server_last_started_stream: AtomicU64,
@@ -0,0 +1,117 @@
+use std::{
+    mem,
+    sync::{
+        atomic::{AtomicUsize, Ordering::Relaxed},
+        Arc,
+    },
+    thread,
+};
+
+use tokio::runtime::{Builder, Runtime};
+
+/// CPU cores to pin runtime threads to.
+#[derive(Clone, Debug)]
+pub struct CoreList(pub Vec<usize>);
+
+/// Parses a core list like `0-7,16,18-19` into core ids.
+pub fn parse_core_list(s: &str) -> Result<CoreList, String> {
+    let mut cores = Vec::new();
+    for part in s.split(',').filter(|p| !p.is_empty()) {
+        let parse = |v: &str| {
+            v.trim()
+                .parse::<usize>()
+                .map_err(|_| format!("bad core id '{v}'"))
+        };
+        match part.split_once('-') {
+            Some((first, last)) => cores.extend(parse(first)?..=parse(last)?),
+            None => cores.push(parse(part)?),
+        }
+    }
+    if cores.is_empty() {
+        return Err("empty core list".to_string());
+    }
+    Ok(CoreList(cores))
+}
+
+/// Builds `num_runtimes` multi-threaded runtimes with `worker_threads` each.
+///
+/// With `pin_cores`, every worker thread is pinned to the next core of the list
+/// (round-robin over all runtimes), so runtimes can be kept on separate cores.
+/// Blocking-pool threads (the result writers) would otherwise inherit the pin of
+/// the worker that spawned them; they get the cores outside the list instead, or
+/// all the cores the process had if the list covers them.
+pub fn build_runtimes(
+    num_runtimes: usize,
+    worker_threads: usize,
+    pin_cores: Option<CoreList>,
+) -> anyhow::Result<Vec<Runtime>> {
+    let next_core = Arc::new(AtomicUsize::new(0));
+    let pin = pin_cores.map(|cores| {
+        let all = process_cores();
+        let spare: Vec<usize> = all
+            .iter()
+            .copied()
+            .filter(|core| !cores.0.contains(core))
+            .collect();
+        let spare = if spare.is_empty() { all } else { spare };
+        (Arc::new(cores.0), Arc::new(spare))
+    });
+    (0..num_runtimes)
+        .map(|idx| -> anyhow::Result<Runtime> {
+            let mut builder = Builder::new_multi_thread();
+            builder
+                .worker_threads(worker_threads)
+                .thread_name(format!("client-rt{idx}"))
+                .enable_all();
+            let started = Arc::new(AtomicUsize::new(0));
+            if let Some((cores, spare)) = pin.clone() {
+                let next_core = next_core.clone();
+                let started = started.clone();
+                builder.on_thread_start(move || {
+                    // the workers are the first threads of the runtime, started by build()
+                    if started.fetch_add(1, Relaxed) < worker_threads {
+                        let core = cores[next_core.fetch_add(1, Relaxed) % cores.len()];
+                        if !core_affinity::set_for_current(core_affinity::CoreId { id: core }) {
+                            tracing::warn!("Could not pin thread to core {core}");
+                        }
+                    } else if !spare.is_empty() && !set_current_cores(&spare) {
+                        tracing::warn!("Could not move blocking thread to cores {spare:?}");
+                    }
+                });
+            }
+            let runtime = builder.build()?;
+            if pin.is_some() {
+                // hold off spawn_blocking until every worker has taken its core
+                while started.load(Relaxed) < worker_threads {
+                    thread::yield_now();
+                }
+            }
+            Ok(runtime)
+        })
+        .collect()
+}
+
+/// Cores the calling thread may run on, or empty if they cannot be read.
+fn process_cores() -> Vec<usize> {
+    // SAFETY: cpu_set_t is plain data and sched_getaffinity writes at most its size
+    unsafe {
+        let mut set: libc::cpu_set_t = mem::zeroed();
+        if libc::sched_getaffinity(0, mem::size_of::<libc::cpu_set_t>(), &mut set) != 0 {
+            return Vec::new();
+        }
+        (0..libc::CPU_SETSIZE as usize)
+            .filter(|&core| libc::CPU_ISSET(core, &set))
+            .collect()
+    }
+}
+
+fn set_current_cores(cores: &[usize]) -> bool {
+    // SAFETY: as above; the cores came from process_cores, so they are below CPU_SETSIZE
+    unsafe {
+        let mut set: libc::cpu_set_t = mem::zeroed();
+        for &core in cores {
+            libc::CPU_SET(core, &mut set);
+        }
+        libc::sched_setaffinity(0, mem::size_of::<libc::cpu_set_t>(), &set) == 0
+    }
+}
@@ -10,24 +10,434 @@
 // lost_plpmtud_probes: 0, black_holes_detected: 0, current_mtu: 1200 } }
 
 use bytemuck::{AnyBitPattern, NoUninit};
+use chrono::{NaiveDate, NaiveDateTime, NaiveTime, Utc};
+use quinn::ConnectionStats;
+use std::{
+    cmp::Reverse,
+    collections::BinaryHeap,
+    io::Write,
+    sync::atomic::{AtomicU64, Ordering::Relaxed},
+    time::Duration,
+};
+use tokio::{sync::mpsc, task::JoinHandle};
+
+/// Samples buffered per connection before its watcher has to wait for the writer.
+pub const STATS_CHANNEL_CAPACITY: usize = 16 * 1024;
+/// Send records buffered per connection; when the writer falls that far behind
+/// further records are dropped (and counted) rather than holding up the sender.
+pub const SEND_LOG_CHANNEL_CAPACITY: usize = 64 * 1024;
+
+/// Microseconds since the solana epoch (2020-03-16), the clock used in all result files.
+pub fn solana_epoch_micros() -> u64 {
+    let solana_epoch = NaiveDateTime::new(
+        NaiveDate::from_ymd_opt(2020, 3, 16).unwrap(),
+        NaiveTime::MIN,
+    );
+    let now = Utc::now().naive_utc();
+    (now - solana_epoch).num_microseconds().unwrap() as u64
+}
+
+/// Records that can be merged into one time-ordered result file.
+pub trait TimeOrdered: Copy {
+    fn time_stamp(&self) -> u64;
+}
+
+/// Writes a plain-old-data record as its raw bytes.
+pub fn write_raw<T: NoUninit, W: Write>(record: &T, writer: &mut W) -> std::io::Result<()> {
+    writer.write_all(bytemuck::bytes_of(record))
+}
+
+/// Everything the client can record about a connection, one u64 each.
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub enum StatsField {
+    UdpTx,
+    UdpRx,
+    Sent,
+    CongestionEvents,
+    CongestionWindow,
+    LostPackets,
+    Time,
+    ConnectionId,
+    IntendedSent,
+    UdpTxDatagrams,
+    SentPackets,
+    LostBytes,
+    RttUs,
+    CurrentMtu,
+    TxStreamsBlockedUni,
+    RxMaxStreamsUni,
+    TxStreamDataBlocked,
+    TxDataBlocked,
+    RxMaxData,
+    RxMaxStreamData,
+}
+
+impl StatsField {
+    /// In file order when all fields are recorded; the first nine are the old fixed layout.
+    pub const ALL: [StatsField; 20] = [
+        StatsField::UdpTx,
+        StatsField::UdpRx,
+        StatsField::Sent,
+        StatsField::CongestionEvents,
+        StatsField::CongestionWindow,
+        StatsField::LostPackets,
+        StatsField::Time,
+        StatsField::ConnectionId,
+        StatsField::IntendedSent,
+        StatsField::UdpTxDatagrams,
+        StatsField::SentPackets,
+        StatsField::LostBytes,
+        StatsField::RttUs,
+        StatsField::CurrentMtu,
+        StatsField::TxStreamsBlockedUni,
+        StatsField::RxMaxStreamsUni,
+        StatsField::TxStreamDataBlocked,
+        StatsField::TxDataBlocked,
+        StatsField::RxMaxData,
+        StatsField::RxMaxStreamData,
+    ];
+    /// The analysis scripts cannot do without these.
+    pub const REQUIRED: [StatsField; 3] =
+        [StatsField::Time, StatsField::ConnectionId, StatsField::Sent];
+
+    pub fn name(self) -> &'static str {
+        match self {
+            StatsField::UdpTx => "udp_tx",
+            StatsField::UdpRx => "udp_rx",
+            StatsField::Sent => "sent",
+            StatsField::CongestionEvents => "congestion_events",
+            StatsField::CongestionWindow => "congestion_window",
+            StatsField::LostPackets => "lost_packets",
+            StatsField::Time => "time",
+            StatsField::ConnectionId => "connection_id",
+            StatsField::IntendedSent => "intended_sent",
+            StatsField::UdpTxDatagrams => "udp_tx_datagrams",
+            StatsField::SentPackets => "sent_packets",
+            StatsField::LostBytes => "lost_bytes",
+            StatsField::RttUs => "rtt_us",
+            StatsField::CurrentMtu => "current_mtu",
+            StatsField::TxStreamsBlockedUni => "tx_streams_blocked_uni",
+            StatsField::RxMaxStreamsUni => "rx_max_streams_uni",
+            StatsField::TxStreamDataBlocked => "tx_stream_data_blocked",
+            StatsField::TxDataBlocked => "tx_data_blocked",
+            StatsField::RxMaxData => "rx_max_data",
+            StatsField::RxMaxStreamData => "rx_max_stream_data",
+        }
+    }
+}
+
+/// Stats fields to record, in file order.
+#[derive(Clone, Debug)]
+pub struct StatsFields(pub Vec<StatsField>);
+
+impl Default for StatsFields {
+    fn default() -> Self {
+        StatsFields(StatsField::ALL.to_vec())
+    }
+}
+
+/// Parses `all` or a comma separated list of field names; required fields are added if missing.
+pub fn parse_stats_fields(s: &str) -> Result<StatsFields, String> {
+    if s == "all" {
+        return Ok(StatsFields::default());
+    }
+    let mut fields = Vec::new();
+    for name in s.split(',').map(str::trim).filter(|n| !n.is_empty()) {
+        let field = StatsField::ALL
+            .into_iter()
+            .find(|f| f.name() == name)
+            .ok_or_else(|| format!("unknown stats field '{name}'"))?;
+        if !fields.contains(&field) {
+            fields.push(field);
+        }
+    }
+    for field in StatsField::REQUIRED {
+        if !fields.contains(&field) {
+            fields.push(field);
+        }
+    }
+    Ok(StatsFields(fields))
+}
+
+/// One sample of every [`StatsField`] for a connection.
+#[derive(Clone, Copy, Debug)]
+pub struct StatsSample {
+    values: [u64; StatsField::ALL.len()],
+}
+
+impl StatsSample {
+    pub fn capture(
+        stats: &ConnectionStats,
+        connection_id: u64,
+        sent: u64,
+        intended_sent: u64,
+    ) -> Self {
+        let mut values = [0; StatsField::ALL.len()];
+        for (value, field) in values.iter_mut().zip(StatsField::ALL) {
+            *value = match field {
+                StatsField::UdpTx => stats.udp_tx.bytes,
+                StatsField::UdpRx => stats.udp_rx.bytes,
+                StatsField::Sent => sent,
+                StatsField::CongestionEvents => stats.path.congestion_events,
+                StatsField::CongestionWindow => stats.path.cwnd,
+                StatsField::LostPackets => stats.path.lost_packets,
+                StatsField::Time => solana_epoch_micros(),
+                StatsField::ConnectionId => connection_id,
+                StatsField::IntendedSent => intended_sent,
+                StatsField::UdpTxDatagrams => stats.udp_tx.datagrams,
+                StatsField::SentPackets => stats.path.sent_packets,
+                StatsField::LostBytes => stats.path.lost_bytes,
+                StatsField::RttUs => stats.path.rtt.as_micros() as u64,
+                StatsField::CurrentMtu => stats.path.current_mtu as u64,
+                StatsField::TxStreamsBlockedUni => stats.frame_tx.streams_blocked_uni,
+                StatsField::RxMaxStreamsUni => stats.frame_rx.max_streams_uni,
+                StatsField::TxStreamDataBlocked => stats.frame_tx.stream_data_blocked,
+                StatsField::TxDataBlocked => stats.frame_tx.data_blocked,
+                StatsField::RxMaxData => stats.frame_rx.max_data,
+                StatsField::RxMaxStreamData => stats.frame_rx.max_stream_data,
+            };
+        }
+        Self { values }
+    }
+
+    pub fn get(&self, field: StatsField) -> u64 {
+        self.values[field as usize]
+    }
+}
+
+impl TimeOrdered for StatsSample {
+    fn time_stamp(&self) -> u64 {
+        self.get(StatsField::Time)
+    }
+}
+
+/// Layout of a `<host>-host-transactions.bin` file.
+///
+/// The file starts with `STATS_MAGIC`, a u32 length and that many bytes of JSON
+/// naming the fields (all u64, little endian) and the sampling interval. The JSON
+/// is padded with spaces so records start 8-byte aligned.
+#[derive(Clone, Debug)]
+pub struct StatsLayout {
+    pub fields: Vec<StatsField>,
+    pub interval: Duration,
+}
+
+pub const STATS_MAGIC: &[u8; 8] = b"QSTATS\0\0";
+pub const STATS_VERSION: u64 = 3;
+
+impl StatsLayout {
+    /// `extra` is merged into the header, e.g. the run parameters.
+    pub fn header(&self, extra: serde_json::Value) -> Vec<u8> {
+        let mut header = serde_json::json!({
+            "version": STATS_VERSION,
+            "fields": self.fields.iter().map(|f| f.name()).collect::<Vec<_>>(),
+            "dtype": "<u8",
+            "sample_interval_us": self.interval.as_micros() as u64,
+        });
+        if let (Some(header), serde_json::Value::Object(extra)) = (header.as_object_mut(), extra) {
+            header.extend(extra);
+        }
+        let mut json = header.to_string().into_bytes();
+        while (STATS_MAGIC.len() + 4 + json.len()) % 8 != 0 {
+            json.push(b' ');
+        }
+        let mut out = Vec::with_capacity(STATS_MAGIC.len() + 4 + json.len());
+        out.extend_from_slice(STATS_MAGIC);
+        out.extend_from_slice(&(json.len() as u32).to_le_bytes());
+        out.extend_from_slice(&json);
+        out
+    }
+
+    pub fn write_sample<W: Write>(
+        &self,
+        sample: &StatsSample,
+        writer: &mut W,
+    ) -> std::io::Result<()> {
+        for field in &self.fields {
+            writer.write_all(&sample.get(*field).to_le_bytes())?;
+        }
+        Ok(())
+    }
+}
+
+/// One transaction handed to the connection, written to `<host>-sendlog.bin`.
+/// Records of different connections are in arrival order, not strictly by time.
 #[derive(Clone, Copy, Debug, AnyBitPattern, NoUninit)]
 #[repr(C)]
-pub struct StatsSample {
-    pub udp_tx: u64,
-    pub udp_rx: u64,
-    pub sent: u64,
-    pub congestion_events: u64,
-    pub congestion_window: u64,
-    pub lost_packets: u64,
+pub struct SendRecord {
     pub time_stamp: u64,
-    pub connection_id: u64,
+    /// Same id as embedded in the transaction payload
+    pub transaction_id: u32,
+    pub connection_id: u32,
+}
+
+impl TimeOrdered for SendRecord {
+    fn time_stamp(&self) -> u64 {
+        self.time_stamp
+    }
+}
+
+/// Counters describing where the in-flight stream window of one connection stalled.
+#[derive(Debug, Default)]
+pub struct StreamWindowStats {
+    /// Transactions for which `open_uni` had to wait for stream credit
+    pub open_uni_blocked: AtomicU64,
+    pub open_uni_wait_us: AtomicU64,
+    /// Transactions for which `write_all` had to wait for flow control / cwnd
+    pub write_blocked: AtomicU64,
+    pub write_wait_us: AtomicU64,
+    /// Times all window slots were busy and a new transaction had to wait
+    pub window_full: AtomicU64,
+    /// Send records dropped because the send log writer was a full channel behind
+    pub send_log_dropped: AtomicU64,
+}
+
+impl StreamWindowStats {
+    pub fn add(&self, other: &StreamWindowStats) {
+        self.open_uni_blocked
+            .fetch_add(other.open_uni_blocked.load(Relaxed), Relaxed);
+        self.open_uni_wait_us
+            .fetch_add(other.open_uni_wait_us.load(Relaxed), Relaxed);
+        self.write_blocked
+            .fetch_add(other.write_blocked.load(Relaxed), Relaxed);
+        self.write_wait_us
+            .fetch_add(other.write_wait_us.load(Relaxed), Relaxed);
+        self.window_full
+            .fetch_add(other.window_full.load(Relaxed), Relaxed);
+        self.send_log_dropped
+            .fetch_add(other.send_log_dropped.load(Relaxed), Relaxed);
+    }
 }
 
-pub fn file_bin(host: String) -> anyhow::Result<std::io::BufWriter<std::fs::File>> {
-    let file_name = format!("{}-host-transactions.bin", host);
+impl std::fmt::Display for StreamWindowStats {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        write!(
+            f,
+            "open_uni_blocked={} open_uni_wait_us={} write_blocked={} write_wait_us={} window_full={} send_log_dropped={}",
+            self.open_uni_blocked.load(Relaxed),
+            self.open_uni_wait_us.load(Relaxed),
+            self.write_blocked.load(Relaxed),
+            self.write_wait_us.load(Relaxed),
+            self.window_full.load(Relaxed),
+            self.send_log_dropped.load(Relaxed),
+        )
+    }
+}
+
+/// Write buffer of one results file when a process writes just a few of them.
+pub const RESULTS_BUFFER_BYTES: usize = 1024 * 1024;
+
+pub fn file_bin(
+    host: String,
+    buffer_bytes: usize,
+) -> anyhow::Result<std::io::BufWriter<std::fs::File>> {
+    results_file(format!("{}-host-transactions.bin", host), buffer_bytes)
+}
+
+pub fn send_log_file(
+    host: String,
+    buffer_bytes: usize,
+) -> anyhow::Result<std::io::BufWriter<std::fs::File>> {
+    results_file(format!("{}-sendlog.bin", host), buffer_bytes)
+}
+
+fn results_file(
+    file_name: String,
+    buffer_bytes: usize,
+) -> anyhow::Result<std::io::BufWriter<std::fs::File>> {
     let mut path = std::path::PathBuf::from("results");
     path.push(file_name);
     let file = std::fs::File::create(path)?;
-    let file = std::io::BufWriter::with_capacity(1024 * 1024, file);
+    let file = std::io::BufWriter::with_capacity(buffer_bytes, file);
     Ok(file)
 }
+
+/// Starts a writer merging `channels` record streams into `writer`.
+/// Returns one sender per stream; the writer finishes once all of them are dropped.
+/// `encode` writes one record, e.g. [`write_raw`]. The writer runs on tokio's
+/// blocking pool: its file I/O must not take worker threads from the connections.
+pub fn spawn_merged_writer<T, W, E>(
+    writer: W,
+    channels: usize,
+    capacity: usize,
+    encode: E,
+) -> (Vec<mpsc::Sender<T>>, JoinHandle<anyhow::Result<u64>>)
+where
+    T: TimeOrdered + Send + 'static,
+    W: Write + Send + 'static,
+    E: FnMut(&T, &mut W) -> std::io::Result<()> + Send + 'static,
+{
+    let (senders, receivers): (Vec<_>, Vec<_>) =
+        (0..channels).map(|_| mpsc::channel(capacity)).unzip();
+    (
+        senders,
+        tokio::task::spawn_blocking(move || write_merged(writer, receivers, encode)),
+    )
+}
+
+/// Starts a writer appending records to `writer` in the order they arrive.
+/// Returns one sender for all producers to clone; the writer finishes once every
+/// clone is dropped. Unlike [`spawn_merged_writer`] no producer is ever waited for,
+/// so a stalled one cannot hold up the others' records. Runs on the blocking pool.
+pub fn spawn_writer<T, W, E>(
+    mut writer: W,
+    capacity: usize,
+    mut encode: E,
+) -> (mpsc::Sender<T>, JoinHandle<anyhow::Result<u64>>)
+where
+    T: Send + 'static,
+    W: Write + Send + 'static,
+    E: FnMut(&T, &mut W) -> std::io::Result<()> + Send + 'static,
+{
+    let (sender, mut receiver) = mpsc::channel(capacity);
+    let handle = tokio::task::spawn_blocking(move || {
+        let mut written = 0;
+        while let Some(record) = receiver.blocking_recv() {
+            encode(&record, &mut writer)?;
+            written += 1;
+        }
+        writer.flush()?;
+        Ok(written)
+    });
+    (sender, handle)
+}
+
+/// Merges the per-connection record streams into one time-ordered file.
+///
+/// Every connection produces its records in time order, so a k-way merge over
+/// the channel heads is enough; memory stays bounded by the channel capacity.
+/// Returns the number of records written once all senders are dropped. Blocks
+/// the calling thread, so it must not run on an async worker thread.
+pub fn write_merged<T, W, E>(
+    mut writer: W,
+    mut receivers: Vec<mpsc::Receiver<T>>,
+    mut encode: E,
+) -> anyhow::Result<u64>
+where
+    T: TimeOrdered,
+    W: Write,
+    E: FnMut(&T, &mut W) -> std::io::Result<()>,
+{
+    let mut heads: Vec<Option<T>> = vec![None; receivers.len()];
+    let mut order = BinaryHeap::with_capacity(receivers.len());
+    for (idx, receiver) in receivers.iter_mut().enumerate() {
+        if let Some(record) = receiver.blocking_recv() {
+            order.push(Reverse((record.time_stamp(), idx)));
+            heads[idx] = Some(record);
+        }
+    }
+    let mut written = 0;
+    while let Some(Reverse((_, idx))) = order.pop() {
+        let record = heads[idx]
+            .take()
+            .expect("every queued index has a head record");
+        encode(&record, &mut writer)?;
+        written += 1;
+        if let Some(record) = receivers[idx].blocking_recv() {
+            order.push(Reverse((record.time_stamp(), idx)));
+            heads[idx] = Some(record);
+        }
+    }
+    writer.flush()?;
+    Ok(written)
+}
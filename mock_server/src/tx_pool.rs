@@ -0,0 +1,92 @@
+use std::{fs::File, path::Path};
+
+use anyhow::{bail, Context};
+use bytes::Bytes;
+use memmap2::Mmap;
+use solana_pubkey::Pubkey;
+
+// Layout written by make_txpool.py, all integers little endian:
+//   header (64 bytes): magic, version u32, slot_size u32, count u64, identity [u8; 32], padding
+//   count slots of slot_size bytes: payload length u16, payload, zero padding
+pub const TX_POOL_MAGIC: &[u8; 8] = b"TXPOOL\0\0";
+pub const TX_POOL_VERSION: u32 = 1;
+pub const TX_POOL_HEADER_SIZE: usize = 64;
+
+/// Pre-signed transactions, memory-mapped and handed out without copying.
+#[derive(Clone)]
+pub struct TxPool {
+    data: Bytes,
+    slot_size: usize,
+    count: usize,
+    total_payload: u64,
+}
+
+impl TxPool {
+    /// Maps a pool file and checks it was built for `identity`.
+    pub fn open(path: &Path, identity: &Pubkey) -> anyhow::Result<Self> {
+        let file = File::open(path).with_context(|| format!("opening {}", path.display()))?;
+        // SAFETY: the pool is written once by the generator and only read afterwards
+        let mmap = unsafe { Mmap::map(&file) }?;
+        if mmap.len() < TX_POOL_HEADER_SIZE || &mmap[0..8] != TX_POOL_MAGIC {
+            bail!("{} is not a transaction pool", path.display());
+        }
+        let u32_at = |at: usize| u32::from_le_bytes(mmap[at..at + 4].try_into().unwrap());
+        let version = u32_at(8);
+        if version != TX_POOL_VERSION {
+            bail!("{}: unsupported pool version {version}", path.display());
+        }
+        let slot_size = u32_at(12) as usize;
+        let count = u64::from_le_bytes(mmap[16..24].try_into().unwrap()) as usize;
+        let pool_identity = Pubkey::new_from_array(mmap[24..56].try_into().unwrap());
+        if pool_identity != *identity {
+            bail!(
+                "{} was signed by {pool_identity}, the client identity is {identity}",
+                path.display()
+            );
+        }
+        if count == 0 || slot_size < 2 || mmap.len() < TX_POOL_HEADER_SIZE + count * slot_size {
+            bail!("{}: truncated or empty pool", path.display());
+        }
+
+        let data = Bytes::from_owner(mmap);
+        let mut pool = Self {
+            data,
+            slot_size,
+            count,
+            total_payload: 0,
+        };
+        for i in 0..count {
+            let len = pool.payload_len(i);
+            if len + 2 > slot_size {
+                bail!("{}: slot {i} overflows ({len} bytes)", path.display());
+            }
+            pool.total_payload += len as u64;
+        }
+        Ok(pool)
+    }
+
+    pub fn len(&self) -> usize {
+        self.count
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.count == 0
+    }
+
+    /// Average transaction size, what the pacer should budget per send.
+    pub fn mean_size(&self) -> f64 {
+        self.total_payload as f64 / self.count as f64
+    }
+
+    fn payload_len(&self, i: usize) -> usize {
+        let at = TX_POOL_HEADER_SIZE + i * self.slot_size;
+        u16::from_le_bytes([self.data[at], self.data[at + 1]]) as usize
+    }
+
+    /// The `i`-th transaction (wrapping around), a view into the mapping.
+    pub fn get(&self, i: usize) -> Bytes {
+        let i = i % self.count;
+        let at = TX_POOL_HEADER_SIZE + i * self.slot_size + 2;
+        self.data.slice(at..at + self.payload_len(i))
+    }
+}
@@ -1,64 +1,88 @@
 #!/usr/bin/python
 import argparse
 
-import numpy as np
-from base58 import b58encode, b58decode
-import os
+from base58 import b58encode
 import pprint
 import json
-import re
 
-import datatypes
-from datatypes import server_record_dtype
+from fairness import analyze, print_summary, summarize
+from results_loader import IdentityIndex, client_files, client_totals, load_server_log, load_stakes
+import run_db
 
 
-def main(hosts_file:str):
+def main(hosts_file:str, record: bool = True, label: str | None = None):
     config = json.load(open("results/config.json"))
     pprint.pprint(config)
     duration = config["duration"]
 
     try:
-        server_data = np.fromfile("results/serverlog.bin", dtype=server_record_dtype)
+        server_data = load_server_log()
         print(f"Server captured {len(server_data)} transactions ({int(len(server_data) / duration)} TPS)")
-    except:
+        if config.get("ceiling-tps"):
+            print(
+                f"Network ceiling {config['ceiling-tps']:.0f} TPS:"
+                f" server reached {len(server_data) / duration / config['ceiling-tps']:.1%} of it"
+            )
+    except FileNotFoundError:
         server_data = None
         print("Server state not available")
 
-    stakes = [
-        re.split(r"[\s]+", line.strip())
-        for line in open(hosts_file).readlines()
-    ]
-    for v in stakes:
-        print(v)
-    stakes = {b58decode(a): int(b) for a, b in stakes}
+    stakes = load_stakes(hosts_file)
+    for id, stake in stakes.items():
+        print([b58encode(id).decode("ascii"), stake])
 
+    received = None
+    if server_data is not None:
+        index = IdentityIndex(list(stakes))
+        received = index.counts(server_data)
 
-    per_client = {}
-    for file in os.listdir("results"):
-        if file.endswith("host-transactions.bin"):
-            num = np.fromfile(f"./results/{file}", dtype=datatypes.client_record_dtype)
-            sent = num["sent"].max()
-            per_client[file.split("-")[0]] = sent
+    per_client = {
+        host: client_totals(path, ("sent", "intended_sent"))
+        for host, path in client_files().items()
+    }
 
-    datapoints = open("datapoints.csv", "a+")
-    for id in stakes:
+    results = {}
+    for i, id in enumerate(stakes):
         b58_id = b58encode(id).decode("ascii")
-        sent = per_client[b58_id]
+        sent = per_client[b58_id]["sent"]
+        intended = per_client[b58_id]["intended_sent"]
+        if intended:
+            print(f"{b58_id}: pacer intended {intended}, sent {(sent / intended - 1) * 100:+.1f}%")
 
-        if server_data is not None:
-            got = (server_data["id"] == id).sum()
+        link = config[b58_id]
+        link_info = f"latency={link['latency']}ms bandwidth={link.get('bandwidth')}Mbit"
+        if received is not None:
+            got = int(received[i])
             print(
-            f"{b58_id}: {sent=} {got=} lost {int(sent - got)} ({int(got / duration)} TPS)"
+            f"{b58_id}: {link_info} {sent=} {got=} lost {int(sent - got)} ({int(got / duration)} TPS)"
             )
 
         else:
             got = sent
             print(
-                f"{b58_id}: {sent=}   ({int(sent / duration)} TPS)"
+                f"{b58_id}: {link_info} {sent=}   ({int(sent / duration)} TPS)"
             )
 
-        datapoints.write(f"{config[b58_id]['latency']} {stakes[id]} {got / duration}\n")
-    datapoints.close()
+        results[b58_id] = {
+            "stake": stakes[id],
+            "latency": link["latency"],
+            "bandwidth": link.get("bandwidth"),
+            "sent": sent,
+            "intended": intended,
+            "got": got,
+        }
+    jain = None
+    if server_data is not None and len(server_data):
+        summary = summarize(analyze(hosts_file))
+        print_summary(summary)
+        jain = summary["jain_mean"]
+    if record:
+        run_id = run_db.record_run(config, results, jain=jain, label=label)
+        # names the archive this run's raw files end up in
+        with open("results/run_id", "w") as f:
+            f.write(f"{run_id}\n")
+        print(f"Recorded as run {run_id} in {run_db.DB_PATH}")
+    return results
 
 
 if __name__ == "__main__":
@@ -68,5 +92,7 @@ if __name__ == "__main__":
         epilog="If you encounter some bug, I wish you a luck ©No-Manuel Macros",
     )
     parser.add_argument("hosts", type=str, help="file with staked accounts")
+    parser.add_argument("--label", type=str, help="tag stored with the run in runs.db")
+    parser.add_argument("--no-record", action="store_true", help="do not add the run to runs.db")
     args = parser.parse_args()
-    main(args.hosts)
+    main(args.hosts, record=not args.no_record, label=args.label)
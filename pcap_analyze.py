@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+from timeline import BinnedSeries
+
+# Ring-buffered captures of the server link and of selected client links
+# (main.py --capture-server / --capture-client), and what they say about where
+# datagrams get lost: per-flow datagram rate, payload sizes and burstiness as
+# seen on each link, and, for captured clients, the client -> server link delay
+# of every datagram, matched between the two captures by a fingerprint of its
+# (encrypted, so practically unique) payload.
+#
+# Captures are memory-mapped and streamed CHUNK_RECORDS records at a time. The
+# capture filter keeps only frames longer than SNAPLEN, so every record is
+# exactly SNAPLEN bytes and the file maps as a fixed-size record array; files
+# that are not like that (other tools, other filters) are walked record by
+# record instead.
+
+CAPTURE_PREFIX = "capture-"
+SNAPLEN = 96
+# frames shorter than this (ACKs, handshakes) are not captured
+MIN_FRAME = 128
+FINGERPRINT_BYTES = 32
+# server files this long past a client file are searched for its datagrams
+MAX_LINK_DELAY_NS = 1_000_000_000
+CHUNK_RECORDS = 1 << 20
+SCAN_BLOCK = 1 << 26
+# bin used for peak rates and the index of dispersion
+BURST_BIN_NS = 1_000_000
+# payload size histogram range, bigger payloads land in the last bin
+MAX_PAYLOAD = 2048
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+packet_dtype = np.dtype(
+    [
+        ("time", "<u8"),  # ns since the unix epoch
+        ("src", "<u4"),
+        ("dst", "<u4"),
+        ("sport", "<u2"),
+        ("dport", "<u2"),
+        ("payload", "<u2"),  # UDP payload bytes
+        ("fingerprint", "<u8"),
+    ]
+)
+
+
+def capture_command(interface: str, name: str, port: int, file_mb: int, files: int, results: str = "results") -> str:
+    """tcpdump keeping the last `files` files of `file_mb` MB of the datagrams to and from `port`."""
+    return (
+        f"exec tcpdump -i {interface} -n -Z root -B 65536 --time-stamp-precision nano -s {SNAPLEN}"
+        f" -C {file_mb} -W {files} -w {os.path.join(results, CAPTURE_PREFIX + name + '.pcap')}"
+        f" 'udp port {port} and greater {MIN_FRAME}'"
+    )
+
+
+def capture_files(results_dir: str, name: str) -> list[str]:
+    """Ring files of one capture, oldest first."""
+    paths = glob.glob(os.path.join(results_dir, f"{CAPTURE_PREFIX}{name}.pcap*"))
+    paths = [path for path in paths if os.path.getsize(path) > 24]
+    return sorted(paths, key=lambda path: PcapFile(path).first_time())
+
+
+def capture_names(results_dir: str) -> list[str]:
+    names = {
+        os.path.basename(path)[len(CAPTURE_PREFIX) :].split(".pcap")[0]
+        for path in glob.glob(os.path.join(results_dir, f"{CAPTURE_PREFIX}*.pcap*"))
+    }
+    return sorted(names)
+
+
+class PcapFile:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(24)
+        if len(head) < 24:
+            raise ValueError(f"{path}: truncated pcap header")
+        (magic,) = struct.unpack("<I", head[:4])
+        if magic in (0xA1B2C3D4, 0xA1B23C4D):
+            self.endian = "<"
+        elif magic in (0xD4C3B2A1, 0x4D3CB2A1):
+            self.endian = ">"
+            (magic,) = struct.unpack(">I", head[:4])
+        else:
+            raise ValueError(f"{path}: not a pcap file")
+        self.frac_ns = 1 if magic == 0xA1B23C4D else 1000
+        self.snaplen, self.linktype = struct.unpack(self.endian + "II", head[16:24])
+        self.header_dtype = np.dtype(
+            [(field, self.endian + "u4") for field in ("ts_sec", "ts_frac", "incl_len", "orig_len")]
+        )
+        self.record_dtype = np.dtype(self.header_dtype.descr + [("data", "u1", (self.snaplen,))])
+
+    def first_time(self) -> int:
+        with open(self.path, "rb") as f:
+            f.seek(24)
+            head = f.read(16)
+        if len(head) < 16:
+            return 0
+        sec, frac = struct.unpack(self.endian + "II", head[:8])
+        return sec * 1_000_000_000 + frac * self.frac_ns
+
+    def records(self, chunk_records: int = CHUNK_RECORDS):
+        """Yields the records as record_dtype arrays (data padded to snaplen), a chunk at a time."""
+        count = (os.path.getsize(self.path) - 24) // self.record_dtype.itemsize
+        mapped = np.memmap(self.path, dtype=self.record_dtype, mode="r", offset=24, shape=(count,)) if count else []
+        for start in range(0, count, chunk_records):
+            chunk = mapped[start : start + chunk_records]
+            if not (chunk["incl_len"] == self.snaplen).all():
+                # records of varying length from here on
+                yield from self._scan(24 + start * self.record_dtype.itemsize, chunk_records)
+                return
+            yield np.asarray(chunk)
+
+    def _scan(self, offset: int, chunk_records: int):
+        pad = np.zeros(self.snaplen, dtype=np.uint8)
+        data_index = np.arange(self.snaplen)
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            rest = b""
+            while block := f.read(SCAN_BLOCK):
+                buf = rest + block
+                starts, pos = [], 0
+                while pos + 16 <= len(buf):
+                    (incl_len,) = struct.unpack_from(self.endian + "I", buf, pos + 8)
+                    if pos + 16 + incl_len > len(buf):
+                        break
+                    starts.append(pos)
+                    pos += 16 + incl_len
+                rest = buf[pos:]
+                if not starts:
+                    continue
+                raw = np.concatenate([np.frombuffer(buf, dtype=np.uint8, count=pos), pad])
+                starts = np.array(starts)
+                for i in range(0, len(starts), chunk_records):
+                    at = starts[i : i + chunk_records]
+                    out = np.empty(len(at), dtype=self.record_dtype)
+                    header = raw[at[:, None] + np.arange(16)].copy().view(self.header_dtype)[:, 0]
+                    for field in self.header_dtype.names:
+                        out[field] = header[field]
+                    data = raw[at[:, None] + 16 + data_index]
+                    # bytes past a record's own length belong to the next one
+                    data[data_index[None, :] >= out["incl_len"][:, None]] = 0
+                    out["data"] = data
+                    yield out
+
+
+def _be(data: np.ndarray, at: np.ndarray, size: int) -> np.ndarray:
+    """Big-endian unsigned ints of `size` bytes at per-row offsets `at` (clipped to the record)."""
+    value = np.zeros(len(data), dtype=np.uint64)
+    for i in range(size):
+        column = np.minimum(at + i, data.shape[1] - 1)[:, None]
+        value = (value << np.uint64(8)) | np.take_along_axis(data, column, axis=1)[:, 0]
+    return value
+
+
+def decode(records: np.ndarray, pcap: PcapFile) -> tuple[np.ndarray, int]:
+    """IPv4/UDP datagrams of a record chunk as packet_dtype, and how many records were not such."""
+    data = records["data"]
+    n = len(records)
+    if pcap.linktype == LINKTYPE_ETHERNET:
+        ethertype = _be(data, np.full(n, 12), 2)
+        vlan = ethertype == 0x8100
+        ethertype = np.where(vlan, _be(data, np.full(n, 16), 2), ethertype)
+        l3 = np.where(vlan, 18, 14)
+    elif pcap.linktype == LINKTYPE_LINUX_SLL:
+        ethertype, l3 = _be(data, np.full(n, 14), 2), np.full(n, 16)
+    elif pcap.linktype == LINKTYPE_LINUX_SLL2:
+        ethertype, l3 = _be(data, np.full(n, 0), 2), np.full(n, 20)
+    elif pcap.linktype == LINKTYPE_RAW:
+        ethertype, l3 = np.where(data[:, 0] >> 4 == 4, 0x0800, 0), np.zeros(n, dtype=np.int64)
+    else:
+        raise ValueError(f"{pcap.path}: unsupported link type {pcap.linktype}")
+    l3 = l3.astype(np.int64)
+    ihl = (np.take_along_axis(data, l3[:, None], axis=1)[:, 0] & 0x0F).astype(np.int64) * 4
+    udp = l3 + ihl
+    protocol = _be(data, l3 + 9, 1)
+    payload = udp + 8
+    keep = (ethertype == 0x0800) & (protocol == 17) & (payload + FINGERPRINT_BYTES <= records["incl_len"])
+    data, l3, udp, payload = data[keep], l3[keep], udp[keep], payload[keep]
+
+    packets = np.empty(len(data), dtype=packet_dtype)
+    packets["time"] = records["ts_sec"][keep].astype(np.uint64) * np.uint64(1_000_000_000) + records["ts_frac"][
+        keep
+    ].astype(np.uint64) * np.uint64(pcap.frac_ns)
+    packets["src"] = _be(data, l3 + 12, 4)
+    packets["dst"] = _be(data, l3 + 16, 4)
+    packets["sport"] = _be(data, udp, 2)
+    packets["dport"] = _be(data, udp + 2, 2)
+    packets["payload"] = _be(data, udp + 4, 2) - 8
+    words = np.take_along_axis(data, payload[:, None] + np.arange(FINGERPRINT_BYTES), axis=1)
+    words = np.ascontiguousarray(words).view("<u8")
+    fingerprint = np.zeros(len(data), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(words.shape[1]):
+            fingerprint = (fingerprint ^ words[:, i]) * np.uint64(0x100000001B3)
+    packets["fingerprint"] = fingerprint
+    return packets, int(n - keep.sum())
+
+
+def packets(paths: list[str]):
+    """Decoded datagrams of a capture's ring files, in file order; yields (packets, skipped records)."""
+    for path in paths:
+        pcap = PcapFile(path)
+        for records in pcap.records():
+            yield decode(records, pcap)
+
+
+def ip(address: int) -> str:
+    return ".".join(str((int(address) >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+
+
+class FlowStats:
+    """Per-flow counters accumulated over a stream of packet chunks."""
+
+    def __init__(self):
+        self.ids: dict[tuple, int] = {}
+        self.count = np.zeros(0)
+        self.bytes = np.zeros(0)
+        self.first = np.zeros(0, dtype=np.uint64)
+        self.last = np.zeros(0, dtype=np.uint64)
+        self.iat_sum = np.zeros(0)
+        self.iat_sumsq = np.zeros(0)
+        self.sizes = np.zeros((0, MAX_PAYLOAD + 1))
+        self.rates: list[BinnedSeries] = []
+        self.skipped = 0
+
+    def _flow_ids(self, chunk: np.ndarray) -> np.ndarray:
+        keys, inverse = np.unique(chunk[["src", "dst", "sport", "dport"]], return_inverse=True)
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys.tolist()):
+            if key not in self.ids:
+                self.ids[key] = len(self.ids)
+                self._grow()
+            ids[i] = self.ids[key]
+        return ids[inverse.ravel()]
+
+    def _grow(self):
+        for name in ("count", "bytes", "iat_sum", "iat_sumsq"):
+            setattr(self, name, np.append(getattr(self, name), 0.0))
+        self.first = np.append(self.first, np.uint64(0))
+        self.last = np.append(self.last, np.uint64(0))
+        self.sizes = np.vstack([self.sizes, np.zeros((1, MAX_PAYLOAD + 1))])
+        self.rates.append(BinnedSeries(1))
+
+    def add(self, chunk: np.ndarray):
+        if len(chunk) == 0:
+            return
+        flow = self._flow_ids(chunk)
+        order = np.lexsort((chunk["time"], flow))
+        flow, t = flow[order], chunk["time"][order]
+        payload = chunk["payload"][order].astype(np.int64)
+        starts = np.flatnonzero(np.diff(flow, prepend=-1))
+        flows = flow[starts]
+
+        seen = self.count[flows] > 0
+        previous = np.where(seen, self.last[flows], t[starts])
+        iat = np.diff(t.astype(np.int64), prepend=0).astype(np.float64)
+        iat[starts] = t[starts].astype(np.int64) - previous.astype(np.int64)
+        iat = np.maximum(iat, 0) / 1e3  # µs
+        first_of_flow = np.zeros(len(t), dtype=bool)
+        first_of_flow[starts[~seen]] = True
+        iat[first_of_flow] = 0
+
+        self.first[flows[~seen]] = t[starts[~seen]]
+        np.add.at(self.count, flow, 1)
+        np.add.at(self.bytes, flow, payload)
+        self.iat_sum += np.bincount(flow, weights=iat, minlength=len(self.ids))
+        self.iat_sumsq += np.bincount(flow, weights=iat**2, minlength=len(self.ids))
+        ends = np.append(starts[1:], len(t)) - 1
+        self.last[flows] = np.maximum(self.last[flows], t[ends])
+        np.add.at(self.sizes, (flow, np.minimum(payload, MAX_PAYLOAD)), 1)
+        bins = (t // np.uint64(BURST_BIN_NS)).astype(np.int64)
+        for f, lo, hi in zip(flows, starts, ends + 1):
+            self.rates[f].add(np.zeros(hi - lo, dtype=np.int64), bins[lo:hi])
+
+    def summary(self) -> list[dict]:
+        rows = []
+        for key, f in self.ids.items():
+            src, dst, sport, dport = key
+            count = self.count[f]
+            span = max(int(self.last[f]) - int(self.first[f]), 1) / 1e9
+            gaps = count - 1
+            iat_mean = self.iat_sum[f] / gaps if gaps > 0 else float("nan")
+            iat_std = np.sqrt(max(self.iat_sumsq[f] / gaps - iat_mean**2, 0)) if gaps > 0 else float("nan")
+            cdf = np.cumsum(self.sizes[f]) / count
+            p5, p50, p95 = (int(np.searchsorted(cdf, q)) for q in (0.05, 0.5, 0.95))
+            per_bin = self.rates[f].values[0]
+            bin_mean = per_bin.mean() if len(per_bin) else 0.0
+            rows.append(
+                {
+                    "src": f"{ip(src)}:{sport}",
+                    "dst": f"{ip(dst)}:{dport}",
+                    "packets": int(count),
+                    "bytes": int(self.bytes[f]),
+                    "duration_s": span,
+                    "pps": count / span,
+                    "mbps": self.bytes[f] * 8 / span / 1e6,
+                    "payload_p5": p5,
+                    "payload_p50": p50,
+                    "payload_p95": p95,
+                    "iat_mean_us": iat_mean,
+                    "iat_cv": iat_std / iat_mean if gaps > 0 and iat_mean > 0 else float("nan"),
+                    "peak_pps": per_bin.max() * 1e9 / BURST_BIN_NS if len(per_bin) else 0.0,
+                    "dispersion": per_bin.var() / bin_mean if bin_mean > 0 else float("nan"),
+                }
+            )
+        return sorted(rows, key=lambda row: -row["packets"])
+
+
+def flow_stats(paths: list[str]) -> FlowStats:
+    stats = FlowStats()
+    for chunk, skipped in packets(paths):
+        stats.add(chunk)
+        stats.skipped += skipped
+    return stats
+
+
+def ring_spans(paths: list[str]) -> list[tuple[int, int]]:
+    """Time span of each ring file (as from capture_files): its first record up to the next file's first."""
+    firsts = [PcapFile(path).first_time() for path in paths]
+    return list(zip(firsts, firsts[1:] + [np.iinfo(np.int64).max]))
+
+
+def link_delays(client_paths: list[str], server_paths: list[str], port: int) -> dict:
+    """Client -> server delay of the datagrams found in both captures.
+
+    The queueing delay of a datagram is its delay minus the smallest delay seen
+    on its flow, i.e. what it spent in queues beyond propagation and
+    serialization. Datagrams the client sent while the server capture was
+    running, but which never showed up in it, were lost on the way.
+
+    One client ring file is matched at a time, against the server files that
+    overlap it, so what is held grows with the matched delays and the
+    unmatched datagrams, not with the whole client capture.
+    """
+    server_spans = ring_spans(server_paths)
+    server_first = server_spans[0][0] if server_spans else None
+    # the last file starts before the capture ended; raised to the last datagram read
+    server_last = server_spans[-1][0] if server_spans else None
+    sent_count = matched_count = 0
+    delays, flows, unmatched = [], [], []
+    for path in client_paths if server_spans else []:
+        sent = [chunk[chunk["dport"] == port] for chunk, _ in packets([path])]
+        sent = np.concatenate(sent) if sent else np.empty(0, dtype=packet_dtype)
+        if len(sent) == 0:
+            continue
+        sent = sent[np.argsort(sent["fingerprint"], kind="stable")]
+        matched = np.zeros(len(sent), dtype=bool)
+        first, last = int(sent["time"].min()), int(sent["time"].max()) + MAX_LINK_DELAY_NS
+        overlapping = [server for (lo, hi), server in zip(server_spans, server_paths) if hi > first and lo <= last]
+        for chunk, _ in packets(overlapping):
+            if len(chunk) == 0:
+                continue
+            server_last = max(server_last, int(chunk["time"].max()))  # pyright:ignore
+            at = np.minimum(np.searchsorted(sent["fingerprint"], chunk["fingerprint"]), len(sent) - 1)
+            hit = sent["fingerprint"][at] == chunk["fingerprint"]
+            at = at[hit]
+            matched[at] = True
+            delay = chunk["time"][hit].astype(np.int64) - sent["time"][at].astype(np.int64)
+            delays.append((delay / 1e3).astype(np.float32))  # µs
+            flows.append(sent["sport"][at])
+        sent_count += len(sent)
+        matched_count += int(matched.sum())
+        # candidates for lost on the wire; the window's end is only known once every delay is
+        missed = sent["time"][~matched]
+        unmatched.append(missed[missed >= server_first])
+    result = {"sent": sent_count, "matched": matched_count}
+    delay = np.concatenate(delays) if delays else np.empty(0)
+    if len(delay) == 0:
+        return result
+    sport = np.concatenate(flows)
+    baseline = np.zeros(len(delay))
+    for port_value in np.unique(sport):
+        mine = sport == port_value
+        baseline[mine] = delay[mine].min()
+    queueing = delay - baseline
+    # only datagrams that had time to arrive while the server capture was running
+    window_end = server_last - int(delay.max() * 1e3)  # pyright:ignore
+    in_window = 0
+    # a second pass over the client capture is cheaper than keeping every send time
+    for chunk, _ in packets(client_paths):
+        t = chunk["time"][chunk["dport"] == port].astype(np.int64)
+        in_window += int(((t >= server_first) & (t <= window_end)).sum())
+    missed = np.concatenate(unmatched).astype(np.int64)
+    result.update(
+        delay_min_us=float(delay.min()),
+        delay_p50_us=float(np.percentile(delay, 50)),
+        delay_p99_us=float(np.percentile(delay, 99)),
+        queueing_p50_us=float(np.percentile(queueing, 50)),
+        queueing_p99_us=float(np.percentile(queueing, 99)),
+        queueing_max_us=float(queueing.max()),
+        in_window=in_window,
+        lost_on_wire=int((missed <= window_end).sum()),
+    )
+    return result
+
+
+def analyze(results_dir: str = "results", server: str = "server", port: int = 8000) -> dict:
+    captures = {name: capture_files(results_dir, name) for name in capture_names(results_dir)}
+    captures = {name: paths for name, paths in captures.items() if paths}
+    report = {"flows": {}, "delays": {}}
+    client_ips = {}
+    for name, paths in captures.items():
+        stats = flow_stats(paths)
+        report["flows"][name] = {"skipped": stats.skipped, "flows": stats.summary()}
+        if name != server and stats.ids:
+            # the client's address is the source of most of what it captured
+            src = max(stats.ids, key=lambda key: stats.count[stats.ids[key]])[0]
+            client_ips[ip(src)] = name
+    for row in report["flows"].get(server, {}).get("flows", []):
+        row["client"] = client_ips.get(row["src"].split(":")[0])
+    if server in captures:
+        for name in client_ips.values():
+            report["delays"][name] = link_delays(captures[name], captures[server], port)
+    return report
+
+
+def print_report(report: dict):
+    for name, capture in report["flows"].items():
+        flows = capture["flows"]
+        print(f"== {name}: {len(flows)} flows, {capture['skipped']} non-UDP/short records skipped")
+        print(
+            f"{'src':>21} {'dst':>21} {'client':>8} {'packets':>10} {'pps':>9} {'Mbps':>8}"
+            f" {'size p5/p50/p95':>16} {'iat cv':>7} {'peak pps':>9} {'disp':>7}"
+        )
+        for row in flows:
+            sizes = f"{row['payload_p5']}/{row['payload_p50']}/{row['payload_p95']}"
+            print(
+                f"{row['src']:>21} {row['dst']:>21} {(row.get('client') or '-')[:8]:>8} {row['packets']:10}"
+                f" {row['pps']:9.0f} {row['mbps']:8.2f} {sizes:>16} {row['iat_cv']:7.2f} {row['peak_pps']:9.0f}"
+                f" {row['dispersion']:7.2f}"
+            )
+    for name, delays in report["delays"].items():
+        if "delay_min_us" not in delays:
+            print(f"== {name} -> server: {delays['matched']} of {delays['sent']} datagrams matched")
+            continue
+        lost = delays["lost_on_wire"] / delays["in_window"] if delays["in_window"] else float("nan")
+        print(
+            f"== {name} -> server: delay min {delays['delay_min_us']:.0f}us p50 {delays['delay_p50_us']:.0f}us"
+            f" p99 {delays['delay_p99_us']:.0f}us, queueing p50 {delays['queueing_p50_us']:.0f}us"
+            f" p99 {delays['queueing_p99_us']:.0f}us max {delays['queueing_max_us']:.0f}us,"
+            f" lost on the wire {delays['lost_on_wire']} of {delays['in_window']} ({lost:.2%})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="pcap_analyze", description="per-flow statistics of a run's packet captures")
+    parser.add_argument("--results", type=str, default="results", help="results directory with capture-*.pcap*")
+    parser.add_argument("--server", type=str, default="server", help="name of the server link's capture")
+    parser.add_argument("--port", type=int, default=8000, help="server port")
+    parser.add_argument("--json", type=str, help="also write the report here")
+    args = parser.parse_args()
+
+    report = analyze(args.results, args.server, args.port)
+    if not report["flows"]:
+        parser.error(f"no captures in {args.results}")
+    print_report(report)
+    if args.json:
+        json.dump(report, open(args.json, "w"), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,30 @@
+import argparse
+
 import numpy as np
-import sys
 from mpl_toolkits.mplot3d import Axes3D  # registers 3D projection
 import matplotlib.pyplot as plt
 
-data = np.genfromtxt("datapoints.csv", delimiter=" ")
-x, y, z = data[:, 0], data[:, 1], data[:, 2]
+from run_db import DB_PATH, query_results
+
+parser = argparse.ArgumentParser(prog="plot_3d", description="TPS over latency and stake from runs.db")
+parser.add_argument("title", nargs="*", help="words joined into the plot title and file name")
+parser.add_argument("--db", type=str, default=DB_PATH)
+parser.add_argument("--since", type=float, help="unix time, only runs recorded after it")
+parser.add_argument("--label", type=str)
+parser.add_argument("--server", type=str)
+parser.add_argument("--tx-size", type=int)
+parser.add_argument("--num-connections", type=int)
+args = parser.parse_args()
+
+rows = query_results(
+    args.db, args.since, label=args.label, server=args.server, tx_size=args.tx_size,
+    num_connections=args.num_connections,
+)
+if not rows:
+    raise SystemExit("no matching runs")
+x = np.array([row["latency"] for row in rows], dtype=float)
+y = np.array([row["stake"] for row in rows], dtype=float)
+z = np.array([row["tps"] for row in rows], dtype=float)
 
 # combine x and y into keys
 keys = np.column_stack((x, y))
@@ -22,7 +42,7 @@ ax = fig.add_subplot(111, projection="3d")
 
 # sc = ax.scatter(np.array(x, dtype=int), np.array(y/1000,dtype=int), np.array(z/1000,dtype=int), c=z, cmap='viridis')
 sc = ax.plot_trisurf(x, y, z, cmap="viridis", edgecolor="none")
-title = "_".join(sys.argv[1:])
+title = "_".join(args.title)
 plt.title(title)
 
 plt.xlabel("latency, ms")
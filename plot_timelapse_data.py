@@ -3,98 +3,52 @@ import argparse
 
 import matplotlib.pyplot as plt
 import numpy as np
-import os
 from itertools import cycle
-from datatypes import (
-    server_local_dtype,
-    server_record_dtype,
-    client_local_dtype,
-    client_record_dtype,
-)
+
+from timeline import build_timeline
+from results_loader import load_stakes
+from base58 import b58encode
 
 np.set_printoptions(suppress=True)
 
 
-def main(hosts_file:str, show:bool):
-    return
-    transactions_per_second: dict[str, dict] = {}
-    total_sent_bytes_per_host = {}
-    total_sent_transactions_per_client = {}
-    stakes = {}
+def main(hosts_file:str, show:bool, bin_ms:float=10.0, use_cache:bool=True):
+    timeline = build_timeline(hosts_file, bin_ms=bin_ms, use_cache=use_cache)
+    hosts = list(timeline["hosts"])
+    t = timeline["time"]
+    end_time = t[-1] if len(t) else 0
 
-    client_transport_stats: dict[str, np.ndarray[client_local_dtype]] = {}
-
-    base_time = 2**62
-    last_end_time = 0
-    # Processing binary files
-    for binary_file in [f for f in os.listdir("results") if f.endswith(".bin")]:
-        path = os.path.join("results", binary_file)
-        host = binary_file.split("-")[0]
-        print(f"Loading {path}")
-        if "server" in binary_file:
-            host = "SERVER"
-            data = np.fromfile(path, dtype=server_record_dtype).astype(
-                server_local_dtype
-            )
-
-        else:
-            data = np.fromfile(path, dtype=client_record_dtype).astype(
-                client_local_dtype
-            )
-            data = data[data["connection_id"] == 0]
-            client_transport_stats[host] = data
-            print(f"{host}, {data['udp_tx'][-1]}")
-            total_sent_bytes_per_host[host] = data["udp_tx"][-1]
-            total_sent_transactions_per_client[host] = len(data["time"])
-
-        start = data["time"].min()
-        base_time = min(base_time, start)
-        end = data["time"].max()
-        last_end_time = max(last_end_time, end)
-
-        bin_size = 1000 * 10  # 10 ms bins
-        bins = np.arange(start, end + bin_size, bin_size)
-        counts, edges = np.histogram(data["time"], bins=bins)
-        transactions_per_second[host] = {"timeline": edges[0:-1], "TPS": counts * 100}
-
-    colormap = plt.cm.tab20 if len(transactions_per_second) > 10 else plt.cm.tab10
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(18, 14))
+    stakes = {}
+    for id, stake in load_stakes(hosts_file).items():
+        stakes[b58encode(id).decode("ascii")] = stake
+
+    colormap = plt.cm.tab20 if len(hosts) > 10 else plt.cm.tab10
+    has_resources = "server_cpu" in timeline
+    if has_resources:
+        fig, (ax1, ax2, ax4, ax3) = plt.subplots(4, 1, figsize=(18, 18))
+    else:
+        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(18, 14))
     ax1_2 = ax1.twinx()
     color_cycle = cycle(colormap.colors)
-    for host, host_data in client_transport_stats.items():
+    for row, host in enumerate(hosts):
         color = next(color_cycle)
-        # ax1.plot(
-        #     (host_data["time"] - base_time) / 1e6,
-        #     host_data["udp_tx"],
-        #     label=f"{host[0:7]}-udp_tx",
-        #     linestyle="-",
-        #     color=color,
-        # )
-
         ax1_2.plot(
-            (host_data["time"] - base_time) / 1e6,
-            host_data["congestion_window"] / 1e3,
+            t,
+            timeline["cwnd"][row] / 1e3,
             label=f"{host[0:7]}-congestion_window",
             linestyle=":",
             color=color,
         )
-        # ax1.plot(
-        #     (host_data["time"] - base_time) / 1e6,
-        #     host_data["congestion_events"] ,
-        #     label=f"{host[0:7]}-congestions",
-        #     linestyle="-",
-        #     color=color,
-        #     )
         ax1.plot(
-            (host_data["time"] - base_time) / 1e6,
-            host_data["lost_packets"] ,
+            t,
+            timeline["lost_packets"][row],
             label=f"{host[0:7]}-lost_pkts",
             linestyle="-",
             color=color,
             )
 
-    ax1.set_xlim([0, (last_end_time - base_time) / 1e6])
-    ax1_2.set_xlim([0, (last_end_time - base_time) / 1e6])
+    ax1.set_xlim([0, end_time])
+    ax1_2.set_xlim([0, end_time])
     ax1.set_xlabel("Time (seconds)")
     ax1.set_ylabel("Lost packets")
     ax1_2.set_ylabel("Congestion window (dotted) KB", color="r")
@@ -103,40 +57,57 @@ def main(hosts_file:str, show:bool):
     color_cycle = cycle(colormap.colors)
     ax2_2 = ax2.twinx()
     ax2_2.set_ylabel("Server-side TPS (black)", color="black")
-    for host, data in transactions_per_second.items():
+    for row, host in enumerate(hosts):
         color = next(color_cycle)
-        print(host, color)
-        linewidth = 1
-        ax = ax2
-        if host == "SERVER":
-            color = "black"
-            linewidth = 2
-            ax = ax2_2
-        ax.plot(
-            (data["timeline"] - base_time) / 1e6,
-            data["TPS"],
+        ax2.plot(
+            t,
+            timeline["server_tps"][row],
             label=f"{host[0:7]}",
             linestyle="-",
-            linewidth=linewidth,
+            linewidth=1,
             color=color,
         )
+    ax2_2.plot(
+        t,
+        timeline["server_total_tps"],
+        label="SERVER",
+        linestyle="-",
+        linewidth=2,
+        color="black",
+    )
 
-    ax2_2.set_xlim([0, (last_end_time - base_time) / 1e6])
-    ax2.set_xlim([0, (last_end_time - base_time) / 1e6])
+    ax2_2.set_xlim([0, end_time])
+    ax2.set_xlim([0, end_time])
     ax2.set_ylabel("Transactions per Second")
 
-    with open(hosts_file) as f:
-        for line in f:
-            stakes[line.split(" ")[0]] = int(line.split(" ")[1])
+    if has_resources:
+        ax4.plot(t, timeline["server_cpu"], label="server process", linewidth=2, color="black")
+        color_cycle = cycle(colormap.colors)
+        for row, name in enumerate(timeline.get("thread_names", [])):
+            ax4.plot(t, timeline["thread_cpu"][row], label=str(name), linewidth=1, color=next(color_cycle))
+        ax4_2 = ax4.twinx()
+        ax4_2.plot(t, timeline["udp_rcvbuf_errors"], label="UDP rcvbuf errors", linestyle=":", color="r")
+        ax4_2.plot(t, timeline["link_rx_dropped"], label="link rx dropped", linestyle="--", color="r")
+        ax4.set_xlim([0, end_time])
+        ax4_2.set_xlim([0, end_time])
+        ax4.set_ylabel("Server CPU (cores)")
+        ax4_2.set_ylabel("Kernel drops per second (red)", color="r")
+        ax4.legend(loc="upper left", fontsize="small")
+        ax4_2.legend(loc="upper right", fontsize="small")
+        ax4.grid(True)
 
     # Normalizing values for bars
-    transactions_sum = sum(total_sent_transactions_per_client.values())
-    for k, v in total_sent_transactions_per_client.copy().items():
-        total_sent_transactions_per_client[k] = float(v) / transactions_sum * 100
-
-    bytes_sent_sum = sum(total_sent_bytes_per_host.values())
-    for k, v in total_sent_bytes_per_host.copy().items():
-        total_sent_bytes_per_host[k] = float(v) / bytes_sent_sum * 100.0
+    received = dict(zip(hosts, timeline["server_tps"].sum(axis=1)))
+    transactions_sum = sum(received.values()) or 1
+    total_sent_transactions_per_client = {
+        k: float(v) / transactions_sum * 100 for k, v in received.items()
+    }
+
+    sent_bytes = dict(zip(hosts, timeline["client_udp_tx"].sum(axis=1)))
+    bytes_sent_sum = sum(sent_bytes.values()) or 1
+    total_sent_bytes_per_host = {
+        k: float(v) / bytes_sent_sum * 100.0 for k, v in sent_bytes.items()
+    }
 
     stake_sum = sum(stakes.values())
     for k, v in stakes.items():
@@ -198,6 +169,8 @@ if __name__ == "__main__":
     )
     parser.add_argument("hosts", type=str, help="file with staked accounts")
     parser.add_argument("--show", action="store_true", help="Show plot for interactive ")
+    parser.add_argument("--bin-ms", type=float, default=10.0, help="timeline bin width")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached timelines")
     args = parser.parse_args()
-    main(args.hosts, args.show)
+    main(args.hosts, args.show, args.bin_ms, not args.no_cache)
 
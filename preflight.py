@@ -0,0 +1,89 @@
+import json
+import subprocess
+import time
+
+from knee_search import offered_tx_size
+
+# Network ceiling of the emulated topology: before a run, every active client
+# host blasts UDP datagrams of the run's transaction size (--tx-size, or the
+# mean size of the --tx-pool pools) at the server with iperf3
+# (-b 0, as fast as it can) for --preflight-duration seconds, all at once, each
+# to its own iperf3 server. What the servers receive per second is the most
+# datagrams, i.e. transactions, the network and hosts can deliver, and parse.py
+# reports the server's TPS as a fraction of it.
+#
+# Within a persistent testbed the same setup is measured only once.
+
+BASE_PORT = 5300
+LISTEN_WAIT_S = 0.5
+
+_measured: dict[tuple, dict] = {}
+
+
+def _setup_key(args, client_nodes) -> tuple:
+    links = tuple((node.latency, node.bandwidth) for node in client_nodes)
+    impairments = tuple(
+        (key, value) for key, value in sorted(vars(args).items()) if key.startswith(("server_", "client_"))
+    )
+    return args.tx_size, args.tx_pool, args.preflight_duration, args.loss_percentage, links, impairments
+
+
+def _received(report: dict) -> tuple[int, int]:
+    """Datagrams and bytes an iperf3 UDP server reports having received."""
+    end = report.get("end", {})
+    total = end.get("sum") or end.get("sum_received") or {}
+    packets = total.get("packets", 0) - total.get("lost_packets", 0)
+    return max(packets, 0), total.get("bytes", 0)
+
+
+def measure(args, server_node, client_nodes) -> dict:
+    """Aggregate UDP goodput of `client_nodes` sending to the server concurrently."""
+    key = _setup_key(args, client_nodes)
+    if key in _measured:
+        print(f"*** Network ceiling (measured before): {_measured[key]['ceiling-tps']:.0f} TPS")
+        return _measured[key]
+    duration = args.preflight_duration
+    tx_size = round(offered_tx_size(args, [pubkey for node in client_nodes for pubkey in node.pubkeys]))
+    print(f"*** Measuring the network ceiling: {len(client_nodes)} clients, {tx_size} byte datagrams, {duration}s")
+    servers = [
+        server_node.popen(
+            f"exec iperf3 -s -1 -J -p {BASE_PORT + i}", shell=True, text=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        for i in range(len(client_nodes))
+    ]
+    time.sleep(LISTEN_WAIT_S)
+    clients = [
+        node.mininet_host.popen(
+            f"exec iperf3 -u -b 0 -l {tx_size} -t {duration} -c {server_node.IP()} -p {BASE_PORT + i}",
+            shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for i, node in enumerate(client_nodes)
+    ]
+    for client in clients:
+        try:
+            client.wait(timeout=duration + 10.0)
+        except subprocess.TimeoutExpired:
+            client.kill()
+            client.wait()
+    packets = received_bytes = 0
+    for server in servers:
+        try:
+            output, _ = server.communicate(timeout=5.0)
+            got, size = _received(json.loads(output))
+        except (subprocess.TimeoutExpired, json.JSONDecodeError):
+            server.kill()
+            server.communicate()
+            print("iperf3 server did not report, its client counts as 0")
+            continue
+        packets += got
+        received_bytes += size
+    ceiling = {
+        "ceiling-tps": packets / duration,
+        "ceiling-mbps": received_bytes * 8 / duration / 1e6,
+        "ceiling-clients": len(client_nodes),
+        "ceiling-duration": duration,
+    }
+    print(f"*** Network ceiling: {ceiling['ceiling-tps']:.0f} TPS ({ceiling['ceiling-mbps']:.0f} Mbit/s)")
+    _measured[key] = ceiling
+    return ceiling
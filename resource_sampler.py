@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Samples a server process and the network namespace it runs in.
+
+    resource_sampler.py --pid PID [--port 8000] [--interval-ms 10]
+
+Run it inside the server's namespace (main.py starts it on the server host):
+/proc/net/* then describe that namespace. Writes results/server_resources.bin
+(one record of RESOURCE_FIELDS per sample) and results/server_threads.bin (one
+thread_sample_dtype record per thread per sample), stamped with the clock of
+serverlog.bin, until the process exits.
+"""
+
+import argparse
+import os
+import signal
+import struct
+import sys
+import time
+
+import numpy as np
+
+from datatypes import SERVER_RESOURCES_MAGIC, pack_header, solana_epoch_micros, thread_sample_dtype
+
+RESOURCE_FIELDS = [
+    "time",
+    "cpu_user_us",
+    "cpu_system_us",
+    "rss_bytes",
+    "threads",
+    "udp_rx_queue",  # bytes waiting in the server port's sockets
+    "udp_socket_drops",  # drops counted on the server port's sockets
+    "udp_in_datagrams",
+    "udp_rcvbuf_errors",
+    "udp_in_errors",
+    "link_rx_packets",
+    "link_rx_bytes",
+    "link_rx_dropped",
+    "link_rx_fifo",
+    "link_tx_packets",
+]
+FLUSH_INTERVAL_S = 1.0
+
+TICK_US = 1e6 / os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_stat(path: str) -> tuple[str, list[str]]:
+    """comm and the fields after it of a /proc/<pid>/stat file."""
+    with open(path) as f:
+        stat = f.read()
+    close = stat.rindex(")")
+    return stat[stat.index("(") + 1 : close], stat[close + 2 :].split()
+
+
+def udp_sockets(port: int) -> tuple[int, int]:
+    """rx_queue bytes and drops summed over the UDP sockets bound to `port`."""
+    rx_queue = drops = 0
+    for path in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            lines = open(path).readlines()[1:]
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if int(fields[1].rsplit(":", 1)[1], 16) != port:
+                continue
+            rx_queue += int(fields[4].split(":")[1], 16)
+            drops += int(fields[-1])
+    return rx_queue, drops
+
+
+def udp_counters() -> dict[str, int]:
+    with open("/proc/net/snmp") as f:
+        udp = [line.split()[1:] for line in f if line.startswith("Udp:")]
+    return dict(zip(udp[0], map(int, udp[1])))
+
+
+def link_counters() -> list[int]:
+    """rx packets, bytes, dropped, fifo and tx packets summed over all interfaces but lo."""
+    totals = [0] * 5
+    with open("/proc/net/dev") as f:
+        for line in f.readlines()[2:]:
+            name, counters = line.split(":", 1)
+            if name.strip() == "lo":
+                continue
+            c = list(map(int, counters.split()))
+            for i, value in enumerate((c[1], c[0], c[3], c[4], c[9])):
+                totals[i] += value
+    return totals
+
+
+def sample_threads(pid: int, now: int) -> np.ndarray:
+    task_dir = f"/proc/{pid}/task"
+    rows = []
+    for tid in os.listdir(task_dir):
+        try:
+            name, fields = read_stat(f"{task_dir}/{tid}/stat")
+        except (FileNotFoundError, ProcessLookupError):
+            continue  # thread exited meanwhile
+        rows.append(
+            (now, int(tid), int(int(fields[11]) * TICK_US), int(int(fields[12]) * TICK_US), name.encode()[:16])
+        )
+    return np.array(rows, dtype=thread_sample_dtype)
+
+
+def sample(pid: int, port: int) -> tuple[list[int], np.ndarray] | None:
+    """One resources record and the per-thread records, None once the process is gone."""
+    now = solana_epoch_micros()
+    try:
+        _, fields = read_stat(f"/proc/{pid}/stat")
+        if fields[0] in ("Z", "X"):
+            return None
+        threads = sample_threads(pid, now)
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    rx_queue, drops = udp_sockets(port)
+    udp = udp_counters()
+    record = [
+        now,
+        int(int(fields[11]) * TICK_US),
+        int(int(fields[12]) * TICK_US),
+        int(fields[21]) * PAGE_SIZE,
+        int(fields[17]),
+        rx_queue,
+        drops,
+        udp.get("InDatagrams", 0),
+        udp.get("RcvbufErrors", 0),
+        udp.get("InErrors", 0),
+        *link_counters(),
+    ]
+    return record, threads
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="resource_sampler", description="samples a server process")
+    parser.add_argument("--pid", type=int, required=True)
+    parser.add_argument("--port", type=int, default=8000, help="UDP port the server listens on")
+    parser.add_argument("--interval-ms", type=float, default=10.0)
+    parser.add_argument("--results", type=str, default="results")
+    args = parser.parse_args()
+
+    # stopped by main.py or by the process exiting, either way the files are flushed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    interval = args.interval_ms / 1000
+    record_format = f"<{len(RESOURCE_FIELDS)}Q"
+    with open(os.path.join(args.results, "server_resources.bin"), "wb") as resources, open(
+        os.path.join(args.results, "server_threads.bin"), "wb"
+    ) as threads:
+        resources.write(
+            pack_header(
+                SERVER_RESOURCES_MAGIC,
+                {
+                    "version": 1,
+                    "fields": RESOURCE_FIELDS,
+                    "dtype": "<u8",
+                    "sample_interval_us": int(args.interval_ms * 1000),
+                    "pid": args.pid,
+                    "port": args.port,
+                },
+            )
+        )
+        next_sample = last_flush = time.monotonic()
+        while (taken := sample(args.pid, args.port)) is not None:
+            record, thread_records = taken
+            resources.write(struct.pack(record_format, *record))
+            threads.write(thread_records.tobytes())
+            now = time.monotonic()
+            if now - last_flush > FLUSH_INTERVAL_S:
+                resources.flush()
+                threads.flush()
+                last_flush = now
+            next_sample += interval
+            if next_sample < now:
+                # fell behind, skip the missed samples rather than bunching them up
+                next_sample = now
+            time.sleep(next_sample - now)
+
+
+if __name__ == "__main__":
+    main()
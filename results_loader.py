@@ -0,0 +1,134 @@
+import os
+import re
+
+import numpy as np
+from base58 import b58decode
+
+from datatypes import client_stats_header, read_client_stats, server_record_dtype
+
+# records handled per step when streaming through a memory-mapped log
+CHUNK_RECORDS = 1 << 22
+# client files are time-ordered, so the last records of every live connection sit
+# at the tail; a connection that ended earlier is only found by a full scan
+CLIENT_TAIL_RECORDS = 4096
+
+
+def load_stakes(hosts_file: str) -> dict[bytes, int]:
+    """Reads the hosts file into {32-byte pubkey: stake}, keeping file order."""
+    stakes = {}
+    for line in open(hosts_file).readlines():
+        if not line.strip():
+            continue
+        pubkey, stake = re.split(r"[\s]+", line.strip())[0:2]
+        stakes[b58decode(pubkey)] = int(stake)
+    return stakes
+
+
+def map_records(path: str, dtype: np.dtype) -> np.ndarray:
+    """Memory-maps a results file as an array of `dtype` records."""
+    count = os.path.getsize(path) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+def client_totals(path: str, fields=("sent",)) -> dict[str, int]:
+    """Final value of cumulative client counters, summed over its connections.
+
+    The tail of the file is enough when every connection the header announces
+    shows up in it, otherwise the whole file is scanned in chunks. Fields the
+    file does not record count as 0.
+    """
+    records = read_client_stats(path)
+    fields_present = [field for field in fields if field in records.dtype.names]
+    expected = client_stats_header(path)[0].get("num_connections")
+    tail = records[-CLIENT_TAIL_RECORDS:]
+    last = _last_per_connection(tail, fields_present)
+    if expected is None or len(last) < expected:
+        last = {}
+        for start in range(0, len(records), CHUNK_RECORDS):
+            chunk = _last_per_connection(records[start : start + CHUNK_RECORDS], fields_present)
+            for connection, values in chunk.items():
+                last[connection] = np.maximum(last.get(connection, values), values)
+    totals = {field: 0 for field in fields}
+    for values in last.values():
+        for field, value in zip(fields_present, values):
+            totals[field] += int(value)
+    return totals
+
+
+def _last_per_connection(records: np.ndarray, fields: list[str]) -> dict[int, np.ndarray]:
+    """{connection_id: the largest value of each of `fields`} over `records`."""
+    if len(records) == 0:
+        return {}
+    connections, conn_idx = np.unique(records["connection_id"], return_inverse=True)
+    last = np.zeros((len(connections), len(fields)), dtype=np.uint64)
+    for i, field in enumerate(fields):
+        np.maximum.at(last[:, i], conn_idx, records[field])
+    return dict(zip(connections.tolist(), last))
+
+
+def client_sent(path: str) -> int:
+    """Total transactions sent by one client, summed over its connections."""
+    return client_totals(path)["sent"]
+
+
+class IdentityIndex:
+    """Interns 32-byte pubkeys into integer codes.
+
+    Known identities get codes 0..n-1 in the order given, anything else maps to n.
+    Lookups sort on the first 8 bytes of the key and verify the full 32 bytes,
+    so interning a chunk costs one searchsorted plus one compare per record.
+    """
+
+    def __init__(self, ids: list[bytes]):
+        self.ids = list(ids)
+        ids_array = np.array(self.ids, dtype="S32")
+        prefixes = np.frombuffer(ids_array.tobytes(), dtype="<u8")[0::4]
+        self._order = np.argsort(prefixes, kind="stable")
+        self._prefixes = prefixes[self._order]
+        self._ids = ids_array[self._order]
+        if len(np.unique(self._prefixes)) != len(self._prefixes):
+            raise ValueError("identities share an 8-byte prefix, cannot intern them")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def codes(self, records: np.ndarray) -> np.ndarray:
+        """Codes for the `id` column of a slice of server records."""
+        if len(self.ids) == 0:
+            return np.zeros(len(records), dtype=np.int32)
+        prefix_view = np.dtype(
+            {
+                "names": ["prefix"],
+                "formats": ["<u8"],
+                "offsets": [records.dtype.fields["id"][1]],
+                "itemsize": records.dtype.itemsize,
+            }
+        )
+        prefixes = np.asarray(records).view(prefix_view)["prefix"]
+        pos = np.searchsorted(self._prefixes, prefixes)
+        pos[pos == len(self._prefixes)] = 0
+        known = (self._prefixes[pos] == prefixes) & (self._ids[pos] == records["id"])
+        return np.where(known, self._order[pos], len(self.ids)).astype(np.int32)
+
+    def counts(self, records: np.ndarray) -> np.ndarray:
+        """Records per identity (last slot counts unknown ids) in one pass."""
+        counts = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        for start in range(0, len(records), CHUNK_RECORDS):
+            chunk = records[start : start + CHUNK_RECORDS]
+            counts += np.bincount(self.codes(chunk), minlength=len(self.ids) + 1)
+        return counts
+
+
+def load_server_log(path: str = "results/serverlog.bin") -> np.ndarray:
+    return map_records(path, server_record_dtype)
+
+
+def client_files(results_dir: str = "results") -> dict[str, str]:
+    """Maps client host name to its stats file."""
+    return {
+        file.split("-")[0]: os.path.join(results_dir, file)
+        for file in os.listdir(results_dir)
+        if file.endswith("host-transactions.bin")
+    }
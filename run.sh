@@ -15,15 +15,14 @@ make_and_run() {
     shift
     local prefix=$1
     shift
-    rm -f datapoints.csv
+    local since=$(date +%s)
     ./make_stakes.py --min-stake=0 --max-stake=10000 "$N"
 
     for lat in "$@"; do
-        $T --latency="$lat" --tx-size="$tx_sz"
+        $T --latency="$lat" --tx-size="$tx_sz" --label="$prefix"
     done
 
-    python plot_3d.py $prefix "$tx_sz" bytes
-    rm -f datapoints.csv
+    python plot_3d.py $prefix "$tx_sz" bytes --since "$since" --label "$prefix" --tx-size "$tx_sz"
 }
 
 # configure what latencies to test
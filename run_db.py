@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# History of every parsed run: one row per run with its setup (the interesting
+# config.json keys get their own indexed columns, the whole config is kept as
+# JSON) and one row per identity with what it sent and what the server got.
+# Columns are added to an existing database when RUN_COLUMNS grows.
+
+DB_PATH = "runs.db"
+
+# column, config.json key, SQL type
+RUN_COLUMNS = [
+    ("server", "server", "TEXT"),
+    ("tx_size", "tx-size", "INTEGER"),
+    ("duration", "duration", "REAL"),
+    ("num_connections", "num-connections", "INTEGER"),
+    ("num_clients", "num-clients", "INTEGER"),
+    ("disable_congestion", "disable-congestion", "INTEGER"),
+    ("congestion", "congestion", "TEXT"),
+    ("max_in_flight_streams", "max-in-flight-streams", "INTEGER"),
+    ("max_tps", "max-tps", "INTEGER"),
+    ("offered_tps", "offered-tps", "REAL"),
+    ("tx_pool", "tx-pool", "INTEGER"),
+    ("latency_dist", "latency-dist", "TEXT"),
+    ("bandwidth_dist", "bandwidth-dist", "TEXT"),
+    ("seed", "seed", "INTEGER"),
+    ("server_bw", "server-bw", "REAL"),
+    ("server_qdisc", "server-qdisc", "TEXT"),
+    ("loss_percentage", "loss-percentage", "REAL"),
+    ("ceiling_tps", "ceiling-tps", "REAL"),
+]
+RESULT_COLUMNS = ["identity", "stake", "latency", "bandwidth", "sent", "intended", "got", "tps"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    label TEXT,
+    server_sha256 TEXT,
+    total_sent INTEGER,
+    total_got INTEGER,
+    server_tps REAL,
+    jain REAL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    identity TEXT NOT NULL,
+    stake INTEGER,
+    latency REAL,
+    bandwidth REAL,
+    sent INTEGER,
+    intended INTEGER,
+    got INTEGER,
+    tps REAL,
+    PRIMARY KEY (run_id, identity)
+);
+CREATE INDEX IF NOT EXISTS runs_by_created ON runs(created);
+CREATE INDEX IF NOT EXISTS results_by_point ON results(latency, stake);
+"""
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    created = not os.path.exists(path)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(SCHEMA)
+    have = {row["name"] for row in db.execute("PRAGMA table_info(runs)")}
+    for column, _, sql_type in RUN_COLUMNS:
+        if column not in have:
+            db.execute(f"ALTER TABLE runs ADD COLUMN {column} {sql_type}")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS runs_by_setup ON runs(server, tx_size, num_connections, disable_congestion)"
+    )
+    db.commit()
+    if created:
+        # the harness runs under sudo, plotting and comparisons usually don't
+        try:
+            os.chmod(path, 0o666)
+        except PermissionError:
+            pass
+    return db
+
+
+def _sha256(path: str | None) -> str | None:
+    if not path or not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_run(
+    config: dict, per_identity: dict[str, dict], jain: float | None = None,
+    label: str | None = None, path: str = DB_PATH,
+) -> int:
+    """Stores one run: results/config.json plus parse.main()'s per-identity results."""
+    duration = config["duration"]
+    setup = {key: value for key, value in config.items() if key not in per_identity}
+    run = {column: setup.get(key) for column, key, _ in RUN_COLUMNS}
+    run.update(
+        created=time.time(),
+        label=label,
+        server_sha256=_sha256(setup.get("server")),
+        total_sent=sum(r["sent"] for r in per_identity.values()),
+        total_got=sum(r["got"] for r in per_identity.values()),
+        jain=jain,
+        config=json.dumps(setup, sort_keys=True),
+    )
+    run["server_tps"] = run["total_got"] / duration
+    with closing(connect(path)) as db, db:
+        columns = ", ".join(run)
+        run_id = db.execute(
+            f"INSERT INTO runs ({columns}) VALUES ({', '.join('?' * len(run))})", list(run.values())
+        ).lastrowid
+        db.executemany(
+            f"INSERT INTO results (run_id, {', '.join(RESULT_COLUMNS)}) VALUES (?{', ?' * len(RESULT_COLUMNS)})",
+            [
+                (run_id, identity, r["stake"], r["latency"], r.get("bandwidth"), r["sent"], r["intended"],
+                 r["got"], r["got"] / duration)
+                for identity, r in per_identity.items()
+            ],
+        )
+    return run_id  # pyright:ignore
+
+
+def _where(filters: dict, since: float | None) -> tuple[str, list]:
+    known = {"id", "label", "server_sha256"} | {column for column, _, _ in RUN_COLUMNS}
+    clauses, params = [], []
+    for column, value in filters.items():
+        if column not in known:
+            raise ValueError(f"cannot filter runs on {column!r}")
+        if value is None:
+            continue
+        clauses.append(f"runs.{column} = ?")
+        params.append(value)
+    if since is not None:
+        clauses.append("runs.created >= ?")
+        params.append(since)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def query_runs(path: str = DB_PATH, since: float | None = None, **filters) -> list[dict]:
+    """Runs matching column=value filters (None matches anything), oldest first."""
+    where, params = _where(filters, since)
+    with closing(connect(path)) as db, db:
+        rows = db.execute(f"SELECT * FROM runs{where} ORDER BY runs.id", params).fetchall()
+    return [dict(row) for row in rows]
+
+
+def query_results(path: str = DB_PATH, since: float | None = None, **filters) -> list[dict]:
+    """Per-identity results of the matching runs, each row carrying its run's columns."""
+    where, params = _where(filters, since)
+    with closing(connect(path)) as db, db:
+        rows = db.execute(
+            f"SELECT runs.*, results.* FROM results JOIN runs ON runs.id = results.run_id{where}"
+            " ORDER BY runs.id, results.identity",
+            params,
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="run_db", description="list recorded runs")
+    parser.add_argument("--db", type=str, default=DB_PATH)
+    parser.add_argument("--since", type=float, help="unix time, only runs recorded after it")
+    parser.add_argument("--label", type=str)
+    parser.add_argument("--server", type=str)
+    parser.add_argument("--tx-size", type=int)
+    parser.add_argument("--num-connections", type=int)
+    args = parser.parse_args()
+
+    runs = query_runs(
+        args.db, args.since, label=args.label, server=args.server, tx_size=args.tx_size,
+        num_connections=args.num_connections,
+    )
+    for run in runs:
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["created"]))
+        jain = f"{run['jain']:.3f}" if run["jain"] is not None else "-"
+        congestion = run["congestion"] or ("off" if run["disable_congestion"] else "on")
+        ceiling = f" ({run['server_tps'] / run['ceiling_tps']:.0%} of ceiling)" if run["ceiling_tps"] else ""
+        print(
+            f"{run['id']:6} {created} {run['label'] or '-':10} {run['server'] or '-':20} tx_size={run['tx_size']}"
+            f" conns={run['num_connections']} congestion={congestion}"
+            f" {run['server_tps']:.0f} TPS{ceiling} jain={jain}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Long-lived Mininet testbed: builds the topology once and serves test runs.
+
+    sudo ./testbed.py serve solana_pubkeys.txt -- --latency 50
+    sudo ./testbed.py run -- --latency 10 --tx-size 512 --duration 10
+    sudo ./testbed.py stop
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from subprocess import call
+
+from mininet.log import setLogLevel
+
+import main as testbench
+import latency
+import parse
+from knee_search import run_knee_search
+from link_profiles import assign_links
+from tooling import mk_results_dir, watchdog
+
+DEFAULT_SOCKET = "testbed.sock"
+
+
+class Testbed:
+    def __init__(self, hosts: str, topology_argv: list[str]):
+        self.hosts = hosts
+        t0 = time.monotonic()
+        args = testbench.build_parser().parse_args([hosts] + topology_argv)
+        self.net, self.server_node, self.client_nodes = testbench.topology(
+            testbench.read_identities(hosts), args
+        )
+        self.startup_time = time.monotonic() - t0
+        print(f"*** Testbed up in {self.startup_time:.2f}s")
+
+    def run(self, argv: list[str]) -> dict:
+        args = testbench.build_parser().parse_args([self.hosts] + argv)
+        t0 = time.monotonic()
+        mk_results_dir()
+        changed = 0
+        links = assign_links([node.pubkey for node in self.client_nodes], args)
+        for node in self.client_nodes:
+            link = links[node.pubkey]
+            if (node.latency, node.bandwidth) != (link["latency"], link["bandwidth"]):
+                testbench.set_client_link(node, link["latency"], link["bandwidth"])
+                changed += 1
+        testbench.apply_impairments(args, self.server_node, self.client_nodes)
+        ceiling = testbench.measure_ceiling(args, self.server_node, self.client_nodes)
+        testbench.write_config(args, self.client_nodes, ceiling)
+        setup_time = time.monotonic() - t0
+        print(f"*** Run setup took {setup_time:.2f}s ({changed} links reconfigured)")
+
+        t0 = time.monotonic()
+        reply = {
+            "startup_time": self.startup_time,
+            "setup_time": setup_time,
+            "links_reconfigured": changed,
+        }
+        if args.find_knee is not None:
+            reply["knees"] = run_knee_search(
+                args,
+                lambda rate: testbench.knee_trial(args, self.server_node, self.client_nodes, rate, ceiling),
+            )
+            reply["run_time"] = time.monotonic() - t0
+            return reply
+        testbench.run_test(args, self.server_node, self.client_nodes)
+        parse.main(args.hosts, label=args.label)
+        if args.send_log:
+            latency.main(args.hosts)
+        reply["run_time"] = time.monotonic() - t0
+        return reply
+
+    def stop(self):
+        print("*** Stopping network")
+        self.net.stop()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        testbed: Testbed = self.server.testbed  # pyright:ignore
+        reply = {"ok": True}
+        try:
+            if request["cmd"] == "run":
+                # armed per run: an idle testbed is healthy however long it waits
+                with watchdog(self.server.watchdog_min):  # pyright:ignore
+                    reply.update(testbed.run(request["argv"]))
+            elif request["cmd"] == "stop":
+                self.server.stop_requested = True  # pyright:ignore
+            else:
+                raise ValueError(f"unknown command {request['cmd']}")
+        except SystemExit as e:
+            # argparse rejected the run arguments
+            reply = {"ok": False, "error": f"bad arguments (exit code {e.code})"}
+        except Exception as e:
+            traceback.print_exc()
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+def serve(args, topology_argv):
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    with watchdog(args.watchdog_min):
+        print("\n[DEBUG] Cleaning Mininet state (mn -c)")
+        call(["sudo", "mn", "-c"])
+        mk_results_dir()
+        testbed = Testbed(args.hosts, topology_argv)
+    try:
+        with socketserver.UnixStreamServer(args.socket, RequestHandler) as server:
+            server.testbed = testbed  # pyright:ignore
+            server.watchdog_min = args.watchdog_min  # pyright:ignore
+            server.stop_requested = False  # pyright:ignore
+            print(f"*** Waiting for runs on {args.socket}")
+            while not server.stop_requested:  # pyright:ignore
+                server.handle_request()
+    finally:
+        with watchdog(args.watchdog_min):
+            testbed.stop()
+        os.unlink(args.socket)
+
+
+def request(socket_path: str, payload: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(payload) + "\n").encode())
+        return json.loads(sock.makefile().readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="testbed",
+        description="Persistent Mininet testbed for repeated streamer runs",
+        epilog="Arguments after -- are passed as main.py options",
+    )
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET, help="control socket")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    serve_parser = sub.add_parser("serve", help="build the topology and wait for runs")
+    serve_parser.add_argument("hosts", type=str, help="file with staked accounts")
+    serve_parser.add_argument(
+        "--watchdog-min",
+        type=int,
+        default=120,
+        help="reboot the box if building the topology, one run or the teardown is not done by then",
+    )
+    sub.add_parser("run", help="run one test on a serving testbed")
+    sub.add_parser("stop", help="tear the testbed down")
+
+    argv = sys.argv[1:]
+    passthrough = []
+    if "--" in argv:
+        passthrough = argv[argv.index("--") + 1 :]
+        argv = argv[: argv.index("--")]
+    args = parser.parse_args(argv)
+
+    if args.cmd == "serve":
+        setLogLevel("info")
+        serve(args, passthrough)
+        return
+    reply = request(args.socket, {"cmd": args.cmd, "argv": passthrough})
+    print(json.dumps(reply, indent=2))
+    if not reply["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
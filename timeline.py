@@ -0,0 +1,270 @@
+import hashlib
+import os
+
+import numpy as np
+from base58 import b58encode
+
+from datatypes import read_client_stats, read_server_resources, thread_sample_dtype
+from results_loader import (
+    CHUNK_RECORDS,
+    IdentityIndex,
+    client_files,
+    load_server_log,
+    load_stakes,
+    map_records,
+)
+
+
+class BinnedSeries:
+    """(rows, bins) accumulator on an absolute bin grid that grows as data arrives."""
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.first_bin = None
+        self.values = np.zeros((rows, 0))
+
+    def add(self, rows: np.ndarray, bins: np.ndarray, weights=None):
+        if len(bins) == 0:
+            return
+        lo, hi = int(bins.min()), int(bins.max())
+        width = hi - lo + 1
+        flat = rows.astype(np.int64) * width + (bins - lo).astype(np.int64)
+        local = np.bincount(flat, weights=weights, minlength=self.rows * width)
+        self._ensure(lo, hi)
+        offset = lo - self.first_bin
+        self.values[:, offset : offset + width] += local.reshape(self.rows, width)
+
+    def _ensure(self, lo: int, hi: int):
+        if self.first_bin is None:
+            self.first_bin = lo
+            self.values = np.zeros((self.rows, hi - lo + 1))
+            return
+        new_lo = min(lo, self.first_bin)
+        new_hi = max(hi, self.first_bin + self.values.shape[1] - 1)
+        if (new_lo, new_hi) == (self.first_bin, self.first_bin + self.values.shape[1] - 1):
+            return
+        grown = np.zeros((self.rows, new_hi - new_lo + 1))
+        offset = self.first_bin - new_lo
+        grown[:, offset : offset + self.values.shape[1]] = self.values
+        self.first_bin, self.values = new_lo, grown
+
+    def on_grid(self, first_bin: int, nbins: int) -> np.ndarray:
+        """Values on [first_bin, first_bin + nbins), bins outside the grid are dropped."""
+        out = np.zeros((self.rows, nbins))
+        if self.first_bin is None:
+            return out
+        lo = max(self.first_bin, first_bin)
+        hi = min(self.first_bin + self.values.shape[1], first_bin + nbins)
+        if hi > lo:
+            out[:, lo - first_bin : hi - first_bin] = self.values[:, lo - self.first_bin : hi - self.first_bin]
+        return out
+
+
+def _per_connection_deltas(data: np.ndarray, field: str, key: str = "connection_id") -> np.ndarray:
+    """Increments of a cumulative counter, taken within each connection (or other `key`)."""
+    order = np.argsort(data[key], kind="stable")
+    values = data[field][order].astype(np.int64)
+    deltas = np.diff(values, prepend=0)
+    conn = data[key][order]
+    first = np.ones(len(conn), dtype=bool)
+    first[1:] = conn[1:] != conn[:-1]
+    deltas[first] = values[first]
+    out = np.empty_like(deltas)
+    out[order] = deltas
+    return out
+
+
+# server_resources.bin counters shown as rates, and gauges shown as bin means
+RESOURCE_RATES = {
+    "server_cpu": ("cpu_user_us", "cpu_system_us"),  # cores busy
+    "udp_socket_drops": ("udp_socket_drops",),
+    "udp_rcvbuf_errors": ("udp_rcvbuf_errors",),
+    "udp_in_errors": ("udp_in_errors",),
+    "link_rx_dropped": ("link_rx_dropped", "link_rx_fifo"),
+    "link_rx_pps": ("link_rx_packets",),
+}
+RESOURCE_GAUGES = {"server_rss_mb": ("rss_bytes", 1e-6), "udp_rx_queue_kb": ("udp_rx_queue", 1e-3)}
+# thread groups kept in the timeline, by CPU used over the run
+TOP_THREAD_GROUPS = 8
+
+
+def _server_resources(results_dir: str, bin_us: int) -> dict[str, BinnedSeries]:
+    """Binned server_resources.bin / server_threads.bin, empty if the run has none."""
+    series = {}
+    path = os.path.join(results_dir, "server_resources.bin")
+    if not os.path.exists(path):
+        return series
+    data = read_server_resources(path)
+    if len(data) < 2:
+        return series
+    # each sample's increments land in the bin it was taken in, the first one has none
+    data = data[np.argsort(data["time"], kind="stable")]
+    rows = np.zeros(len(data) - 1, dtype=np.int64)
+    bins = data["time"][1:] // bin_us
+    for name, fields in RESOURCE_RATES.items():
+        weights = sum(np.diff(data[field].astype(np.int64)) for field in fields)
+        series[name] = BinnedSeries(1)
+        series[name].add(rows, bins, weights=np.maximum(weights, 0).astype(np.float64))
+    samples = BinnedSeries(1)
+    samples.add(rows, bins)
+    series["resource_samples"] = samples
+    for name, (field, _) in RESOURCE_GAUGES.items():
+        series[name] = BinnedSeries(1)
+        series[name].add(rows, bins, weights=data[field][1:].astype(np.float64))
+
+    threads_path = os.path.join(results_dir, "server_threads.bin")
+    if os.path.exists(threads_path):
+        threads = map_records(threads_path, thread_sample_dtype)
+        if len(threads):
+            cpu = _per_connection_deltas(threads, "cpu_user_us", key="tid") + _per_connection_deltas(
+                threads, "cpu_system_us", key="tid"
+            )
+            # a thread's first sample carries its whole history, not an increment
+            first = np.ones(len(threads), dtype=bool)
+            order = np.argsort(threads["tid"], kind="stable")
+            first[order[1:]] = threads["tid"][order[1:]] != threads["tid"][order[:-1]]
+            cpu[first] = 0
+            names, groups = np.unique(threads["name"], return_inverse=True)
+            keep = np.argsort(np.bincount(groups, weights=cpu))[::-1][:TOP_THREAD_GROUPS]
+            rank = np.full(len(names), -1)
+            rank[keep] = np.arange(len(keep))
+            mask = rank[groups] >= 0
+            series["thread_cpu"] = BinnedSeries(len(keep))
+            series["thread_cpu"].add(rank[groups][mask], threads["time"][mask] // bin_us, weights=cpu[mask])
+            series["thread_names"] = names[keep]
+    return series
+
+
+def _cache_path(results_dir: str, hosts_file: str, bin_us: int) -> str:
+    key = hashlib.sha1(f"{bin_us}".encode())
+    inputs = [os.path.abspath(hosts_file)] + sorted(
+        os.path.join(results_dir, f) for f in os.listdir(results_dir) if f.endswith(".bin")
+    )
+    for path in inputs:
+        st = os.stat(path)
+        key.update(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return os.path.join(results_dir, f"timeline-{key.hexdigest()[:16]}.npz")
+
+
+def build_timeline(
+    hosts_file: str, results_dir: str = "results", bin_ms: float = 10.0, use_cache: bool = True
+) -> dict[str, np.ndarray]:
+    """Per-host time series for one run, binned on a common grid.
+
+    Returns arrays indexed [host, bin] for the staked hosts (in hosts file order):
+      server_tps, server_bytes  - what the server received from each host
+      client_tps, client_udp_tx - what each host says it sent (tx/s, bytes/s)
+      intended_tps, pacing_error - what its pacer meant to send, (sent - intended) / intended
+      cwnd, lost_packets, rtt_ms - mean over the bin for connection 0
+      streams_blocked           - STREAMS_BLOCKED_UNI frames sent per second (out of stream credit)
+    With a server_resources.bin, also 1-d server series on the same grid:
+      server_cpu (cores), server_rss_mb, udp_rx_queue_kb, udp_socket_drops,
+      udp_rcvbuf_errors, udp_in_errors, link_rx_dropped, link_rx_pps (per second)
+      thread_cpu [group, bin] (cores) for the busiest `thread_names` groups
+    plus `server_total_tps`, `unknown_tps` (ids not in the hosts file), `time`
+    (bin start, seconds since the first bin), `start_us` and `bin_us`.
+    Fields a client did not record read as 0. Results are cached next to the
+    inputs and reused while they are unchanged.
+    """
+    bin_us = int(bin_ms * 1000)
+    cache = _cache_path(results_dir, hosts_file, bin_us)
+    if use_cache and os.path.exists(cache):
+        with np.load(cache) as cached:
+            return dict(cached)
+
+    stakes = load_stakes(hosts_file)
+    index = IdentityIndex(list(stakes))
+    hosts = [b58encode(id).decode("ascii") for id in stakes]
+    nhosts = len(hosts)
+
+    server_count = BinnedSeries(nhosts + 1)
+    server_bytes = BinnedSeries(nhosts + 1)
+    server_path = os.path.join(results_dir, "serverlog.bin")
+    if os.path.exists(server_path):
+        server_log = load_server_log(server_path)
+        for start in range(0, len(server_log), CHUNK_RECORDS):
+            chunk = server_log[start : start + CHUNK_RECORDS]
+            codes = index.codes(chunk)
+            bins = chunk["time"] // bin_us
+            server_count.add(codes, bins)
+            server_bytes.add(codes, bins, weights=chunk["size"].astype(np.float64))
+
+    client_sent = BinnedSeries(nhosts)
+    client_udp_tx = BinnedSeries(nhosts)
+    client_intended = BinnedSeries(nhosts)
+    streams_blocked = BinnedSeries(nhosts)
+    conn0_samples = BinnedSeries(nhosts)
+    cwnd = BinnedSeries(nhosts)
+    lost = BinnedSeries(nhosts)
+    rtt = BinnedSeries(nhosts)
+    row_of = {host: row for row, host in enumerate(hosts)}
+    for host, path in client_files(results_dir).items():
+        if host not in row_of:
+            continue
+        data = read_client_stats(path)
+        if len(data) == 0:
+            continue
+        recorded = data.dtype.names
+        rows = np.full(len(data), row_of[host])
+        bins = data["time"] // bin_us
+        client_sent.add(rows, bins, weights=_per_connection_deltas(data, "sent"))
+        for series, field in (
+            (client_udp_tx, "udp_tx"),
+            (client_intended, "intended_sent"),
+            (streams_blocked, "tx_streams_blocked_uni"),
+        ):
+            if field in recorded:
+                series.add(rows, bins, weights=_per_connection_deltas(data, field))
+        conn0 = data["connection_id"] == 0
+        rows, bins = rows[conn0], bins[conn0]
+        conn0_samples.add(rows, bins)
+        for series, field in ((cwnd, "congestion_window"), (lost, "lost_packets"), (rtt, "rtt_us")):
+            if field in recorded:
+                series.add(rows, bins, weights=data[field][conn0].astype(np.float64))
+
+    filled = [s for s in (server_count, client_sent) if s.first_bin is not None]
+    if not filled:
+        raise FileNotFoundError(f"no server or client records in {results_dir}")
+    first_bin = min(s.first_bin for s in filled)
+    last_bin = max(s.first_bin + s.values.shape[1] - 1 for s in filled)
+    nbins = last_bin - first_bin + 1
+    per_second = 1e6 / bin_us
+
+    server = server_count.on_grid(first_bin, nbins) * per_second
+    samples = conn0_samples.on_grid(first_bin, nbins)
+    client_tps = client_sent.on_grid(first_bin, nbins) * per_second
+    intended_tps = client_intended.on_grid(first_bin, nbins) * per_second
+    with np.errstate(invalid="ignore", divide="ignore"):
+        timeline = {
+            "hosts": np.array(hosts),
+            "start_us": np.int64(first_bin * bin_us),
+            "bin_us": np.int64(bin_us),
+            "time": np.arange(nbins) * bin_us / 1e6,
+            "server_tps": server[:nhosts],
+            "unknown_tps": server[nhosts],
+            "server_total_tps": server.sum(axis=0),
+            "server_bytes": server_bytes.on_grid(first_bin, nbins)[:nhosts] * per_second,
+            "client_tps": client_tps,
+            "intended_tps": intended_tps,
+            "pacing_error": ((client_tps - intended_tps) / intended_tps).astype(np.float32),
+            "client_udp_tx": client_udp_tx.on_grid(first_bin, nbins) * per_second,
+            "cwnd": (cwnd.on_grid(first_bin, nbins) / samples).astype(np.float32),
+            "lost_packets": (lost.on_grid(first_bin, nbins) / samples).astype(np.float32),
+            "rtt_ms": (rtt.on_grid(first_bin, nbins) / samples / 1000).astype(np.float32),
+            "streams_blocked": streams_blocked.on_grid(first_bin, nbins) * per_second,
+        }
+    resources = _server_resources(results_dir, bin_us)
+    if resources:
+        samples = resources["resource_samples"].on_grid(first_bin, nbins)[0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for name in RESOURCE_RATES:
+                rate = resources[name].on_grid(first_bin, nbins)[0] * per_second
+                timeline[name] = rate / 1e6 if name == "server_cpu" else rate
+            for name, (_, scale) in RESOURCE_GAUGES.items():
+                timeline[name] = (resources[name].on_grid(first_bin, nbins)[0] / samples * scale).astype(np.float32)
+        if "thread_cpu" in resources:
+            timeline["thread_cpu"] = resources["thread_cpu"].on_grid(first_bin, nbins) * per_second / 1e6
+            timeline["thread_names"] = np.array([name.decode(errors="replace") for name in resources["thread_names"]])
+    if use_cache:
+        np.savez(cache, **timeline)
+    return timeline
@@ -5,6 +5,8 @@ from mininet.node import Host
 import os
 import fcntl
 
+from archive import archive_results
+
 def set_nonblocking(file_obj):
     fd = file_obj.fileno()  # Get the file descriptor
     flags = fcntl.fcntl(fd, fcntl.F_GETFL)  # Get current flags
@@ -92,8 +94,14 @@ def enable_l2_mode(net):
             sw.cmd(f"ovs-vsctl set Bridge {sw.name} fail_mode=standalone")
 
 
-def mk_results_dir():
+def mk_results_dir(archive_root: str | None = "archive"):
+    """Empties results/, moving the previous run into `archive_root` unless it is None.
+
+    Only the move happens here; the files are compressed in the background.
+    """
     if not os.path.exists("results"):
         os.mkdir("results")
-    else:
+    elif archive_root is None:
         subprocess.run("rm results/*", shell=True)
+    else:
+        archive_results("results", archive_root, background=True)
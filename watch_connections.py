@@ -1,102 +1,292 @@
 #!/usr/bin/env python3
+"""Keeps low-rate client connections open to a list of validators.
 
+    ./watch_connections.py --watchlist watchlist.txt --rpc-url https://api.mainnet-beta.solana.com
+
+Targets are split into shards, each shard is one client process driving all
+of its targets (--targets-file). TPU QUIC addresses come from getClusterNodes
+through a TTL cache, so a target that comes back after a validator restart is
+re-resolved. Targets that fail or end are restarted with exponential backoff,
+batched for up to --restart-batch-s so they share client processes. Every
+--maintenance-s the addresses of running targets are checked against the cache
+and the shards of targets that moved are restarted, as are shards that ran
+down to under half of --targets-per-client, so their targets get regrouped.
+Supervisor events go to watch_connections.log, client output to
+watch_clients.log, both rotated.
+"""
+
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
 import subprocess
-import requests
 import threading
-import logging
-import sys
 import time
 from pathlib import Path
 
-# ---- configuration ----
-RPC_URL = "https://api.mainnet-beta.solana.com"
-CLIENT_BIN = "./client"  # path to your client binary
-#PUBKEYS=["1KXvrkPXwkGF6NK1zyzVuJqbXfpenPVPP6hoiK9bsK3", "23U4mgK9DMCxsv2StC4y2qAptP25Xv5b2cybKCeJ1to3"]
-PUBKEYS = open("watchlist.txt").read().splitlines()
-LOG_DIR = Path("results")
-# -----------------------
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-)
-
-LOG_DIR.mkdir(exist_ok=True)
-
-def fetch_all_tpu_quic_addrs(pubkeys: list[str]) -> dict[str, str]:
-    """
-    Returns a mapping {pubkey: 'ip:port'} for TPU QUIC endpoints.
-    Resolves all pubkeys using a single getClusterNodes RPC call.
-    """
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "getClusterNodes",
-    }
-    r = requests.post(RPC_URL, json=payload, timeout=10)
-    r.raise_for_status()
-
-    # Build pubkey -> tpuQuic map from RPC response
-    nodes = {}
-    for node in r.json()["result"]:
-        pk = node.get("pubkey")
-        tpu_quic = node.get("tpuQuic")
-        if pk and tpu_quic:
-            nodes[pk] = tpu_quic
-
-    # Validate requested pubkeys
-    result = {}
-    missing = []
-    for pk in pubkeys:
-        addr = nodes.get(pk)
-        if not addr:
-            missing.append(pk)
-        else:
-            result[pk] = addr
-
-    if missing:
-        logging.warning(
-            "Missing TPU QUIC address for pubkeys: "
-            + ", ".join(missing)
-        )
-
-    return result
-
-
-
-def run_client(pubkey: str, addr:str):
-    start_time = time.time()
-    log_path = LOG_DIR / pubkey
-    logging.info("Starting client for %s -> %s", pubkey, addr)
-    args = f"{CLIENT_BIN} --target {addr} --max-bitrate-bps 10e3 --host-name {pubkey}  --num-connections 1 --tx-size 512"
-    with open(log_path, "wb") as f:
-        proc = subprocess.Popen(
-            args.split(),
-            stdout=f,
-            stderr=f,
-        )
-        rc = proc.wait()
-
-    logging.info(
-        f"Client for {pubkey} terminated with exit code {rc} after {time.time()-start_time} seconds"
+import requests
+
+# a target that ran this long before failing starts over with the shortest backoff
+STABLE_RUN_S = 300.0
+
+
+class ClusterNodes:
+    """pubkey -> TPU QUIC address from getClusterNodes, refreshed at most every `ttl` seconds."""
+
+    def __init__(self, rpc_url: str, ttl: float):
+        self.rpc_url = rpc_url
+        self.ttl = ttl
+        self.nodes: dict[str, str] = {}
+        self.fetched_at = None
+
+    def refresh(self):
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "getClusterNodes"}
+        r = requests.post(self.rpc_url, json=payload, timeout=10)
+        r.raise_for_status()
+        self.nodes = {
+            node["pubkey"]: node["tpuQuic"]
+            for node in r.json()["result"]
+            if node.get("pubkey") and node.get("tpuQuic")
+        }
+        self.fetched_at = time.monotonic()
+        logging.info("getClusterNodes: %d nodes with a TPU QUIC address", len(self.nodes))
+
+    def lookup(self, pubkeys: list[str]) -> dict[str, str]:
+        if self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl:
+            try:
+                self.refresh()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                # keep serving the stale map, try again on the next lookup
+                logging.warning("getClusterNodes failed: %s", e)
+        found = {pk: self.nodes[pk] for pk in pubkeys if pk in self.nodes}
+        missing = [pk for pk in pubkeys if pk not in found]
+        if missing:
+            logging.warning("No TPU QUIC address for %s", ", ".join(missing))
+        return found
+
+
+class Target:
+    def __init__(self, pubkey: str):
+        self.pubkey = pubkey
+        self.failures = 0
+        self.next_start = 0.0
+        self.started = None
+        self.shard = None
+        self.addr = None
+
+
+class Supervisor:
+    def __init__(self, args, pubkeys: list[str]):
+        self.args = args
+        self.cluster = ClusterNodes(args.rpc_url, args.rpc_ttl)
+        self.targets = {pk: Target(pk) for pk in pubkeys}
+        self.events = queue.Queue()
+        self.shards = {}
+        self.next_shard = 0
+        self.last_maintenance = time.monotonic()
+        self.client_log = logging.getLogger("client")
+        self.client_log.propagate = False
+        self.client_log.addHandler(rotating_handler(args.log_dir / "watch_clients.log", args))
+
+    def backoff(self, failures: int) -> float:
+        return min(self.args.backoff_min * 2 ** max(failures - 1, 0), self.args.backoff_max)
+
+    def target_ended(self, pubkey: str, shard: int, reason: str, failed: bool):
+        target = self.targets[pubkey]
+        if target.shard != shard:
+            # already restarted elsewhere
+            return
+        ran = time.monotonic() - target.started
+        if ran > STABLE_RUN_S:
+            target.failures = 0
+        target.failures += 1
+        delay = self.backoff(target.failures)
+        target.next_start = time.monotonic() + delay
+        target.shard = None
+        log = logging.warning if failed else logging.info
+        log("%s ended after %.0fs (%s), restart in %.0fs", pubkey, ran, reason, delay)
+
+    def start_due(self):
+        now = time.monotonic()
+        due = [t for t in self.targets.values() if t.shard is None and t.next_start <= now]
+        if not due:
+            return
+        # wait for a full shard's worth of restarts, or until the oldest has waited long enough
+        oldest = min(t.next_start for t in due)
+        if len(due) < self.args.targets_per_client and now - oldest < self.args.restart_batch_s:
+            return
+        due = [t.pubkey for t in due]
+        addrs = self.cluster.lookup(due)
+        for pk in due:
+            if pk not in addrs:
+                self.targets[pk].next_start = now + self.args.rpc_ttl
+        due = [pk for pk in due if pk in addrs]
+        for i in range(0, len(due), self.args.targets_per_client):
+            self.start_shard({pk: addrs[pk] for pk in due[i : i + self.args.targets_per_client]})
+
+    def maintain(self):
+        """Restarts the shards of targets whose address changed and shards that ran down."""
+        if time.monotonic() - self.last_maintenance < self.args.maintenance_s:
+            return
+        self.last_maintenance = time.monotonic()
+        running = [t for t in self.targets.values() if t.shard is not None]
+        if not running:
+            return
+        addrs = self.cluster.lookup([t.pubkey for t in running])
+        moved = {t.shard for t in running if t.pubkey in addrs and addrs[t.pubkey] != t.addr}
+        for shard in moved:
+            self.retire_shard(shard, "a target moved")
+        sizes = {}
+        for t in self.targets.values():
+            if t.shard is not None:
+                sizes[t.shard] = sizes.get(t.shard, 0) + 1
+        small = [shard for shard, size in sizes.items() if size < self.args.targets_per_client / 2]
+        if len(small) > 1:
+            for shard in small:
+                self.retire_shard(shard, "regrouping small shards")
+
+    def retire_shard(self, shard: int, reason: str):
+        """Stops a shard's client; its targets are due again at once, without counting a failure."""
+        proc, _ = self.shards[shard]
+        restarted = [t for t in self.targets.values() if t.shard == shard]
+        for target in restarted:
+            target.shard, target.next_start = None, 0.0
+        logging.info("shard %d: restarting its %d targets (%s)", shard, len(restarted), reason)
+        # its exit event removes it from self.shards
+        proc.terminate()
+
+    def start_shard(self, addrs: dict[str, str]):
+        shard = self.next_shard
+        self.next_shard += 1
+        targets_file = self.args.log_dir / f"targets-{shard}.txt"
+        targets_file.write_text("".join(f"{pk} {addr}\n" for pk, addr in addrs.items()))
+        cmd = [
+            self.args.client_bin,
+            "--targets-file", str(targets_file),
+            "--max-bitrate-bps", str(self.args.max_bitrate_bps),
+            "--num-connections", "1",
+            "--tx-size", str(self.args.tx_size),
+        ]
+        try:
+            proc = subprocess.Popen(
+                cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.args.workdir
+            )
+        except OSError as e:
+            logging.error("cannot start %s: %s", self.args.client_bin, e)
+            for pk in addrs:
+                target = self.targets[pk]
+                target.failures += 1
+                target.next_start = time.monotonic() + self.backoff(target.failures)
+            return
+        self.shards[shard] = (proc, targets_file)
+        for pk, addr in addrs.items():
+            target = self.targets[pk]
+            target.shard, target.started, target.addr = shard, time.monotonic(), addr
+        logging.info("shard %d (pid %d): %d targets", shard, proc.pid, len(addrs))
+        threading.Thread(target=self.read_stdout, args=(shard, proc), daemon=True).start()
+        threading.Thread(target=self.read_stderr, args=(shard, proc), daemon=True).start()
+
+    def read_stdout(self, shard: int, proc: subprocess.Popen):
+        for line in proc.stdout:  # pyright:ignore
+            self.client_log.info("[%d] %s", shard, line.rstrip())
+            fields = line.split(maxsplit=2)
+            if len(fields) >= 2 and fields[0] in ("TARGET_DONE", "TARGET_FAILED"):
+                failed = fields[0] == "TARGET_FAILED"
+                self.events.put(("target", shard, fields[1], failed, line.strip()))
+        self.events.put(("exit", shard, proc.wait()))
+
+    def read_stderr(self, shard: int, proc: subprocess.Popen):
+        for line in proc.stderr:  # pyright:ignore
+            self.client_log.info("[%d] %s", shard, line.rstrip())
+
+    def handle(self, event):
+        if event[0] == "target":
+            _, shard, pubkey, failed, line = event
+            if pubkey in self.targets:
+                self.target_ended(pubkey, shard, line, failed)
+            return
+        _, shard, code = event
+        _, targets_file = self.shards.pop(shard)
+        targets_file.unlink(missing_ok=True)
+        for target in self.targets.values():
+            if target.shard == shard:
+                self.target_ended(target.pubkey, shard, f"client exited with {code}", failed=True)
+
+    def run(self):
+        while True:
+            self.maintain()
+            self.start_due()
+            try:
+                self.handle(self.events.get(timeout=1.0))
+                while True:
+                    self.handle(self.events.get_nowait())
+            except queue.Empty:
+                pass
+
+    def stop(self):
+        for proc, _ in self.shards.values():
+            proc.terminate()
+        for proc, targets_file in self.shards.values():
+            proc.wait()
+            targets_file.unlink(missing_ok=True)
+
+
+def rotating_handler(path: Path, args) -> logging.Handler:
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=args.log_max_mb * 1024 * 1024, backupCount=args.log_backups
     )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    return handler
 
 
 def main():
-    threads = []
-    tpu_addrs = fetch_all_tpu_quic_addrs(PUBKEYS)
+    parser = argparse.ArgumentParser(
+        prog="watch_connections",
+        description="keep client connections open to a list of validators",
+    )
+    parser.add_argument("--watchlist", type=str, default="watchlist.txt", help="validator pubkeys, one per line")
+    parser.add_argument("--rpc-url", type=str, default="https://api.mainnet-beta.solana.com")
+    parser.add_argument("--rpc-ttl", type=float, default=60.0, help="seconds a getClusterNodes answer is reused")
+    parser.add_argument("--client-bin", type=str, default="./client", help="path to the client binary")
+    parser.add_argument("--targets-per-client", type=int, default=64, help="targets driven by one client process")
+    parser.add_argument(
+        "--restart-batch-s", type=float, default=10.0, help="longest a due restart waits for others to share a client"
+    )
+    parser.add_argument(
+        "--maintenance-s",
+        type=float,
+        default=300.0,
+        help="how often running targets are re-resolved and small shards regrouped",
+    )
+    parser.add_argument("--max-bitrate-bps", type=float, default=10e3, help="per target")
+    parser.add_argument("--tx-size", type=int, default=512)
+    parser.add_argument("--backoff-min", type=float, default=1.0, help="first restart delay, doubles per failure")
+    parser.add_argument("--backoff-max", type=float, default=300.0)
+    parser.add_argument("--workdir", type=str, default=".", help="clients write their results/ here")
+    parser.add_argument("--log-dir", type=Path, default=Path("results"))
+    parser.add_argument("--log-max-mb", type=int, default=50)
+    parser.add_argument("--log-backups", type=int, default=5)
+    args = parser.parse_args()
 
-    for pk, addr  in tpu_addrs.items():
-        t = threading.Thread(target=run_client, args=(pk,addr), daemon=True)
-        t.start()
-        threads.append(t)
+    args.log_dir.mkdir(exist_ok=True)
+    os.makedirs(os.path.join(args.workdir, "results"), exist_ok=True)
+    args.client_bin = os.path.abspath(args.client_bin)
+    args.log_dir = args.log_dir.absolute()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        handlers=[logging.StreamHandler(), rotating_handler(args.log_dir / "watch_connections.log", args)],
+    )
 
-    for t in threads:
-        t.join()
+    pubkeys = [line.strip() for line in open(args.watchlist) if line.strip()]
+    supervisor = Supervisor(args, pubkeys)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logging.info("stopping %d client processes", len(supervisor.shards))
+        supervisor.stop()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 1:
-        print("No arguments expected; configure script constants instead", file=sys.stderr)
-        sys.exit(1)
     main()